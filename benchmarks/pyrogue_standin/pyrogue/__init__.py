@@ -0,0 +1,85 @@
+# A lightweight stand-in for pyrogue, for running the benchmarks offline
+#
+# It only mimics the part of the pyrogue node API that the converter relies on: the node tree, and the attributes of
+# devices, remote variables and commands. Nothing here touches hardware, and there is no C++ extension to import.
+
+from collections import OrderedDict
+
+
+class Node(object):
+    """
+    A named node of the device tree.
+    """
+    def __init__(self, name, description="", offset=0):
+        self.name = name
+        self.description = description
+        self.offset = offset
+        self._nodes = OrderedDict()
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    def add(self, node):
+        if isinstance(node, (list, tuple)):
+            for n in node:
+                self.add(n)
+        else:
+            self._nodes[node.name] = node
+
+    def getNodes(self, typ, excTyp=None):
+        return OrderedDict((k, n) for k, n in self._nodes.items()
+                           if isinstance(n, typ) and (excTyp is None or not isinstance(n, excTyp)))
+
+    @property
+    def devices(self):
+        return self.getNodes(Device)
+
+    @property
+    def variables(self):
+        return self.getNodes(BaseVariable, excTyp=BaseCommand)
+
+    @property
+    def commands(self):
+        return self.getNodes(BaseCommand)
+
+
+class BaseVariable(Node):
+    def __init__(self, name, description="", offset=0, mode="RW", **kwargs):
+        Node.__init__(self, name, description, offset)
+        self.mode = mode
+
+
+class LocalVariable(BaseVariable):
+    pass
+
+
+class RemoteVariable(BaseVariable):
+    def __init__(self, name, description="", offset=0, bitSize=32, bitOffset=0, mode="RW", **kwargs):
+        BaseVariable.__init__(self, name, description, offset, mode)
+        self.bitSize = [bitSize]
+        self.bitOffset = [bitOffset]
+        self.varBytes = (bitSize + bitOffset + 7) // 8
+
+
+class BaseCommand(BaseVariable):
+    pass
+
+
+class LocalCommand(BaseCommand):
+    def __init__(self, name, description="", function=None, **kwargs):
+        BaseCommand.__init__(self, name, description, mode="WO")
+
+
+class RemoteCommand(BaseCommand, RemoteVariable):
+    def __init__(self, name, description="", offset=0, bitSize=1, bitOffset=0, function=None, **kwargs):
+        RemoteVariable.__init__(self, name, description, offset, bitSize, bitOffset, mode="WO")
+
+
+class Device(Node):
+    def __init__(self, name=None, description="", offset=0, memBase=None, **kwargs):
+        Node.__init__(self, name or type(self).__name__, description, offset)
+
+    def addRemoteVariables(self, number, stride, name, offset=0, **kwargs):
+        for i in range(number):
+            self.add(RemoteVariable(name="{0}[{1}]".format(name, i), offset=offset + i * stride, **kwargs))
@@ -0,0 +1,253 @@
+# Benchmark the converter against synthetic Rogue devices, offline
+#
+# The benchmarks use the pyrogue stand-in in benchmarks/pyrogue_standin, so that they need neither a rogue install nor
+# any firmware checkout.
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+STANDIN_DIR = os.path.join(BENCHMARK_DIR, "pyrogue_standin")
+DEFAULT_BASELINE_FILENAME = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+sys.path.insert(0, STANDIN_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from synthetic_devices import SyntheticDeviceSpec  # noqa: E402
+
+# The register counts of the device to serialize and export, to measure how the converter scales
+REGISTER_COUNTS = (100, 1000, 5000)
+
+# The number of files of the synthetic firmware tree to run the launcher on
+LAUNCHER_FILE_COUNTS = (4, 16)
+
+# A benchmark regresses if it is this many times slower than its baseline
+DEFAULT_TIME_TOLERANCE = 2.0
+
+# A benchmark regresses if its scaling exponent grows by more than this, e.g. from linear to n log n or quadratic
+DEFAULT_SCALING_TOLERANCE = 0.25
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the rogue2yaml benchmarks against synthetic devices.")
+    parser.add_argument("--output", help="Save the results into this JSON file.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILENAME,
+                        help="Compare the results against this JSON file (default: benchmarks/baseline.json).")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline instead of comparing against it.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="The number of runs of each measurement. The fastest run is kept (default: 3).")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE,
+                        help="Report a regression if a measurement is this many times slower than its baseline "
+                             "(default: {0}).".format(DEFAULT_TIME_TOLERANCE))
+    parser.add_argument("--scaling-tolerance", type=float, default=DEFAULT_SCALING_TOLERANCE,
+                        help="Report a regression if a scaling exponent grows by more than this (default: {0})."
+                        .format(DEFAULT_SCALING_TOLERANCE))
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="rogue2yaml_bench_")
+    try:
+        results = run_benchmarks(work_dir, args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    _print_results(results)
+
+    if args.output:
+        _save(results, args.output)
+    if args.save_baseline:
+        _save(results, args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found at '{0}'. Use --save-baseline to create one.".format(args.baseline))
+        return 0
+
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.time_tolerance, args.scaling_tolerance)
+    if regressions:
+        print("\nRegressions against '{0}':".format(args.baseline))
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+    print("\nNo regressions against '{0}'.".format(args.baseline))
+    return 0
+
+
+def run_benchmarks(work_dir, repeat):
+    """
+    Run all the benchmarks.
+
+    Parameters
+    ----------
+    work_dir : str
+        A scratch directory
+    repeat : int
+        The number of runs of each measurement
+
+    Returns
+    -------
+    The results, with the timings in seconds : dict
+    """
+    from rogue2yaml.yaml_converter import YamlConverter
+
+    benchmarks = {"serialize": {}, "export": {}, "launcher": {}}
+    for register_count in REGISTER_COUNTS:
+        spec = SyntheticDeviceSpec(name="SynthR{0}".format(register_count), register_count=register_count,
+                                   array_count=register_count // 50, array_size=8, command_count=register_count // 10)
+        converter = YamlConverter(spec.build_device(os.path.join(work_dir, spec.name)))
+
+        benchmarks["serialize"][str(register_count)] = _time(converter._serialize_rogue_data, repeat)
+        benchmarks["export"][str(register_count)] = _time(
+            lambda: converter._export_to_yaml(spec.name + ".yaml", work_dir), repeat)
+
+    for file_count in LAUNCHER_FILE_COUNTS:
+        benchmarks["launcher"][str(file_count)] = _time(lambda: _run_launcher(work_dir, file_count), repeat)
+
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "benchmarks": benchmarks,
+        "scaling": dict((name, _get_scaling_exponent(timings)) for name, timings in benchmarks.items()),
+    }
+
+
+def compare(results, baseline, time_tolerance=DEFAULT_TIME_TOLERANCE, scaling_tolerance=DEFAULT_SCALING_TOLERANCE):
+    """
+    Compare benchmark results against a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        The benchmark results
+    baseline : dict
+        The baseline benchmark results
+    time_tolerance : float
+        The slowdown ratio beyond which a measurement regresses
+    scaling_tolerance : float
+        The scaling exponent increase beyond which a benchmark regresses
+
+    Returns
+    -------
+    The descriptions of the regressions : list
+    """
+    regressions = []
+    for name, timings in sorted(results["benchmarks"].items()):
+        baseline_timings = baseline.get("benchmarks", {}).get(name, {})
+        for size, seconds in sorted(timings.items(), key=lambda item: int(item[0])):
+            baseline_seconds = baseline_timings.get(size)
+            if baseline_seconds and seconds > baseline_seconds * time_tolerance:
+                regressions.append("{0}[{1}]: {2:.4f}s vs. {3:.4f}s in the baseline"
+                                   .format(name, size, seconds, baseline_seconds))
+
+        scaling = results["scaling"].get(name)
+        baseline_scaling = baseline.get("scaling", {}).get(name)
+        if scaling is not None and baseline_scaling is not None and scaling > baseline_scaling + scaling_tolerance:
+            regressions.append("{0}: scales as n^{1:.2f} vs. n^{2:.2f} in the baseline"
+                               .format(name, scaling, baseline_scaling))
+    return regressions
+
+
+def _run_launcher(work_dir, file_count):
+    """
+    Run the launcher end-to-end, in a fresh process, on a synthetic firmware tree.
+
+    Parameters
+    ----------
+    work_dir : str
+        A scratch directory
+    file_count : int
+        The number of files to convert
+    """
+    run_dir = os.path.join(work_dir, "launcher{0}".format(file_count))
+    shutil.rmtree(run_dir, ignore_errors=True)
+    source_dir = os.path.join(run_dir, "firmware")
+
+    for i in range(file_count // 2):
+        spec = SyntheticDeviceSpec(name="SynthF{0}".format(i), register_count=200, array_count=4, array_size=8,
+                                   command_count=20, depth=2, package="module{0}".format(i))
+        spec.write_sources(source_dir)
+
+    shutil.copytree(os.path.join(REPO_DIR, "settings"), os.path.join(run_dir, "settings"))
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([REPO_DIR, STANDIN_DIR, environment.get("PYTHONPATH", "")])
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, "-m", "rogue2yaml_launcher.main", STANDIN_DIR, source_dir, "output"],
+                              cwd=run_dir, env=environment, stdout=devnull, stderr=devnull)
+
+
+def _time(function, repeat):
+    """
+    Time a function.
+
+    Parameters
+    ----------
+    function : callable
+        The function to time
+    repeat : int
+        The number of runs
+
+    Returns
+    -------
+    The duration of the fastest run, in seconds : float
+    """
+    durations = []
+    for _ in range(max(1, repeat)):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+def _get_scaling_exponent(timings):
+    """
+    Estimate how a benchmark scales with its size, i.e. k for a time proportional to n^k, from its smallest and largest
+    sizes.
+
+    Parameters
+    ----------
+    timings : dict
+        The timings, keyed by size
+
+    Returns
+    -------
+    The scaling exponent, or None if it cannot be estimated : float
+    """
+    sizes = sorted(int(size) for size in timings)
+    if len(sizes) < 2:
+        return None
+    smallest, largest = timings[str(sizes[0])], timings[str(sizes[-1])]
+    if smallest <= 0 or largest <= 0:
+        return None
+    return math.log(largest / smallest) / math.log(float(sizes[-1]) / sizes[0])
+
+
+def _print_results(results):
+    for name, timings in sorted(results["benchmarks"].items()):
+        print("{0}:".format(name))
+        for size, seconds in sorted(timings.items(), key=lambda item: int(item[0])):
+            print("  {0:>8}  {1:.4f}s".format(size, seconds))
+        if results["scaling"].get(name) is not None:
+            print("  scales as n^{0:.2f}".format(results["scaling"][name]))
+
+
+def _save(results, filename):
+    with open(filename, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+        results_file.write('\n')
+    print("\nResults saved to '{0}'.".format(filename))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# Generate synthetic Rogue device files for the benchmarks
+
+import os
+import sys
+import importlib
+
+
+class SyntheticDeviceSpec:
+    """
+    The shape of a synthetic Rogue device hierarchy.
+
+    Each level of the hierarchy is a device class in its own file. A device has plain registers, register arrays and
+    commands, plus an array of devices of the next level, down to the requested depth.
+    """
+    def __init__(self, name="Synth", register_count=100, array_count=4, array_size=8, command_count=10, depth=1,
+                 fanout=2, package=None):
+        """
+        Parameters
+        ----------
+        name : str
+            The prefix of the generated class names
+        register_count : int
+            The number of plain registers per device
+        array_count : int
+            The number of register arrays per device
+        array_size : int
+            The number of elements per register array
+        command_count : int
+            The number of commands per device
+        depth : int
+            The number of levels of the device hierarchy
+        fanout : int
+            The number of child devices per device, except for the deepest level
+        package : str
+            If given, the files are written into a Python package of this name, like in a firmware checkout, and import
+            each other through it
+        """
+        self.name = name
+        self.register_count = register_count
+        self.array_count = array_count
+        self.array_size = array_size
+        self.command_count = command_count
+        self.depth = max(1, depth)
+        self.fanout = fanout
+        self.package = package
+
+    @property
+    def class_names(self):
+        return ["{0}L{1}".format(self.name, level) for level in range(self.depth)]
+
+    @property
+    def top_class_name(self):
+        return self.class_names[0]
+
+    def generate_sources(self):
+        """
+        Generate the Rogue Python source of every level.
+
+        Returns
+        -------
+        The source of each file, keyed by the file name : dict
+        """
+        sources = {}
+        class_names = self.class_names
+        for level, class_name in enumerate(class_names):
+            lines = ["import pyrogue as pr"]
+            child_class_name = class_names[level + 1] if level + 1 < len(class_names) else None
+            if child_class_name:
+                if self.package:
+                    lines.append("from {0}._{1} import {1}".format(self.package, child_class_name))
+                else:
+                    lines.append("from _{0} import {0}".format(child_class_name))
+
+            lines += ["",
+                      "",
+                      "class {0}(pr.Device):".format(class_name),
+                      "    def __init__(self, name=\"{0}\", description=\"Synthetic level {1}\", **kwargs):"
+                      .format(class_name, level),
+                      "        super({0}, self).__init__(name=name, description=description, **kwargs)"
+                      .format(class_name)]
+
+            offset = 0
+            for i in range(self.register_count):
+                lines.append("        self.add(pr.RemoteVariable(name=\"Reg{0}\", description=\"Register {0}\", "
+                             "offset={1}, bitSize={2}, bitOffset={3}, mode=\"{4}\"))"
+                             .format(i, hex(offset), 32 if i % 3 else 16, 0 if i % 3 else 8, "RW" if i % 2 else "RO"))
+                offset += 4
+            for i in range(self.array_count):
+                lines.append("        self.addRemoteVariables(number={0}, stride=4, name=\"Array{1}\", "
+                             "description=\"Array {1}\", offset={2}, bitSize=32, mode=\"RW\")"
+                             .format(self.array_size, i, hex(offset)))
+                offset += 4 * self.array_size
+            for i in range(self.command_count):
+                if i % 2:
+                    lines.append("        self.add(pr.LocalCommand(name=\"Cmd{0}\", description=\"Command {0}\"))"
+                                 .format(i))
+                else:
+                    lines.append("        self.add(pr.RemoteCommand(name=\"Cmd{0}\", description=\"Command {0}\", "
+                                 "offset={1}, bitSize=1))".format(i, hex(offset)))
+                    offset += 4
+            if child_class_name:
+                child_size = 1 << max(12, offset.bit_length())
+                for i in range(self.fanout):
+                    lines.append("        self.add({0}(name=\"Child[{1}]\", offset={2}))"
+                                 .format(child_class_name, i, hex(child_size * (i + 1))))
+
+            sources["_{0}.py".format(class_name)] = '\n'.join(lines) + '\n'
+        return sources
+
+    def write_sources(self, directory):
+        """
+        Write the Rogue Python files of every level.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to write the files, or their package, into
+
+        Returns
+        -------
+        The paths of the written files : list
+        """
+        if self.package:
+            directory = os.path.join(directory, self.package)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if self.package:
+            open(os.path.join(directory, "__init__.py"), 'w').close()
+
+        paths = []
+        for filename, source in sorted(self.generate_sources().items()):
+            path = os.path.join(directory, filename)
+            with open(path, 'w') as source_file:
+                source_file.write(source)
+            paths.append(path)
+        return paths
+
+    def build_device(self, directory):
+        """
+        Write the Rogue Python files, and instantiate the top-level device.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to write the files into
+
+        Returns
+        -------
+        The top-level device : pyrogue.Device
+        """
+        self.write_sources(directory)
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        prefix = self.package + '.' if self.package else ''
+        for class_name in self.class_names:
+            sys.modules.pop(prefix + '_' + class_name, None)
+        importlib.invalidate_caches()
+
+        module = importlib.import_module(prefix + '_' + self.top_class_name)
+        return getattr(module, self.top_class_name)()
@@ -0,0 +1,221 @@
+# Flatten a device model into a sorted table of absolute register addresses
+
+import struct
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from io import StringIO
+
+# The register modes, as stored in the binary address map
+MODES = ("RO", "RW", "WO")
+UNKNOWN_MODE = 255
+
+# The binary address map starts with the magic bytes and the number of entries, followed by the entries sorted by
+# address, followed by the UTF-8 encoded paths the entries point to
+BINARY_MAGIC = b"R2YAMAP1"
+BINARY_HEADER = struct.Struct("<8sI")
+
+# address, size in bits, path offset, path length, lsBit, mode
+BINARY_ENTRY = struct.Struct("<QIIHBB")
+
+CSV_HEADER = "path,address,size_bits,ls_bit,mode\n"
+
+
+AddressMapEntry = namedtuple("AddressMapEntry", ["address", "path", "size_bits", "ls_bit", "mode"])
+
+
+def build_address_map(device_model, base_address=0):
+    """
+    Flatten a device model into the absolute addresses of all the registers of its hierarchy. The arrays of registers
+    and of devices are expanded into one entry per element.
+
+    Parameters
+    ----------
+    device_model : dict
+        The device model, as built by YamlConverter.build_model()
+    base_address : int
+        The address of the device
+
+    Returns : list
+    -------
+        The address map entries, sorted by address, then by path
+    """
+    entries = []
+    for device in device_model.values():
+        _add_children(device, base_address, '', entries)
+    entries.sort()
+    return entries
+
+
+def render_csv(entries):
+    """
+    Render an address map as CSV.
+
+    Parameters
+    ----------
+    entries : list
+        The address map entries
+
+    Returns : str
+    -------
+        The CSV contents
+    """
+    csv_file = StringIO()
+    csv_file.write(CSV_HEADER)
+    for entry in entries:
+        csv_file.write("{0},{1},{2},{3},{4}\n".format(entry.path, hex(entry.address), entry.size_bits, entry.ls_bit,
+                                                      entry.mode))
+    return csv_file.getvalue()
+
+
+def render_binary(entries):
+    """
+    Render an address map into its binary form, which can be searched by bisection without parsing it all.
+
+    Parameters
+    ----------
+    entries : list
+        The address map entries, sorted by address
+
+    Returns : bytes
+    -------
+        The binary contents
+    """
+    records = bytearray()
+    paths = bytearray()
+    for entry in entries:
+        path = entry.path.encode("utf-8")
+        mode = MODES.index(entry.mode) if entry.mode in MODES else UNKNOWN_MODE
+        records += BINARY_ENTRY.pack(entry.address, entry.size_bits, len(paths), len(path), entry.ls_bit, mode)
+        paths += path
+    return BINARY_HEADER.pack(BINARY_MAGIC, len(entries)) + bytes(records) + bytes(paths)
+
+
+class AddressMap:
+    """
+    Reverse-map absolute addresses to register paths, using a binary address map.
+    """
+    def __init__(self, contents):
+        """
+        Initialize the address map.
+
+        Parameters
+        ----------
+        contents : bytes
+            The binary address map, as rendered by render_binary()
+        """
+        magic, count = BINARY_HEADER.unpack_from(contents, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError("Not a binary address map.")
+
+        self._contents = contents
+        self._count = count
+        self._paths_offset = BINARY_HEADER.size + count * BINARY_ENTRY.size
+
+        # Only the addresses are unpacked up front, to bisect them
+        self._addresses = array('Q', (BINARY_ENTRY.unpack_from(contents, BINARY_HEADER.size + i * BINARY_ENTRY.size)[0]
+                                      for i in range(count)))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a binary address map file.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the binary address map file
+
+        Returns : AddressMap
+        -------
+            The address map
+        """
+        with open(filename, 'rb') as address_map_file:
+            return cls(address_map_file.read())
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        address, size_bits, path_offset, path_length, ls_bit, mode = BINARY_ENTRY.unpack_from(
+            self._contents, BINARY_HEADER.size + index * BINARY_ENTRY.size)
+        path_start = self._paths_offset + path_offset
+        path = bytes(self._contents[path_start:path_start + path_length]).decode("utf-8")
+        return AddressMapEntry(address, path, size_bits, ls_bit, MODES[mode] if mode < len(MODES) else '')
+
+    def lookup(self, address):
+        """
+        Find the registers at an address.
+
+        Parameters
+        ----------
+        address : int
+            The absolute address
+
+        Returns : list
+        -------
+            The entries of the registers that start at the closest address at or below the given address, and span the
+            given address. Several registers can share an address, e.g. bit fields.
+        """
+        index = bisect_right(self._addresses, address) - 1
+        if index < 0:
+            return []
+
+        start_address = self._addresses[index]
+        while index > 0 and self._addresses[index - 1] == start_address:
+            index -= 1
+
+        entries = []
+        while index < self._count and self._addresses[index] == start_address:
+            entry = self[index]
+            if address < entry.address + max(1, (entry.ls_bit + entry.size_bits + 7) // 8):
+                entries.append(entry)
+            index += 1
+        return entries
+
+
+def _add_children(device, base_address, prefix, entries):
+    """
+    Add the registers of a device, and of its child devices, to an address map.
+
+    Parameters
+    ----------
+    device : dict
+        The device model
+    base_address : int
+        The absolute address of the device
+    prefix : str
+        The path of the device
+    entries : list
+        The address map entries to add to
+    """
+    for name, child in device.get("children", {}).items():
+        at = child.get("at", {})
+        if "offset" not in at:
+            continue
+        element_count = at.get("nelms", 1)
+        if not isinstance(element_count, int):
+            element_count = 1
+
+        is_device = "children" in child
+        is_register = not is_device and "sizeBits" in child
+        if not is_device and not is_register:
+            # e.g. commands
+            continue
+
+        if is_device:
+            default_stride = child.get("size", 0)
+        else:
+            default_stride = (child.get("lsBit", 0) + child["sizeBits"] + 7) // 8
+        stride = at.get("stride", default_stride)
+
+        for i in range(element_count):
+            path = ''.join([prefix, name, "[{0}]".format(i) if element_count > 1 else ''])
+            address = base_address + at["offset"] + i * stride
+            if is_device:
+                _add_children(child, address, path + '.', entries)
+            else:
+                entries.append(AddressMapEntry(address, path, child["sizeBits"], child.get("lsBit", 0),
+                                               child.get("mode", '')))
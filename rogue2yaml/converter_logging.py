@@ -1,18 +1,200 @@
 import os
+import sys
+import errno
+import queue
+import atexit
+import threading
 import logging
+import logging.handlers
+from contextlib import contextmanager
 
 try:
     os.makedirs("logs")
 except os.error as err:
     # It's OK if the log directory exists. This is to be compatible with Python 2.7
-    if err.errno != os.errno.EEXIST:
+    if err.errno != errno.EEXIST:
         raise err
 
-logging.basicConfig(level=logging.INFO, filename="logs/rogue2yaml.log",
-                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+LOG_FILENAME = "logs/rogue2yaml.log"
+FILE_FORMAT = "%(asctime)s - %(processName)s - %(rogue_file)s - %(name)s - %(levelname)s - %(message)s"
+
+# The records are only queued by the logging calls. A single listener thread formats and writes them, to the log file
+# and to the console, so that the conversions never wait on the I/O, and the records of the launcher and of the worker
+# processes do not interleave within the log file.
+_record_queue = queue.Queue(-1)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Tag each record with the Rogue Python file being converted by its thread, if any.
+    """
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    @property
+    def rogue_file(self):
+        return getattr(self._local, "rogue_file", '-')
+
+    @rogue_file.setter
+    def rogue_file(self, rogue_file):
+        self._local.rogue_file = rogue_file
+
+    def filter(self, record):
+        if not hasattr(record, "rogue_file"):
+            record.rogue_file = self.rogue_file
+        return True
+
+
+_context_filter = _ContextFilter()
+
+
+def _create_file_handler(max_bytes=0, backup_count=0):
+    if max_bytes:
+        file_handler = logging.handlers.RotatingFileHandler(LOG_FILENAME, maxBytes=max_bytes,
+                                                            backupCount=backup_count, delay=True)
+    else:
+        file_handler = logging.FileHandler(LOG_FILENAME, delay=True)
+    file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+    return file_handler
+
+
+def _create_queue_handler(record_queue):
+    queue_handler = logging.handlers.QueueHandler(record_queue)
+    queue_handler.addFilter(_context_filter)
+    return queue_handler
+
 
 # Override the basic configs for cleaner console output
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG)
 console_handler.setFormatter(logging.Formatter("%(message)s"))
-logger = logging.getLogger('').addHandler(console_handler)
+
+_listener = logging.handlers.QueueListener(_record_queue, _create_file_handler(), console_handler,
+                                           respect_handler_level=True)
+_listener.start()
+
+_root_logger = logging.getLogger('')
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(_create_queue_handler(_record_queue))
+
+
+def _stop_listener():
+    # Write out the records still queued on exit
+    _listener.stop()
+
+
+atexit.register(_stop_listener)
+
+# The queue the worker processes send their records to, and the thread forwarding them to the listener, if started
+_process_queue = None
+_process_listener = None
+
+
+def configure_logging(level=None, max_bytes=0, backup_count=0):
+    """
+    Configure the logging of the launcher.
+
+    Parameters
+    ----------
+    level : int
+        If provided, the level of the records to log. The records below it are discarded by the logging calls, before
+        being queued.
+    max_bytes : int
+        If not 0, the size, in bytes, beyond which the log file is rotated
+    backup_count : int
+        The number of rotated log files to keep
+    """
+    if level is not None:
+        _root_logger.setLevel(level)
+
+    global _listener
+    _listener.stop()
+    for handler in _listener.handlers:
+        if handler is not console_handler:
+            handler.close()
+    _listener = logging.handlers.QueueListener(_record_queue, _create_file_handler(max_bytes, backup_count),
+                                               console_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def get_process_queue(context):
+    """
+    Get the queue the worker processes send their records to, starting the thread forwarding them to the listener if
+    needed.
+
+    Parameters
+    ----------
+    context : multiprocessing.context.BaseContext
+        The multiprocessing context of the worker processes
+
+    Returns
+    -------
+    The queue, to pass to configure_worker_logging() in the worker processes : multiprocessing.Queue
+    """
+    global _process_queue, _process_listener
+    if _process_queue is None:
+        _process_queue = context.Queue(-1)
+        # The records are already tagged and formatted by the workers
+        _process_listener = logging.handlers.QueueListener(_process_queue, _ForwardingHandler(_record_queue))
+        _process_listener.start()
+        atexit.register(_stop_process_listener)
+    return _process_queue
+
+
+def configure_worker_logging(process_queue, level):
+    """
+    Send the records of this worker process to the launcher, which writes them.
+
+    Parameters
+    ----------
+    process_queue : multiprocessing.Queue
+        The queue returned by get_process_queue() in the launcher
+    level : int
+        The level of the records to log
+    """
+    for handler in list(_root_logger.handlers):
+        _root_logger.removeHandler(handler)
+    _root_logger.addHandler(_create_queue_handler(process_queue))
+    _root_logger.setLevel(level)
+
+
+@contextmanager
+def log_context(rogue_file):
+    """
+    Tag the records logged by this thread within the context with the Rogue Python file being converted.
+
+    Parameters
+    ----------
+    rogue_file : str
+        The name of the Rogue Python file
+    """
+    previous_rogue_file = _context_filter.rogue_file
+    _context_filter.rogue_file = rogue_file
+    try:
+        yield
+    finally:
+        _context_filter.rogue_file = previous_rogue_file
+
+
+def _stop_process_listener():
+    if _process_listener is not None:
+        try:
+            _process_listener.stop()
+        except (OSError, ValueError, EOFError):
+            # At exit, the listener writing the log records may already be stopped, so that the error cannot be logged
+            sys.stderr.write("Cannot receive the last log records of the worker processes.\n")
+
+
+class _ForwardingHandler(logging.Handler):
+    """
+    Forward the records received from the worker processes to the listener of the launcher.
+    """
+    def __init__(self, record_queue):
+        super().__init__()
+        self._record_queue = record_queue
+
+    def handle(self, record):
+        # The level and the filters have already been applied by the worker
+        self._record_queue.put_nowait(record)
+        return True
@@ -0,0 +1,121 @@
+# Dispatch the child nodes of a Rogue device to the handlers serializing them, by the class of each node
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class NodeHandler(ABC):
+    """
+    Serialize the child nodes of a Rogue device dispatched to this handler, e.g. its remote variables.
+
+    The nodes are serialized together, once all the children of the device have been dispatched, so that a handler
+    sees the elements of an array one after the other. A handler must implement serialize() to be instantiated.
+    """
+    @abstractmethod
+    def serialize(self, converter, nodes, replica_count):
+        """
+        Serialize the nodes into the children of the converted device.
+
+        Parameters
+        ----------
+        converter : YamlConverter
+            The converter of the device, to add the serialized children to with add_child()
+        nodes : OrderedDict
+            The nodes dispatched to this handler, keyed by their names, in the order of the device
+        replica_count : int
+            The number of buffers of the device, or 0 if it is not replicated
+        """
+
+
+class NodeHandlerRegistry:
+    """
+    The handlers of each class of node.
+
+    The handlers of a node are those of the first class of its MRO with registered handlers, so that the subclasses of
+    a class share its handlers unless registered themselves. The registry is only read while dispatching, so that it
+    can be shared by concurrent conversions; each conversion caches the resolution per class, so that dispatching a
+    node is a single lookup.
+    """
+    def __init__(self):
+        """
+        Initialize an empty registry.
+        """
+        self._handlers = OrderedDict()
+        # Every registered handler, in the order its nodes are serialized
+        self._ordered_handlers = []
+
+    def register(self, node_class, *handlers):
+        """
+        Register the handlers of a class of node, and of its subclasses, replacing those it inherits.
+
+        The nodes of the different handlers are serialized in the order the handlers have first been registered, e.g.
+        the remote variables, the devices, and then the commands. The handlers must be registered before the
+        conversions using the registry start.
+
+        Parameters
+        ----------
+        node_class : type
+            The class of node, e.g. a site-specific device class
+        handlers : NodeHandler
+            The handlers serializing the nodes of the class. No handler to not serialize them.
+        """
+        self._handlers[node_class] = tuple(handlers)
+        for handler in handlers:
+            if handler not in self._ordered_handlers:
+                self._ordered_handlers.append(handler)
+
+    def get_handlers(self, node_class):
+        """
+        Resolve the handlers of a class of node.
+
+        Parameters
+        ----------
+        node_class : type
+            The class of the node
+
+        Returns : tuple
+        -------
+            The handlers of the nodes of the class, if any
+        """
+        for base_class in node_class.__mro__:
+            if base_class in self._handlers:
+                return self._handlers[base_class]
+        return ()
+
+    def dispatch(self, nodes, resolved_handlers):
+        """
+        Sort nodes by handler, in a single pass.
+
+        Parameters
+        ----------
+        nodes : OrderedDict
+            The nodes, keyed by their names
+        resolved_handlers : dict
+            The handlers of the classes already resolved, e.g. by the same conversion, to add the new classes to
+
+        Returns : OrderedDict
+        -------
+            The nodes of each handler with nodes, keyed by the handler, in the order of registration
+        """
+        nodes_by_handler = OrderedDict((handler, OrderedDict()) for handler in self._ordered_handlers)
+        for key, node in nodes.items():
+            handlers = resolved_handlers.get(type(node))
+            if handlers is None:
+                handlers = resolved_handlers[type(node)] = self.get_handlers(type(node))
+            for handler in handlers:
+                nodes_by_handler[handler][key] = node
+        return OrderedDict((handler, handler_nodes) for handler, handler_nodes in nodes_by_handler.items()
+                           if handler_nodes)
+
+    def copy(self):
+        """
+        Copy the registry, e.g. to override some handlers for a conversion only.
+
+        Returns : NodeHandlerRegistry
+        -------
+            A registry with the same handlers
+        """
+        registry = NodeHandlerRegistry()
+        registry._handlers = OrderedDict(self._handlers)
+        registry._ordered_handlers = list(self._ordered_handlers)
+        return registry
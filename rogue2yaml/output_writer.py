@@ -0,0 +1,135 @@
+# Write the converted files in background threads, overlapping the output I/O with the conversions
+
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindWriter:
+    """
+    Own all the output file I/O of a conversion batch.
+
+    Rendered contents are handed over to a bounded queue, and a small pool of threads writes them out while the next
+    device is being serialized. When the queue is full, submitting blocks until a writer thread catches up, so that
+    a slow filesystem cannot make the rendered contents pile up in memory.
+
+    Each file is first written to a temporary file, which then replaces the final output file, so that an interrupted
+    write never leaves behind a truncated output file.
+    """
+    DEFAULT_THREAD_COUNT = 2
+    DEFAULT_MAX_PENDING_FILES = 16
+
+    def __init__(self, thread_count=DEFAULT_THREAD_COUNT, max_pending_files=DEFAULT_MAX_PENDING_FILES):
+        """
+        Initialize the writer, and start its threads.
+
+        Parameters
+        ----------
+        thread_count : int
+            The number of writer threads
+        max_pending_files : int
+            The number of files that can wait to be written before submitting blocks
+        """
+        self._queue = queue.Queue(max(1, max_pending_files))
+        self._errors = OrderedDict()
+        self._errors_lock = threading.Lock()
+
+        self._threads = []
+        for _ in range(max(1, thread_count)):
+            thread = threading.Thread(target=self._write_files)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def errors(self):
+        """
+        The write errors, keyed by the names given when submitting the files.
+
+        Returns
+        -------
+        The error messages : OrderedDict
+        """
+        with self._errors_lock:
+            return OrderedDict(self._errors)
+
+    def submit(self, path, contents, name=None, on_written=None):
+        """
+        Queue a file to be written. Block if too many files are already waiting to be written.
+
+        Parameters
+        ----------
+        path : str
+            The path of the output file
+        contents : str, bytes or memoryview
+            The contents to write
+        name : str
+            The name to report a write error under. Defaults to the path.
+        on_written : callable
+            If provided, called with the contents once the file has been written, or has failed to, e.g. to release
+            the memory they are viewed from
+        """
+        self._queue.put((path, contents, name or path, on_written))
+
+    def close(self):
+        """
+        Wait for all the submitted files to be written, and stop the writer threads.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_files(self):
+        """
+        The main loop of a writer thread.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            path, contents, name, on_written = item
+            item = None
+            try:
+                write_file(path, contents)
+            except (IOError, OSError) as error:
+                logger.error("Cannot write the output file '{0}'. Exception: {1}".format(path, error))
+                with self._errors_lock:
+                    self._errors[name] = "Cannot write the output file '{0}'. {1}".format(path, error)
+            finally:
+                if on_written:
+                    on_written(contents)
+
+
+def write_file(path, contents):
+    """
+    Write a file by replacing it with a fully written temporary file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the output file
+    contents : str, bytes or memoryview
+        The contents to write. The bytes are written as is, e.g. the UTF-8 encoded text of a worker process.
+    """
+    temp_path = '.'.join([path, "tmp"])
+    try:
+        with open(temp_path, 'wb' if isinstance(contents, (bytes, memoryview)) else 'w') as temp_file:
+            temp_file.write(contents)
+        os.replace(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
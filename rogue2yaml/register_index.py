@@ -0,0 +1,257 @@
+# Index the devices, registers and commands of converted device models in a SQLite database
+
+import time
+import sqlite3
+
+from rogue2yaml.yaml_comparator import COMMAND_CLASS
+
+DEVICE = "device"
+REGISTER = "register"
+COMMAND = "command"
+NODE_KINDS = (DEVICE, REGISTER, COMMAND)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    device TEXT,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    class TEXT,
+    address INTEGER NOT NULL,
+    end_address INTEGER NOT NULL,
+    size_bits INTEGER,
+    ls_bit INTEGER,
+    mode TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_by_file ON nodes (filename);
+CREATE INDEX IF NOT EXISTS nodes_by_name ON nodes (name);
+CREATE INDEX IF NOT EXISTS nodes_by_path ON nodes (path);
+CREATE INDEX IF NOT EXISTS nodes_by_address ON nodes (address, end_address);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# The largest address range of a register or a command, which bounds the address lookups to an index range
+_MAX_SPAN_KEY = "max_span"
+
+_COLUMNS = ("filename", "path", "parent", "name", "kind", "class", "address", "end_address", "size_bits", "ls_bit",
+            "mode", "description")
+
+
+class RegisterIndex:
+    """
+    A SQLite database of the devices, registers and commands of every converted device hierarchy, with their absolute
+    addresses within the device of their file.
+
+    Each file is indexed as a whole, in one transaction, replacing what was indexed for the file before, so that the
+    index can be updated incrementally as files are reconverted.
+    """
+    def __init__(self, filename):
+        """
+        Open the index, creating it if needed.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the SQLite database file
+        """
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def update(self, filename, device_model):
+        """
+        Index the device model of a converted file, replacing what was indexed for the file before.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the converted file, without its extension
+        device_model : dict
+            The device model, as built by YamlConverter.build_model()
+        """
+        rows = []
+        device_name = None
+        for device_name, device in device_model.items():
+            _add_nodes(filename, device, 0, '', rows)
+
+        max_span = max([row[7] - row[6] for row in rows if row[4] != DEVICE] or [0])
+        with self._connection:
+            self._connection.execute("DELETE FROM nodes WHERE filename = ?", (filename,))
+            self._connection.executemany("INSERT INTO nodes ({0}) VALUES ({1})"
+                                         .format(', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))), rows)
+            self._connection.execute("INSERT OR REPLACE INTO files (filename, device, indexed_at) VALUES (?, ?, ?)",
+                                     (filename, device_name, time.time()))
+            # The span only grows, so that it still bounds the address ranges of all the indexed files
+            self._connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, MAX(?, COALESCE("
+                                     "(SELECT value FROM settings WHERE key = ?), 0)))",
+                                     (_MAX_SPAN_KEY, max_span, _MAX_SPAN_KEY))
+
+    def remove(self, filename):
+        """
+        Remove a file from the index.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the converted file, without its extension
+        """
+        with self._connection:
+            self._connection.execute("DELETE FROM nodes WHERE filename = ?", (filename,))
+            self._connection.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def get_filenames(self):
+        """
+        Get the names of the indexed files.
+
+        Returns
+        -------
+        The names of the indexed files, sorted : list
+        """
+        return [row[0] for row in self._connection.execute("SELECT filename FROM files ORDER BY filename")]
+
+    def find_by_address(self, address, filename=None):
+        """
+        Find the registers and commands at an address.
+
+        Parameters
+        ----------
+        address : int
+            The absolute address, within the device of each file
+        filename : str
+            If provided, only search this file
+
+        Returns
+        -------
+        The matching nodes, as dictionaries keyed by column name : list
+        """
+        row = self._connection.execute("SELECT value FROM settings WHERE key = ?", (_MAX_SPAN_KEY,)).fetchone()
+        max_span = row[0] if row else 0
+
+        # A node spanning the address starts at most max_span bytes below it, which keeps the lookup an index range
+        query = "SELECT {0} FROM nodes WHERE address > ? AND address <= ? AND end_address > ? AND kind != ?" \
+            .format(', '.join(_COLUMNS))
+        parameters = [address - max_span, address, address, DEVICE]
+        if filename:
+            query += " AND filename = ?"
+            parameters.append(filename)
+        return self._fetch(query + " ORDER BY filename, address, path", parameters)
+
+    def find_by_name(self, pattern, kind=None, filename=None):
+        """
+        Find the nodes whose name matches a glob pattern, e.g. "*Reset*".
+
+        Parameters
+        ----------
+        pattern : str
+            The glob pattern of the node names. Case-sensitive.
+        kind : str
+            If provided, only find this kind of nodes, i.e. "device", "register" or "command"
+        filename : str
+            If provided, only search this file
+
+        Returns
+        -------
+        The matching nodes, as dictionaries keyed by column name : list
+        """
+        query = "SELECT {0} FROM nodes WHERE name GLOB ?".format(', '.join(_COLUMNS))
+        parameters = [pattern]
+        if kind:
+            query += " AND kind = ?"
+            parameters.append(kind)
+        if filename:
+            query += " AND filename = ?"
+            parameters.append(filename)
+        return self._fetch(query + " ORDER BY filename, address, path", parameters)
+
+    def get_children(self, filename, path=''):
+        """
+        Get the direct children of a device.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the converted file
+        path : str
+            The path of the device within the device of the file. The empty path is the device of the file.
+
+        Returns
+        -------
+        The children, as dictionaries keyed by column name : list
+        """
+        return self._fetch("SELECT {0} FROM nodes WHERE filename = ? AND parent = ? ORDER BY address, path"
+                           .format(', '.join(_COLUMNS)), (filename, path))
+
+    def _fetch(self, query, parameters):
+        return [dict(zip(_COLUMNS, row)) for row in self._connection.execute(query, parameters)]
+
+
+def _add_nodes(filename, device, base_address, prefix, rows):
+    """
+    Add the rows of the children of a device, recursing into the child devices. The arrays are expanded into one row
+    per element.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the converted file
+    device : dict
+        The device model
+    base_address : int
+        The absolute address of the device
+    prefix : str
+        The path of the device, followed by '.', or '' for the device of the file
+    rows : list
+        The rows to add to
+    """
+    parent = prefix[:-1]
+    for name, child in device.get("children", {}).items():
+        at = child.get("at", {})
+        if "offset" not in at:
+            continue
+        element_count = at.get("nelms", 1)
+        if not isinstance(element_count, int):
+            element_count = 1
+
+        if "children" in child:
+            kind = DEVICE
+            size = child.get("size", 0)
+        elif child.get("class") == COMMAND_CLASS:
+            kind = COMMAND
+            size = 1
+        elif "sizeBits" in child:
+            kind = REGISTER
+            size = max(1, (child.get("lsBit", 0) + child["sizeBits"] + 7) // 8)
+        else:
+            continue
+        stride = at.get("stride", size)
+
+        for i in range(element_count):
+            element_name = ''.join([name, "[{0}]".format(i) if element_count > 1 else ''])
+            address = base_address + at["offset"] + i * stride
+            rows.append((filename, prefix + element_name, parent, element_name, kind, child.get("class"), address,
+                         address + size, child.get("sizeBits"), child.get("lsBit"), child.get("mode"),
+                         child.get("description")))
+            if kind == DEVICE:
+                _add_nodes(filename, child, address, prefix + element_name + '.', rows)
+
@@ -0,0 +1,84 @@
+# Dump and load the device model in machine-friendly formats, alongside the CPSW YAML files
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# The file extension of each sidecar format
+SIDECAR_FORMATS = {
+    "json": "json",
+    "msgpack": "msgpack",
+}
+
+
+def dump_sidecar(device_model, sidecar_format):
+    """
+    Dump a device model into a sidecar format.
+
+    Parameters
+    ----------
+    device_model : OrderedDict
+        The device model, as built by YamlConverter.build_model()
+    sidecar_format : str
+        The name of the sidecar format, i.e. "json" or "msgpack"
+
+    Returns : str or bytes
+    -------
+        The sidecar contents
+    """
+    if sidecar_format == "json":
+        return json.dumps(device_model, separators=(',', ':'))
+    if sidecar_format == "msgpack":
+        if msgpack is None:
+            raise ValueError("The msgpack sidecar format requires the msgpack package. Install it with "
+                             "'pip install msgpack'.")
+        return msgpack.packb(device_model, use_bin_type=True)
+    raise ValueError("Unknown sidecar format '{0}'. Supported formats: {1}."
+                     .format(sidecar_format, ', '.join(sorted(SIDECAR_FORMATS))))
+
+
+def load_sidecar(filename):
+    """
+    Load a device model from a sidecar file. The format is given by the file extension.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the sidecar file
+
+    Returns : dict
+    -------
+        The device model, keyed by the name of the device
+    """
+    if filename.endswith('.' + SIDECAR_FORMATS["msgpack"]):
+        if msgpack is None:
+            raise ValueError("Loading '{0}' requires the msgpack package. Install it with 'pip install msgpack'."
+                             .format(filename))
+        with open(filename, 'rb') as sidecar_file:
+            return msgpack.unpackb(sidecar_file.read(), raw=False)
+    with open(filename, 'r') as sidecar_file:
+        return json.load(sidecar_file)
+
+
+def get_sidecar_filename(yaml_filename, sidecar_format):
+    """
+    Get the name of the sidecar file of a CPSW YAML file.
+
+    Parameters
+    ----------
+    yaml_filename : str
+        The name of the CPSW YAML file, e.g. "AxiVersion.yaml"
+    sidecar_format : str
+        The name of the sidecar format
+
+    Returns : str
+    -------
+        The sidecar file name, e.g. "AxiVersion.json"
+    """
+    if yaml_filename.endswith(".yaml"):
+        yaml_filename = yaml_filename[:-len(".yaml")]
+    return '.'.join([yaml_filename, SIDECAR_FORMATS[sidecar_format]])
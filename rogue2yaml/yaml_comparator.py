@@ -0,0 +1,292 @@
+# Compare CPSW YAML files produced by the converter register by register
+
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from rogue2yaml.sidecar import SIDECAR_FORMATS, load_sidecar
+
+try:
+    from yaml import CBaseLoader as _Loader
+except ImportError:
+    from yaml import BaseLoader as _Loader
+
+
+# An alias to an anchor defined in another file, e.g. "<<: *AxiVersion", which cannot be resolved within the file
+_ALIAS_PATTERN = re.compile(r"^(\s*[^\s#][^:]*:\s+)\*(\S+)\s*$", re.MULTILINE)
+
+COMMAND_CLASS = "SequenceCommand"
+
+
+class RegisterMapDiff:
+    """
+    The differences between two register maps.
+    """
+    def __init__(self, added=None, removed=None, changed=None):
+        """
+        Initialize the differences.
+
+        Parameters
+        ----------
+        added : OrderedDict
+            The nodes only in the new register map, keyed by path
+        removed : OrderedDict
+            The nodes only in the old register map, keyed by path
+        changed : OrderedDict
+            The changed attributes of the nodes in both register maps, keyed by path. Each attribute maps to its
+            (old value, new value).
+        """
+        self.added = added if added is not None else OrderedDict()
+        self.removed = removed if removed is not None else OrderedDict()
+        self.changed = changed if changed is not None else OrderedDict()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def format(self):
+        """
+        Describe the differences, one node per line.
+
+        Returns
+        -------
+        The description lines : list
+        """
+        lines = []
+        for path, node in self.added.items():
+            lines.append("+ {0} {1}".format(node["kind"], path))
+        for path, node in self.removed.items():
+            lines.append("- {0} {1}".format(node["kind"], path))
+        for path, changes in self.changed.items():
+            lines.append("~ {0}: {1}".format(path, ", ".join("{0} {1!r} -> {2!r}".format(name, old, new)
+                                                             for name, (old, new) in changes.items())))
+        return lines
+
+
+def load_register_map(filename):
+    """
+    Load a converted CPSW YAML file, or a sidecar file of its device model, as a register map.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the CPSW YAML file, or of the sidecar file
+
+    Returns
+    -------
+    The registers, commands and child devices, keyed by their path within the device : OrderedDict
+    """
+    if os.path.splitext(filename)[1][1:] in SIDECAR_FORMATS.values():
+        data = load_sidecar(filename)
+    else:
+        with open(filename, 'r') as yaml_file:
+            contents = yaml_file.read()
+
+        # Keep the aliases to other files as plain strings, e.g. "*AxiVersion"
+        contents = _ALIAS_PATTERN.sub(r'\1"*\2"', contents)
+        data = yaml.load(contents, Loader=_Loader) or {}
+
+    register_map = OrderedDict()
+    for device in data.values():
+        if isinstance(device, dict):
+            _flatten_children(device, '', register_map, _get_metadata(device))
+    return register_map
+
+
+def compare_register_maps(old_register_map, new_register_map):
+    """
+    Compare two register maps, in linear time.
+
+    Parameters
+    ----------
+    old_register_map : OrderedDict
+        The register map to compare from
+    new_register_map : OrderedDict
+        The register map to compare to
+
+    Returns
+    -------
+    The differences : RegisterMapDiff
+    """
+    diff = RegisterMapDiff()
+    for path, new_node in new_register_map.items():
+        old_node = old_register_map.get(path)
+        if old_node is None:
+            diff.added[path] = new_node
+            continue
+
+        changes = OrderedDict()
+        for name in list(old_node.keys()) + [name for name in new_node.keys() if name not in old_node]:
+            old_value, new_value = old_node.get(name), new_node.get(name)
+            if old_value != new_value:
+                changes[name] = (old_value, new_value)
+        if changes:
+            diff.changed[path] = changes
+
+    for path, old_node in old_register_map.items():
+        if path not in new_register_map:
+            diff.removed[path] = old_node
+    return diff
+
+
+def compare_files(old_filename, new_filename):
+    """
+    Compare two converted CPSW YAML files register by register.
+
+    Parameters
+    ----------
+    old_filename : str
+        The name of the file to compare from
+    new_filename : str
+        The name of the file to compare to
+
+    Returns
+    -------
+    The differences : RegisterMapDiff
+    """
+    return compare_register_maps(load_register_map(old_filename), load_register_map(new_filename))
+
+
+def compare_directories(old_dirname, new_dirname, worker_count=None):
+    """
+    Compare two directories of converted CPSW YAML files, e.g. from two firmware releases. The files are compared in
+    parallel.
+
+    Parameters
+    ----------
+    old_dirname : str
+        The directory to compare from
+    new_dirname : str
+        The directory to compare to
+    worker_count : int
+        The number of processes comparing the files. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    The files only in the new directory, the files only in the old directory, and the differences of each file in both
+    directories that has changed : tuple(list, list, OrderedDict)
+    """
+    old_filenames = set(_list_yaml_files(old_dirname))
+    new_filenames = set(_list_yaml_files(new_dirname))
+    added_files = sorted(new_filenames - old_filenames)
+    removed_files = sorted(old_filenames - new_filenames)
+    common_files = sorted(old_filenames & new_filenames)
+
+    changed_files = OrderedDict()
+    with ProcessPoolExecutor(worker_count) as executor:
+        diffs = executor.map(compare_files, [os.path.join(old_dirname, filename) for filename in common_files],
+                             [os.path.join(new_dirname, filename) for filename in common_files],
+                             chunksize=max(1, len(common_files) // (4 * (worker_count or os.cpu_count() or 1))))
+        for filename, diff in zip(common_files, diffs):
+            if diff:
+                changed_files[filename] = diff
+    return added_files, removed_files, changed_files
+
+
+def _list_yaml_files(dirname):
+    """
+    List the YAML files in a directory tree.
+
+    Parameters
+    ----------
+    dirname : str
+        The directory
+
+    Returns
+    -------
+    The paths of the YAML files, relative to the directory : list
+    """
+    filenames = []
+    for root, _, files in os.walk(dirname):
+        for filename in files:
+            if filename.endswith(".yaml"):
+                filenames.append(os.path.relpath(os.path.join(root, filename), dirname))
+    return filenames
+
+
+def _get_metadata(device):
+    """
+    Get the metadata values of a device, e.g. numBuffers, to resolve the aliases to them.
+
+    Parameters
+    ----------
+    device : dict
+        The device mapping
+
+    Returns
+    -------
+    The metadata values, keyed by the alias referring to them : dict
+    """
+    metadata = device.get("metadata")
+    if not isinstance(metadata, dict):
+        return {}
+    return dict(('*' + name, value) for name, value in metadata.items())
+
+
+def _flatten_children(device, prefix, register_map, metadata):
+    """
+    Add the children of a device to a register map, recursing into nested children.
+
+    Parameters
+    ----------
+    device : dict
+        The device mapping
+    prefix : str
+        The path of the device within the top device
+    register_map : OrderedDict
+        The register map to add to
+    metadata : dict
+        The metadata values to resolve the aliases to
+    """
+    children = device.get("children")
+    if not isinstance(children, dict):
+        return
+
+    for name, child in children.items():
+        if not isinstance(child, dict):
+            continue
+        path = prefix + name
+
+        node = OrderedDict()
+        if "<<" in child or "children" in child:
+            node["kind"] = "device"
+        elif child.get("class") == COMMAND_CLASS:
+            node["kind"] = "command"
+        else:
+            node["kind"] = "register"
+
+        for key, value in child.items():
+            if key == "children":
+                continue
+            if key == "at" and isinstance(value, dict):
+                for at_key, at_value in value.items():
+                    node[at_key] = _normalize(metadata.get(at_value, at_value))
+            else:
+                node[key] = _normalize(metadata.get(value, value) if not isinstance(value, dict) else value)
+        register_map[path] = node
+
+        if "children" in child:
+            _flatten_children(child, path + '.', register_map, metadata)
+
+
+def _normalize(value):
+    """
+    Turn the numeric strings, e.g. "0x100", into numbers so that equal values in different notations compare equal.
+
+    Parameters
+    ----------
+    value : object
+        The value
+
+    Returns
+    -------
+    The normalized value : object
+    """
+    if isinstance(value, str):
+        try:
+            return int(value, 0)
+        except ValueError:
+            return value
+    return value
@@ -2,11 +2,17 @@
 
 import os
 from collections import OrderedDict
+from io import StringIO
 import yaml
 
 import pyrogue as pr
 from version import CPSW_YAML_SCHEMA_VERSION
 
+from rogue2yaml.output_writer import write_file
+from rogue2yaml.address_map import build_address_map
+from rogue2yaml.node_handlers import NodeHandler, NodeHandlerRegistry
+from rogue2yaml.sidecar import dump_sidecar, get_sidecar_filename
+
 
 class YamlConverter:
     """
@@ -21,7 +27,7 @@ class YamlConverter:
     SEQUENCE_COMMAND_CLASS = "SequenceCommand"
     CHILD_DEVICE_BYTE_ORDER = "BE"
 
-    def __init__(self, pyrogue_device):
+    def __init__(self, pyrogue_device, node_handlers=None):
         """
         Initialize the Converter.
 
@@ -29,11 +35,28 @@ class YamlConverter:
         ----------
         pyrogue_device : Device
             The Rogue device object, from which its CPSW YAML representation is to be formed.
+        node_handlers : NodeHandlerRegistry
+            The handlers serializing the children of the device, by their classes. Defaults to DEFAULT_NODE_HANDLERS.
         """
         self._pyrogue_device = pyrogue_device
+        self._node_handlers = node_handlers or DEFAULT_NODE_HANDLERS
         self._serialized_data = OrderedDict()
 
-    def convert(self, export_filename, export_dirname="output"):
+        # The child device objects, keyed by their serialized names, to resolve the merge keys referring to them
+        self._child_devices = OrderedDict()
+
+        # The distances between the elements of the arrays, keyed by their serialized names
+        self._array_strides = OrderedDict()
+
+        # The device model built from the last serialized data
+        self._model = None
+
+        # The handlers of the classes of the nodes, and whether they have an offset, resolved once per class. They
+        # are kept per converter, as the converters of different files may run concurrently, e.g. in threads.
+        self._resolved_handlers = {}
+        self._offset_classes = {}
+
+    def convert(self, export_filename, export_dirname="output", writer=None, sidecar_formats=()):
         """
         Perform the conversion, i.e. dumping the Rogue device object's data into a YAML-formatted file.
 
@@ -45,15 +68,151 @@ class YamlConverter:
             The name of the output file
         export_dirname : str
             The name of the output directory
+        writer : WriteBehindWriter
+            If provided, hand the output file over to this writer instead of writing it before returning
+        sidecar_formats : list
+            The machine-friendly formats, e.g. "json", to also write the device model in, from the same serialized data
+        """
+        self._serialize_rogue_data()
+        if writer:
+            writer.submit(os.path.join(export_dirname, export_filename), self._render_yaml(export_filename),
+                          name=export_filename)
+        else:
+            self._export_to_yaml(export_filename, export_dirname)
+
+        for sidecar_format in sidecar_formats:
+            sidecar_path = os.path.join(export_dirname, get_sidecar_filename(export_filename, sidecar_format))
+            if writer:
+                writer.submit(sidecar_path, self.render_sidecar(sidecar_format), name=export_filename)
+            else:
+                write_file(sidecar_path, self.render_sidecar(sidecar_format))
+
+    def render(self, export_filename):
+        """
+        Perform the conversion, returning the CPSW YAML contents instead of writing them into a file.
+
+        Parameters
+        ----------
+        export_filename : str
+            The name of the output file, which is part of the YAML heading
+
+        Returns : str
+        -------
+            The CPSW YAML contents
         """
         self._serialize_rogue_data()
-        self._export_to_yaml(export_filename, export_dirname)
+        return self._render_yaml(export_filename)
+
+    def render_sidecar(self, sidecar_format):
+        """
+        Render the device model, i.e. the serialized data with its anchors and merge keys resolved, into a compact
+        machine-friendly format. This reuses the data serialized by the last conversion, if any.
+
+        Parameters
+        ----------
+        sidecar_format : str
+            The name of the sidecar format, i.e. "json" or "msgpack"
+
+        Returns : str or bytes
+        -------
+            The sidecar contents
+        """
+        return dump_sidecar(self.build_model(), sidecar_format)
+
+    def build_model(self):
+        """
+        Build the device model, which mirrors the CPSW YAML contents, but with its anchors and merge keys resolved, i.e.
+        each child device includes its own resolved device model, and its numbers are numbers instead of hex strings.
+        The arrays also get the stride between their elements.
+
+        The data serialized by the last conversion is reused, if any.
+
+        Returns : OrderedDict
+        -------
+            The device model, keyed by the name of the device
+        """
+        if not self._serialized_data:
+            self._serialize_rogue_data()
+        if self._model is not None:
+            return self._model
+
+        root = self._serialized_data["__root__"]
+        device_model = OrderedDict()
+        anchors = OrderedDict()
+        for key, value in root.items():
+            if key == "children":
+                continue
+            if key == "metadata":
+                device_model["metadata"] = OrderedDict()
+                for metadata_key, metadata_value in value.items():
+                    # e.g. "&numBuffers 4"
+                    anchor, _, metadata_value = metadata_value.partition(' ')
+                    anchors[anchor.replace('&', '*', 1)] = int(metadata_value, 0)
+                    device_model["metadata"][metadata_key] = int(metadata_value, 0)
+            else:
+                device_model[key] = YamlConverter._resolve_value(value, anchors)
+
+        device_model["children"] = OrderedDict()
+        for child_name, child in root["children"].items():
+            if child_name in ('#', "##"):
+                continue
+            child_model = OrderedDict()
+            if "<<" in child and child_name in self._child_devices:
+                child_device_model = YamlConverter(self._child_devices[child_name],
+                                                   self._node_handlers).build_model()
+                child_model.update(next(iter(child_device_model.values())))
+            for key, value in child.items():
+                if key in ('<<', '#', "##"):
+                    continue
+                if key == "at":
+                    child_model["at"] = OrderedDict((at_key, YamlConverter._resolve_value(at_value, anchors))
+                                                    for at_key, at_value in value.items())
+                    if child_name in self._array_strides:
+                        child_model["at"]["stride"] = self._array_strides[child_name]
+                else:
+                    child_model[key] = YamlConverter._resolve_value(value, anchors)
+            device_model["children"][child_name] = child_model
+
+        name = getattr(self._pyrogue_device, "name", None)
+        self._model = OrderedDict([(name, device_model)])
+        return self._model
+
+    def build_address_map(self):
+        """
+        Flatten the device model into the absolute addresses of all the registers of the hierarchy.
+
+        Returns : list
+        -------
+            The address map entries, sorted by address
+        """
+        return build_address_map(self.build_model())
+
+    def add_child(self, name, child):
+        """
+        Add a serialized child to the device, e.g. from a NodeHandler, between separator lines. A child of the same
+        name is replaced.
+
+        Parameters
+        ----------
+        name : str
+            The name of the child in the CPSW YAML file
+        child : OrderedDict
+            The serialized fields of the child, e.g. "at", "description" and "class"
+        """
+        child_data = OrderedDict()
+        child_data['#'] = '#' * 20
+        child_data[name] = OrderedDict(child)
+        child_data[name]['##'] = '#' * 20
+        self._serialized_data["__root__"]["children"].update(child_data)
 
     def _serialize_rogue_data(self):
         """
         Serialize the Rogue device object.
         """
         self._serialized_data = OrderedDict()
+        self._child_devices = OrderedDict()
+        self._array_strides = OrderedDict()
+        self._model = None
 
         if hasattr(self._pyrogue_device, "name"):
             name = self._pyrogue_device.name
@@ -90,20 +249,10 @@ class YamlConverter:
             A Rogue device whose children are to be serialized
 
         """
-        # Serialize Remote Variables
-        if hasattr(device, "getNodes"):
-            remote_variables = device.getNodes(pr.RemoteVariable)
-            self._serialize_remote_variables(remote_variables, replica_count)
-
-        # Serialize devices
-        if hasattr(device, "devices"):
-            devices = device.devices
-            self._serialize_devices(devices)
-
-        # Serialize Commands
-        if hasattr(device, "commands"):
-            commands = device.commands
-            self._serialize_commands(commands)
+        # Sort the children by handler in a single pass over the nodes of the device, keeping their order
+        nodes_by_handler = self._node_handlers.dispatch(getattr(device, "nodes", {}), self._resolved_handlers)
+        for handler, nodes in nodes_by_handler.items():
+            handler.serialize(self, nodes, replica_count)
 
     def _serialize_remote_variables(self, remote_variables, replica_count):
         """
@@ -121,7 +270,8 @@ class YamlConverter:
                 if search_index >= 0:
                     remote_var_name = remote_var_name[0:search_index]
                     if key[search_index:search_index + 3] != "[0]" and not replica_count:
-                        current_node_count = child_data[remote_var_name].get("nelms", None)
+                        current_node_count = child_data[remote_var_name]["at"].get("nelms", None)
+                        self._record_array_stride(remote_var_name, remote_var.offset)
                         if current_node_count is None:
                             self._serialized_data["__root__"]["children"][remote_var_name]["at"]["nelms"] = 2
                         else:
@@ -172,7 +322,9 @@ class YamlConverter:
                     device_name = device_name[0:search_index]
                     if key[search_index:search_index + 3] != "[0]":
                         # Do not output duplicate remote var names with different subscripts
-                        current_node_count = child_data[device_name].get("nelms", None)
+                        current_node_count = child_data[device_name]["at"].get("nelms", None)
+                        if self._has_offset(v):
+                            self._record_array_stride(device_name, v.offset)
                         if current_node_count is None:
                             self._serialized_data["__root__"]["children"][device_name]["at"]["nelms"] = 2
                         else:
@@ -185,11 +337,12 @@ class YamlConverter:
                 child_data[device_name] = OrderedDict()
                 child_data[device_name]["<<"] = ''.join(['*', device_name])
                 child_data[device_name]["at"] = OrderedDict()
-                if hasattr(devices[key], "offset"):
-                    child_data[device_name]["at"]["offset"] = hex(devices[key].offset)
+                if self._has_offset(v):
+                    child_data[device_name]["at"]["offset"] = hex(v.offset)
                 child_data[device_name]['##'] = '#' * 20
 
                 self._serialized_data["__root__"]["children"].update(child_data)
+                self._child_devices[device_name] = devices[key]
 
     def _serialize_commands(self, commands):
         """
@@ -208,8 +361,8 @@ class YamlConverter:
                 child_data['#'] = '#' * 20
                 child_data[command_name] = OrderedDict()
                 child_data[command_name]["at"] = OrderedDict()
-                child_data[command_name]["at"]["offset"] = hex(command.offset) if hasattr(command, "offset") else \
-                    hex(YamlConverter.SEQUENCE_COMMAND_OFFSET)
+                child_data[command_name]["at"]["offset"] = hex(command.offset) \
+                    if self._has_offset(command) else hex(YamlConverter.SEQUENCE_COMMAND_OFFSET)
 
                 child_data[command_name]["name"] = command_name
                 child_data[command_name]["description"] = command.description
@@ -220,11 +373,7 @@ class YamlConverter:
 
     def _export_to_yaml(self, filename, dirname="output"):
         """
-        Post-process the YAML contents before writing into the final output file.
-
-        This is accomplished by first writing into a temporary file, then read the temporary file and process certain
-        lines, i.e. adding headers, then write to the official output line. Finally, automatically delete the temporary
-        line.
+        Write the post-processed YAML contents into the final output file.
 
         Parameters
         ----------
@@ -233,20 +382,77 @@ class YamlConverter:
         dirname : str
             The name of the output directory
         """
-        with open(os.path.join(dirname, '.'.join([filename, "tmp"])), 'w') as temp_yaml_file:
-            contents = YamlConverter.ordered_dump(self._serialized_data, dumper=yaml.SafeDumper,
-                                                  default_flow_style=False)
-            contents = contents.replace("__root__:\n", "")
-            temp_yaml_file.write(contents)
-        with open(os.path.join(dirname, filename), 'w') as yaml_file:
-            YamlConverter._insert_heading(yaml_file, filename)
-            with open(os.path.join(dirname, '.'.join([filename, "tmp"])), 'r') as temp_yaml_file:
-                lines = temp_yaml_file.readlines()
-                for line in lines:
-                    line = YamlConverter._post_process_line(line)
-                    yaml_file.write(line)
-
-        os.remove(os.path.join(dirname, '.'.join([filename, "tmp"])))
+        write_file(os.path.join(dirname, filename), self._render_yaml(filename))
+
+    def _render_yaml(self, filename):
+        """
+        Dump the serialized data into YAML, and post-process the YAML contents, i.e. adding headers.
+
+        Parameters
+        ----------
+        filename : str
+            The user-provided output data file name.
+
+        Returns : str
+        -------
+            The post-processed YAML contents
+        """
+        contents = YamlConverter.ordered_dump(self._serialized_data, dumper=yaml.SafeDumper, default_flow_style=False)
+        contents = contents.replace("__root__:\n", "")
+
+        yaml_file = StringIO()
+        YamlConverter._insert_heading(yaml_file, filename)
+        for line in contents.splitlines(True):
+            yaml_file.write(YamlConverter._post_process_line(line))
+        return yaml_file.getvalue()
+
+    def _record_array_stride(self, name, element_offset):
+        """
+        Record the stride of an array, from the offset of its second element, if not recorded yet.
+
+        Parameters
+        ----------
+        name : str
+            The serialized name of the array
+        element_offset : int
+            The offset of an element of the array other than the first one
+        """
+        if name not in self._array_strides:
+            first_element_offset = int(self._serialized_data["__root__"]["children"][name]["at"]["offset"], 16)
+            self._array_strides[name] = element_offset - first_element_offset
+
+    def _has_offset(self, node):
+        """
+        Check if a node has an offset, once per class of node. The offset is a property of the Rogue classes, so that
+        all the nodes of a class have one, or none.
+        """
+        has_offset = self._offset_classes.get(type(node))
+        if has_offset is None:
+            has_offset = self._offset_classes[type(node)] = hasattr(node, "offset")
+        return has_offset
+
+    @staticmethod
+    def _resolve_value(value, anchors):
+        """
+        Resolve a serialized value for the device model.
+
+        Parameters
+        ----------
+        value : object
+            The serialized value, e.g. "0x100", or "*numBuffers"
+        anchors : dict
+            The values of the anchors defined in the device, keyed by their aliases
+
+        Returns : object
+        -------
+            The resolved value
+        """
+        if isinstance(value, str):
+            if value in anchors:
+                return anchors[value]
+            if value.startswith("0x"):
+                return int(value, 16)
+        return value
 
     @staticmethod
     def _post_process_line(line):
@@ -324,3 +530,40 @@ class YamlConverter:
 
         OrderedDumper.add_representer(OrderedDict, _dict_representer)
         return yaml.dump(data, stream, OrderedDumper, **kwds)
+
+
+class RemoteVariableHandler(NodeHandler):
+    """
+    Serialize the remote variables as IntFields, with their arrays.
+    """
+    def serialize(self, converter, nodes, replica_count):
+        converter._serialize_remote_variables(nodes, replica_count)
+
+
+class DeviceHandler(NodeHandler):
+    """
+    Serialize the child devices as merge keys of their own conversions, with their arrays.
+    """
+    def serialize(self, converter, nodes, replica_count):
+        converter._serialize_devices(nodes)
+
+
+class CommandHandler(NodeHandler):
+    """
+    Serialize the commands as SequenceCommands.
+    """
+    def serialize(self, converter, nodes, replica_count):
+        converter._serialize_commands(nodes)
+
+
+REMOTE_VARIABLE_HANDLER = RemoteVariableHandler()
+DEVICE_HANDLER = DeviceHandler()
+COMMAND_HANDLER = CommandHandler()
+
+# The handlers of the Rogue nodes, which the site-specific node classes can be registered into. A remote command is
+# both a remote variable and a command, which replaces the former in the children of the device.
+DEFAULT_NODE_HANDLERS = NodeHandlerRegistry()
+DEFAULT_NODE_HANDLERS.register(pr.RemoteVariable, REMOTE_VARIABLE_HANDLER)
+DEFAULT_NODE_HANDLERS.register(pr.Device, DEVICE_HANDLER)
+DEFAULT_NODE_HANDLERS.register(pr.BaseCommand, COMMAND_HANDLER)
+DEFAULT_NODE_HANDLERS.register(pr.RemoteCommand, REMOTE_VARIABLE_HANDLER, COMMAND_HANDLER)
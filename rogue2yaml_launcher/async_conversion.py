@@ -0,0 +1,370 @@
+# Convert Rogue Python files from asyncio code, without blocking the event loop
+
+import os
+import sys
+import queue
+import atexit
+import shutil
+import asyncio
+import importlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Pipe
+
+from rogue2yaml.output_writer import write_file
+from rogue2yaml_launcher.conversion import ConversionOptions, ConversionResult
+from rogue2yaml_launcher.daemon import _convert_request
+from rogue2yaml_launcher.dependencies import get_file_signature
+from rogue2yaml_launcher.preflight import BROKEN, HARDWARE_MODULES, NEEDS_STUB, classify_file
+from rogue2yaml_launcher.worker_pool import WorkerPool
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+
+class AsyncConverter:
+    """
+    Convert Rogue Python files from asyncio code.
+
+    The conversions run in a pool of worker processes, driven by a background thread, or one at a time in a background
+    thread of this process. The files are staged and written by the default executor of the event loop, so that the
+    event loop is never blocked. Cancelling a conversion that has already started lets it complete in the background,
+    and discards its result. If a file changes after it has been converted, the workers, which keep its module
+    imported, are replaced once their conversions are complete.
+    """
+    def __init__(self, max_concurrency=None, processes=True, options=None, preflight=True, timeout=0):
+        """
+        Initialize the converter. The workers are started on the first conversion.
+
+        Parameters
+        ----------
+        max_concurrency : int
+            The number of conversions running at the same time, i.e. the number of worker processes. Defaults to the
+            number of CPUs. Ignored without processes, as the conversions then run one at a time.
+        processes : bool
+            True to convert in worker processes, forked from a template process that has imported pyrogue; False to
+            convert in a background thread of this process, e.g. where worker processes cannot be started
+        options : ConversionOptions
+            The default options of the conversions
+        preflight : bool
+            True to classify each file before converting it, stubbing the hardware modules it needs
+        timeout : float
+            The duration, in seconds, beyond which a conversion in a worker process is abandoned, and the worker
+            replaced. 0 means no limit.
+        """
+        self.max_concurrency = 1 if not processes else max_concurrency or os.cpu_count() or 1
+        self.processes = processes
+        self.options = options or ConversionOptions()
+        self.preflight = preflight
+        self.timeout = timeout
+
+        self._executor = None
+        self._semaphore = None
+        # The locks of the staged file names, as files of the same name cannot be staged at the same time
+        self._staging_locks = {}
+        # The source of each staged file, with its signature when staged
+        self._staged_files = {}
+
+    async def convert_file(self, path, output_dir=None, options=None):
+        """
+        Convert one Rogue Python file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the Rogue Python file, which is staged into the "input" directory
+        output_dir : str
+            If provided, the directory to write the CPSW YAML file and the additional outputs to
+        options : ConversionOptions
+            The options of this conversion, instead of the default options
+
+        Returns
+        -------
+        The outcome of the conversion : ConversionResult
+        """
+        filename = os.path.basename(path)
+        options = options or self.options
+        loop = asyncio.get_running_loop()
+
+        async with self._staging_locks.setdefault(filename, asyncio.Lock()):
+            verdict, changed = await loop.run_in_executor(None, self._stage, path, filename)
+            if changed:
+                self._reload(filename)
+            if verdict and verdict.verdict == BROKEN:
+                result = ConversionResult(filename[:-3], False, "Preflight: " + verdict.reason)
+            else:
+                if verdict and verdict.verdict == NEEDS_STUB:
+                    options = options.with_stub_modules(HARDWARE_MODULES)
+                result = await self._run(filename, options)
+
+        if output_dir:
+            await loop.run_in_executor(None, _write_outputs, result, output_dir)
+        return result
+
+    async def convert_class(self, module_name, class_name, output_dir=None, options=None):
+        """
+        Convert a Rogue device class of an importable module, e.g. of the firmware libraries.
+
+        Parameters
+        ----------
+        module_name : str
+            The full name of the module, e.g. "surf.axi"
+        class_name : str
+            The name of the Rogue device class in the module
+        output_dir : str
+            If provided, the directory to write the CPSW YAML file and the additional outputs to
+        options : ConversionOptions
+            The options of this conversion, instead of the default options
+
+        Returns
+        -------
+        The outcome of the conversion : ConversionResult
+        """
+        result = await self._run(class_name + ".py", options or self.options, module_name)
+        if output_dir:
+            await asyncio.get_running_loop().run_in_executor(None, _write_outputs, result, output_dir)
+        return result
+
+    async def convert_many(self, paths, output_dir=None, options=None):
+        """
+        Convert Rogue Python files, streaming the outcomes as the conversions complete.
+
+        At most max_concurrency files are in progress at a time, and the paths are consumed as the conversions
+        complete. If the iteration stops early, e.g. on a break, or is cancelled, the pending conversions are
+        cancelled.
+
+        Parameters
+        ----------
+        paths : iterable or async iterable
+            The paths of the Rogue Python files
+        output_dir : str
+            If provided, the directory to write the CPSW YAML files and the additional outputs to
+        options : ConversionOptions
+            The options of these conversions, instead of the default options
+
+        Yields : ConversionResult
+        -------
+            The outcome of each conversion, in completion order
+        """
+        path_iterator = _iterate(paths)
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_concurrency:
+                    try:
+                        path = await path_iterator.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(self.convert_file(path, output_dir, options)))
+                if not pending:
+                    break
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    async def close(self):
+        """
+        Stop the workers, once the conversions that have started are complete.
+        """
+        if self._executor:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _run(self, filename, options, module_name=None):
+        """
+        Run a conversion in the workers, within the concurrency limit.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._executor is None:
+            self._executor = _PoolExecutor(self.max_concurrency, self.timeout) if self.processes else \
+                ThreadPoolExecutor(1)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, _convert_request, filename,
+                                                                    options, module_name)
+
+    def _stage(self, path, filename):
+        """
+        Copy a file into the "input" directory, unless the same unchanged file is already staged, and classify it if
+        requested.
+
+        Returns
+        -------
+        The preflight verdict of the file, or None if not classified, and whether another version of the file has
+        been staged before : tuple(PreflightResult, bool)
+        """
+        staged_path = os.path.join("input", filename)
+        previous_path, previous_signature = self._staged_files.get(filename, (None, None))
+        signature = get_file_signature(path, previous_signature if previous_path == path else None)
+        changed = False
+        if previous_path != path or signature != previous_signature or not os.path.isfile(staged_path):
+            os.makedirs("input", exist_ok=True)
+            shutil.copyfile(path, staged_path)
+            changed = previous_signature is not None and \
+                (previous_path != path or signature.get("sha1") != previous_signature.get("sha1"))
+            self._staged_files[filename] = (path, signature)
+        return classify_file(staged_path) if self.preflight else None, changed
+
+    def _reload(self, filename):
+        """
+        Make the next conversions import the new version of a staged file, instead of the module already imported.
+        """
+        if not self.processes:
+            # The conversions run in this process
+            sys.modules.pop('.'.join(["input", filename[:-3]]), None)
+            importlib.invalidate_caches()
+        elif self._executor:
+            logger.info("Replacing the workers, as the file '{0}' has changed.".format(filename))
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=False)
+
+
+def _write_outputs(result, output_dir):
+    """
+    Write the CPSW YAML file and the additional outputs of a successful conversion. If they cannot be written, the
+    conversion is marked as failed.
+    """
+    if not result.succeeded:
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, '.'.join([result.filename, "yaml"]))
+    try:
+        write_file(path, result.contents)
+        for sidecar_filename, sidecar_contents in result.sidecars.items():
+            path = os.path.join(output_dir, sidecar_filename)
+            write_file(path, sidecar_contents)
+    except (IOError, OSError) as error:
+        logger.error("Cannot write the output file '{0}'. Exception: {1}".format(path, error))
+        result.succeeded = False
+        result.message = "Cannot write the output file '{0}'. {1}".format(path, error)
+
+
+class _PoolExecutor:
+    """
+    Run the conversions in a worker pool, from a background thread taking them from a queue.
+
+    Only the conversion function is supported, whose call is then resolved with its outcome, or with a failed
+    conversion if its worker has crashed or timed out. The executor implements the task source interface of
+    WorkerPool.imap_unordered().
+    """
+    def __init__(self, worker_count, task_timeout):
+        self.exhausted = False
+        self.wakeup_connection, self._wakeup_sender = Pipe(duplex=False)
+        self._tasks = queue.Queue()
+        self._futures = {}
+        self._running_count = 0
+        self._pool = WorkerPool(_convert_request, worker_count, task_timeout=task_timeout)
+        self._thread = threading.Thread(target=self._run, name="AsyncConverterPool")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, function, *args):
+        if self.exhausted or not self._thread.is_alive():
+            raise RuntimeError("Cannot convert after the workers have been stopped.")
+        future = Future()
+        self._tasks.put((args, future))
+        self._wakeup_sender.send_bytes(b'\0')
+        return future
+
+    def shutdown(self, wait=True):
+        self._tasks.put(None)
+        self._wakeup_sender.send_bytes(b'\0')
+        if wait:
+            self._thread.join()
+
+    def pop(self):
+        # Wait for a task if none is running, as the pool stops once it has no task to run
+        try:
+            item = self._tasks.get(block=not self._running_count)
+        except queue.Empty:
+            return None
+        if item is None:
+            self.exhausted = True
+            return None
+        task, future = item
+        if not future.set_running_or_notify_cancel():
+            return self.pop()
+        self._futures[id(task)] = task, future
+        self._running_count += 1
+        return task
+
+    def task_done(self, task, duration, peak_memory):
+        self._running_count -= 1
+
+    def _run(self):
+        try:
+            for task, result, error in self._pool.imap_unordered((), scheduler=self):
+                _, future = self._futures.pop(id(task))
+                if error:
+                    logger.error("Cannot convert '{0}'. {1}.".format(task[0], error))
+                    result = ConversionResult(task[0][:-3], False, error)
+                future.set_result(result)
+        except Exception as error:
+            logger.error("Unexpected exception in the worker pool. Exception type: {0}. Exception: {1}"
+                         .format(type(error), error))
+            for _, future in self._futures.values():
+                future.set_exception(error)
+            while not self._tasks.empty():
+                item = self._tasks.get()
+                if item and item[1].set_running_or_notify_cancel():
+                    item[1].set_exception(error)
+        finally:
+            self.exhausted = True
+            self._pool.close()
+
+
+async def _iterate(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+_default_converter = None
+
+
+def _get_default_converter():
+    global _default_converter
+    if _default_converter is None:
+        _default_converter = AsyncConverter()
+        atexit.register(_stop_default_converter)
+    return _default_converter
+
+
+def _stop_default_converter():
+    # Stop the workers before the logging queue they write to is closed
+    if _default_converter._executor:
+        _default_converter._executor.shutdown()
+
+
+async def convert_file(path, output_dir=None, options=None):
+    """
+    Convert one Rogue Python file in the worker processes shared by the module-level functions. See
+    AsyncConverter.convert_file().
+    """
+    return await _get_default_converter().convert_file(path, output_dir, options)
+
+
+async def convert_many(paths, output_dir=None, options=None):
+    """
+    Convert Rogue Python files in the worker processes shared by the module-level functions, streaming the outcomes as
+    the conversions complete. See AsyncConverter.convert_many().
+    """
+    async for result in _get_default_converter().convert_many(paths, output_dir, options):
+        yield result
@@ -0,0 +1,165 @@
+# Cache the code objects of the staged Rogue Python files by content, as their staging copies change their timestamps
+
+import os
+import sys
+import time
+import errno
+import marshal
+import hashlib
+import threading
+import importlib.machinery
+import importlib.util
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The package the Rogue Python files are staged into, whose modules are cached
+STAGING_PACKAGE = "input"
+
+# The cache entries not used for this number of days are removed by the launcher
+DEFAULT_MAX_AGE_DAYS = 30
+
+_CACHE_EXTENSION = ".pyc"
+
+# The conversions of the threads of a process install the cache concurrently
+_install_lock = threading.Lock()
+
+
+def get_default_cache_dir():
+    """
+    Get the default bytecode cache directory, in the user cache directory.
+
+    Returns
+    -------
+    The path of the directory : str
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser('~'), ".cache")
+    return os.path.join(cache_home, "rogue2yaml", "bytecode")
+
+
+def install_bytecode_cache(cache_dir):
+    """
+    Load the modules of the staging package through the bytecode cache, in this process. Installing the same cache
+    again has no effect.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The bytecode cache directory, which is created if needed
+    """
+    with _install_lock:
+        for finder in sys.meta_path:
+            if isinstance(finder, _CachingFinder):
+                if finder.cache_dir == cache_dir:
+                    return
+                sys.meta_path.remove(finder)
+                break
+
+        try:
+            os.makedirs(cache_dir)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                logger.warning("Cannot create the bytecode cache directory '{0}'. {1}".format(cache_dir, error))
+                return
+        sys.meta_path.insert(0, _CachingFinder(cache_dir))
+
+
+def prune_bytecode_cache(cache_dir, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """
+    Remove the cache entries that have not been used for a number of days.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The bytecode cache directory
+    max_age_days : float
+        The number of days after which an unused entry is removed
+
+    Returns
+    -------
+    The number of removed entries : int
+    """
+    oldest_time = time.time() - max_age_days * 24 * 3600
+    removed_count = 0
+    try:
+        entries = os.listdir(cache_dir)
+    except OSError:
+        return removed_count
+
+    for entry in entries:
+        path = os.path.join(cache_dir, entry)
+        try:
+            if entry.endswith(_CACHE_EXTENSION) and os.path.getmtime(path) < oldest_time:
+                os.remove(path)
+                removed_count += 1
+        except OSError:
+            # e.g. removed by a concurrent launcher
+            pass
+    return removed_count
+
+
+class _CachingFinder:
+    """
+    Find the modules of the staging package as usual, but load them with the caching loader.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not fullname.startswith(STAGING_PACKAGE + '.'):
+            return None
+
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is None or type(spec.loader) is not importlib.machinery.SourceFileLoader:
+            return spec
+        spec.loader = _CachingLoader(fullname, spec.origin, self.cache_dir)
+        return spec
+
+    def invalidate_caches(self):
+        pass
+
+
+class _CachingLoader(importlib.machinery.SourceFileLoader):
+    """
+    Load a source file from the code object cached for its contents, compiling and caching it on a miss.
+
+    The cache entries are keyed by the hash of the Python magic number, the path and the contents of the source file,
+    so that a copy of an unchanged file hits the cache whatever its timestamps.
+    """
+    def __init__(self, fullname, path, cache_dir):
+        super().__init__(fullname, path)
+        self.cache_dir = cache_dir
+
+    def get_code(self, fullname):
+        source_path = self.get_filename(fullname)
+        source = self.get_data(source_path)
+
+        key = hashlib.sha1(importlib.util.MAGIC_NUMBER)
+        key.update(os.path.abspath(source_path).encode("utf-8", "surrogateescape"))
+        key.update(b'\0')
+        key.update(source)
+        cache_path = os.path.join(self.cache_dir, key.hexdigest() + _CACHE_EXTENSION)
+
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                data = cache_file.read()
+            if data[:len(importlib.util.MAGIC_NUMBER)] == importlib.util.MAGIC_NUMBER:
+                code = marshal.loads(data[len(importlib.util.MAGIC_NUMBER):])
+                # Refresh the time of the entry, which tells the pruning it is still in use
+                os.utime(cache_path, None)
+                return code
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        code = self.source_to_code(source, source_path)
+        # Written to a temporary file first, as other workers, or threads, may be writing the same entry
+        temp_path = '.'.join([cache_path, str(os.getpid()), str(threading.get_ident()), "tmp"])
+        try:
+            with open(temp_path, 'wb') as temp_file:
+                temp_file.write(importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+            os.replace(temp_path, cache_path)
+        except OSError as error:
+            logger.debug("Cannot cache the bytecode of '{0}'. {1}".format(source_path, error))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return code
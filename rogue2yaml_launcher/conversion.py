@@ -0,0 +1,294 @@
+# Convert a single staged Rogue Python file into a CPSW YAML file
+
+import sys
+from collections import OrderedDict
+from pydoc import locate, ErrorDuringImport
+
+from rogue2yaml.address_map import render_binary, render_csv
+from rogue2yaml.sidecar import get_sidecar_filename
+from rogue2yaml_launcher.bytecode_cache import install_bytecode_cache
+from rogue2yaml_launcher.dependencies import find_source_files
+from rogue2yaml_launcher.preflight import get_class_name, stub_modules
+from rogue2yaml_launcher.shared_outputs import share_outputs
+from rogue2yaml.converter_logging import log_context, logging
+logger = logging.getLogger(__name__)
+
+ADDRESS_MAP_CSV_EXTENSION = "addrmap.csv"
+ADDRESS_MAP_BINARY_EXTENSION = "addrmap.bin"
+
+
+class ConversionResult:
+    """
+    The outcome of converting a single Rogue Python file.
+    """
+    def __init__(self, filename, succeeded, message="", contents=None, sidecars=None, device_model=None,
+                 dependencies=None, shared_outputs=None):
+        """
+        Initialize the result.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the converted file, without the ".py" extension
+        succeeded : bool
+            True if the CPSW YAML file has been produced; False otherwise
+        message : str
+            The reason why the conversion failed, if it did
+        contents : str
+            The CPSW YAML contents, which are yet to be written into the output file
+        sidecars : OrderedDict
+            The contents of the additional output files, e.g. the sidecars and the address maps, keyed by their file
+            names, which are yet to be written
+        device_model : OrderedDict
+            The device model, if requested, e.g. to be indexed by the launcher
+        dependencies : list
+            The absolute paths of the source files the device has been built from
+        shared_outputs : SharedOutputs
+            If provided, the shared memory segment holding the CPSW YAML contents and the additional output files, in
+            place of the contents and the sidecars
+        """
+        self.filename = filename
+        self.succeeded = succeeded
+        self.message = message
+        self.contents = contents
+        self.sidecars = sidecars if sidecars is not None else OrderedDict()
+        self.device_model = device_model
+        self.dependencies = dependencies if dependencies is not None else []
+        self.shared_outputs = shared_outputs
+
+
+class ConversionOptions:
+    """
+    The options of the conversion of each file, besides the CPSW YAML output.
+    """
+    def __init__(self, sidecar_formats=(), address_map=False, device_model=False, stub_modules=(),
+                 bytecode_cache_dir=None, shared_output_threshold=0):
+        """
+        Initialize the options.
+
+        Parameters
+        ----------
+        sidecar_formats : list
+            The machine-friendly formats, e.g. "json", to also render the device model in
+        address_map : bool
+            True to also render the flattened address map of the device hierarchy, as CSV and binary
+        device_model : bool
+            True to also return the device model, e.g. to index it
+        stub_modules : tuple
+            The names of the modules to replace with inert stubs while building the device, e.g. the hardware access
+            modules
+        bytecode_cache_dir : str
+            If provided, the directory to cache the code objects of the staged files in, by content
+        shared_output_threshold : int
+            If not 0, the total size, in bytes, beyond which the outputs are returned in a shared memory segment, e.g.
+            by a worker process to the launcher
+        """
+        self.sidecar_formats = tuple(sidecar_formats)
+        self.address_map = address_map
+        self.device_model = device_model
+        self.stub_modules = tuple(stub_modules)
+        self.bytecode_cache_dir = bytecode_cache_dir
+        self.shared_output_threshold = shared_output_threshold
+
+    def with_stub_modules(self, module_names):
+        """
+        Get a copy of the options, stubbing some modules.
+
+        Parameters
+        ----------
+        module_names : tuple
+            The names of the modules to stub
+
+        Returns
+        -------
+        The copy of the options : ConversionOptions
+        """
+        return ConversionOptions(self.sidecar_formats, self.address_map, self.device_model, module_names,
+                                 self.bytecode_cache_dir, self.shared_output_threshold)
+
+    def with_shared_outputs(self, threshold):
+        """
+        Get a copy of the options, returning the outputs in a shared memory segment beyond a size.
+
+        Parameters
+        ----------
+        threshold : int
+            The total size, in bytes, of the outputs beyond which they are shared
+
+        Returns
+        -------
+        The copy of the options : ConversionOptions
+        """
+        return ConversionOptions(self.sidecar_formats, self.address_map, self.device_model, self.stub_modules,
+                                 self.bytecode_cache_dir, threshold)
+
+
+def convert_file(filename, options=None):
+    """
+    Convert one Rogue Python file, which has been collected into the "input" directory, into CPSW YAML contents.
+
+    If the class cannot be located using the filename as the class name, retry by varying the capitalization of the
+    class name.
+
+    This function is self-contained so that it can run either in the launcher process, or in a worker process. Writing
+    the output file is left to the launcher. The log records of the conversion are tagged with the name of the file.
+    If the options request it, the large outputs are placed in a shared memory segment for the launcher to read.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the Rogue Python file in the "input" directory, including the ".py" extension
+    options : ConversionOptions
+        The additional outputs to render
+
+    Returns
+    -------
+    The outcome of the conversion : ConversionResult
+    """
+    with log_context(filename):
+        result = _convert_file(filename, options)
+        if options and options.shared_output_threshold:
+            share_outputs(result, options.shared_output_threshold)
+        return result
+
+
+def convert_class(module_name, class_name, options=None):
+    """
+    Convert a Rogue device class of an importable module, e.g. of the firmware libraries, into CPSW YAML contents.
+
+    Unlike convert_file(), the class name is used as is, and the outputs are named after it.
+
+    Parameters
+    ----------
+    module_name : str
+        The full name of the module, e.g. "surf.axi"
+    class_name : str
+        The name of the Rogue device class in the module
+    options : ConversionOptions
+        The additional outputs to render
+
+    Returns
+    -------
+    The outcome of the conversion : ConversionResult
+    """
+    with log_context('.'.join([module_name, class_name])):
+        return _convert_file(class_name + ".py", options, module_name=module_name)
+
+
+def _convert_file(filename, options, module_name=None):
+    """
+    Convert one Rogue Python file, or one class of a module if a module name is provided. See convert_file().
+    """
+    from rogue2yaml.yaml_converter import YamlConverter
+
+    options = options or ConversionOptions()
+    if options.bytecode_cache_dir:
+        install_bytecode_cache(options.bytecode_cache_dir)
+
+    logger.info("Converting file '{0}'...".format(filename))
+    class_name = filename[:-3] if module_name else get_class_name(filename)
+    filename = filename[:-3]
+
+    module_names_before = set(sys.modules)
+    try:
+        with stub_modules(options.stub_modules):
+            if module_name:
+                class_rep = locate('.'.join([module_name, class_name]))
+                if not class_rep:
+                    raise NameError("The class '{0}' cannot be found in the module '{1}'"
+                                    .format(class_name, module_name))
+            else:
+                class_rep = _locate_class("input", filename, class_name)
+
+            # Instantiate the Rogue device
+            pyrogue_device = class_rep()
+
+            # Instantiate the YAML Converter
+            converter = YamlConverter(pyrogue_device)
+
+            # Convert to YAML, and to the additional outputs from the same serialized data
+            output_filename = '.'.join([filename, "yaml"])
+            contents = converter.render(output_filename)
+            sidecars = OrderedDict()
+            for sidecar_format in options.sidecar_formats:
+                sidecar_filename = get_sidecar_filename(output_filename, sidecar_format)
+                sidecars[sidecar_filename] = converter.render_sidecar(sidecar_format)
+            if options.address_map:
+                address_map = converter.build_address_map()
+                sidecars['.'.join([filename, ADDRESS_MAP_CSV_EXTENSION])] = render_csv(address_map)
+                sidecars['.'.join([filename, ADDRESS_MAP_BINARY_EXTENSION])] = render_binary(address_map)
+            return ConversionResult(filename, True, contents=contents, sidecars=sidecars,
+                                    device_model=converter.build_model() if options.device_model else None,
+                                    dependencies=sorted(find_source_files(pyrogue_device, module_names_before)))
+    except (TypeError, AttributeError, SyntaxError, NameError, ErrorDuringImport) as error:
+        logger.error("Cannot instantiate the object of type '{0}'. Make sure the file name and the class "
+                     "name are the same (case-sensitive). Exception Type: {1}. Exception: {2}"
+                     .format(filename, type(error), error))
+        return ConversionResult(filename, False, '. '.join(["Make sure the file name and the class name are the same",
+                                                            str(type(error)), str(error)]))
+    except Exception as e:
+        logger.error("Unexpected exception during the conversion of file '{0}'. Exception type: {1}. "
+                     "Exception: {2}".format(filename, type(e), e))
+        return ConversionResult(filename, False, '. '.join(["Unexpected exception during the conversion",
+                                                            str(type(e)), str(e)]))
+
+
+def _locate_class(package_name, module_name, class_name):
+    """
+    Locate the class of a staged Rogue Python file, varying the capitalization of its name if needed.
+
+    Parameters
+    ----------
+    package_name : str
+        The name of the package the file is staged into
+    module_name : str
+        The name of the module of the file
+    class_name : str
+        The expected name of the class
+
+    Returns
+    -------
+    The class, or None if no variation of its name is found : type
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    class_rep = None
+    trial_count = 0
+
+    output = _generate_class_name_variations(class_name)
+    while not class_rep and trial_count < 2 ** len(class_name):
+        variation = next(output)
+        if debug:
+            logger.debug("Trying class name variation '{0}'...".format(variation))
+
+        class_rep = locate('.'.join([package_name, module_name, variation]))
+        if not class_rep:
+            trial_count += 1
+    return class_rep
+
+
+def _generate_class_name_variations(class_name):
+    """
+    Attempt to guess the class name by varying the capitalization of character combos in the class name string.
+
+    Parameters
+    ----------
+    class_name : str
+        The name of a Python Rogue class
+
+    Yields : str
+    -------
+        The next name with the next capitalization variation
+    """
+    if class_name is not None:
+        class_name_length = len(class_name)
+        for value in range(0, 2 ** class_name_length):
+            bit_pattern = [value >> i & 1 for i in range(class_name_length - 1, -1, -1)]
+            set_bit_indices = []
+            for i in range(0, len(bit_pattern)):
+                if bit_pattern[i]:
+                    set_bit_indices.append(i)
+            processed_name = class_name
+            for set_bit_index in set_bit_indices:
+                processed_name = ''.join([processed_name[:set_bit_index], processed_name[set_bit_index].upper(),
+                                          processed_name[set_bit_index + 1:]])
+            yield processed_name
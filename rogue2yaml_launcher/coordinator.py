@@ -0,0 +1,561 @@
+# Hand out the conversions to the remote worker launchers pulling them from a coordinator, e.g. on several build nodes
+
+import os
+import sys
+import time
+import socket
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import AuthenticationError, Client, Listener, Pipe, wait
+
+from rogue2yaml.output_writer import write_file
+from rogue2yaml_launcher.conversion import convert_file
+from rogue2yaml_launcher.worker_pool import _IteratorScheduler, _get_peak_memory, _reset_peak_memory
+
+from rogue2yaml.converter_logging import configure_worker_logging, get_process_queue, logging
+logger = logging.getLogger(__name__)
+
+# The environment variable holding the key the coordinator and the workers authenticate each other with
+AUTHKEY_ENVIRONMENT_VARIABLE = "ROGUE2YAML_AUTHKEY"
+
+# The key used on Unix sockets if none is provided, as the socket file is only accessible to its owner
+DEFAULT_UNIX_SOCKET_AUTHKEY = b"rogue2yaml"
+
+# A worker sends a heartbeat at this interval, in seconds, while converting. A worker not heard from for the timeout is
+# considered lost, e.g. if its node has crashed, and its task is given to another worker.
+HEARTBEAT_INTERVAL = 5.0
+DEFAULT_HEARTBEAT_TIMEOUT = 30.0
+
+# The number of workers a task may be lost with, e.g. by crashing them, before it is reported as failed
+DEFAULT_MAX_ATTEMPTS = 2
+
+
+def parse_address(address):
+    """
+    Parse the address of a coordinator.
+
+    Parameters
+    ----------
+    address : str
+        Either "host:port", for a TCP socket, or the path of a Unix socket
+
+    Returns
+    -------
+    The address, as accepted by multiprocessing.connection : tuple(str, int) or str
+    """
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and os.sep not in address:
+        return host or "localhost", int(port)
+    return address
+
+
+def get_authkey(address):
+    """
+    Get the key the coordinator and the workers authenticate each other with, from the environment.
+
+    Parameters
+    ----------
+    address : tuple(str, int) or str
+        The parsed address of the coordinator
+
+    Returns
+    -------
+    The key : bytes
+
+    Raises
+    ------
+    ValueError
+        If no key is provided for a TCP address, which any host could connect to
+    """
+    authkey = os.environ.get(AUTHKEY_ENVIRONMENT_VARIABLE)
+    if authkey:
+        return authkey.encode("utf-8")
+    if isinstance(address, tuple):
+        raise ValueError("Set the {0} environment variable to the same secret on the coordinator and on the workers "
+                         "to use a TCP address.".format(AUTHKEY_ENVIRONMENT_VARIABLE))
+    return DEFAULT_UNIX_SOCKET_AUTHKEY
+
+
+class Coordinator:
+    """
+    Serve the conversion tasks to the remote worker launchers connecting to an address, each pulling one task at a
+    time, and receive their results.
+
+    The tasks are pulled, rather than split up front, so that the fast workers take more tasks than the slow ones. The
+    task of a worker that disconnects, or stops sending heartbeats, is given to another worker.
+
+    The coordinator has the same interface as WorkerPool, so that the launcher can use either.
+    """
+    def __init__(self, address, authkey, task_timeout=0, heartbeat_timeout=DEFAULT_HEARTBEAT_TIMEOUT,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Start listening for the workers.
+
+        Parameters
+        ----------
+        address : tuple(str, int) or str
+            The TCP address, as (host, port), or the path of the Unix socket, to listen on. Port 0 picks a free port.
+        authkey : bytes
+            The key the workers must authenticate with
+        task_timeout : float
+            The duration, in seconds, beyond which a task is abandoned, and its worker disconnected. 0 means no limit.
+        heartbeat_timeout : float
+            The duration, in seconds, after which a silent worker is considered lost
+        max_attempts : int
+            The number of workers a task may be lost with before it is reported as failed
+        """
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        if isinstance(self.address, str):
+            # The socket file is created with the umask of the process, e.g. group-writable, and a Unix socket may use
+            # the public default key, while the results sent over it are unpickled
+            os.chmod(self.address, 0o600)
+        self._task_timeout = task_timeout
+        self._heartbeat_timeout = heartbeat_timeout
+        self._max_attempts = max_attempts
+        self._input_dir = os.path.abspath("input")
+
+        self._workers = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._new_connections = []
+        self._wakeup_reader, self._wakeup_writer = Pipe(duplex=False)
+        self._accept_thread = threading.Thread(target=self._accept, name="coordinator-accept")
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+        # The largest number of workers connected at the same time
+        self.worker_count = 0
+        logger.info("Waiting for the workers on {0}...".format(self.address))
+
+    def imap_unordered(self, tasks, scheduler=None):
+        """
+        Run convert_file() on each task on the workers, yielding the outcomes as they complete.
+
+        Parameters
+        ----------
+        tasks : iterable
+            The (filename, options) tuples of the files staged in the "input" directory. Ignored if a scheduler is
+            provided.
+        scheduler : object
+            If provided, the source of the tasks. See WorkerPool.imap_unordered().
+
+        Yields : tuple
+        -------
+            (task, result, error). If the task has been lost with too many workers, or timed out, result is None, and
+            error describes what happened.
+        """
+        if scheduler is None:
+            scheduler = _IteratorScheduler(tasks)
+        queued_tasks = deque()
+        attempts = {}
+
+        while True:
+            self._adopt_new_connections()
+
+            for worker in self._workers:
+                if worker.task is not None:
+                    continue
+                if queued_tasks:
+                    task = queued_tasks.popleft()
+                elif not scheduler.exhausted:
+                    task = scheduler.pop()
+                else:
+                    task = None
+                if task is None:
+                    break
+
+                try:
+                    with open(os.path.join("input", task[0]), 'rb') as source_file:
+                        source = source_file.read()
+                except (IOError, OSError) as error:
+                    scheduler.task_done(task, 0.0, None)
+                    yield task, None, "Cannot read the staged file. {0}".format(error)
+                    continue
+                worker.assign(task, source)
+
+            # Look ahead while no worker is available, to find out whether any task is left
+            if not queued_tasks and not scheduler.exhausted:
+                task = scheduler.pop()
+                if task is not None:
+                    queued_tasks.append(task)
+
+            # Handle the workers that have failed to take their task
+            for outcome in self._drop_lost_workers(scheduler, queued_tasks, attempts):
+                yield outcome
+
+            busy_workers = [worker for worker in self._workers if worker.task is not None]
+            if not busy_workers and not queued_tasks and scheduler.exhausted:
+                break
+
+            timeout = None
+            if busy_workers:
+                deadlines = [worker.last_seen_time + self._heartbeat_timeout for worker in busy_workers]
+                if self._task_timeout:
+                    deadlines += [worker.assign_time + self._task_timeout for worker in busy_workers]
+                timeout = max(0.0, min(deadlines) - time.time())
+
+            ready = wait([worker.connection for worker in self._workers] + [self._wakeup_reader], timeout)
+            if self._wakeup_reader in ready:
+                self._wakeup_reader.recv()
+
+            for worker in list(self._workers):
+                if worker.connection in ready:
+                    task = worker.task
+                    message = worker.receive()
+                    if message and message[0] == "result":
+                        _, result, duration, peak_memory = message
+                        result.dependencies = [self._map_dependency(worker, dependency)
+                                               for dependency in result.dependencies or []]
+                        scheduler.task_done(task, duration, peak_memory)
+                        yield task, result, None
+                elif worker.task is not None:
+                    now = time.time()
+                    if self._task_timeout and now - worker.assign_time >= self._task_timeout:
+                        task = worker.task
+                        worker.task = None
+                        worker.close()
+                        self._workers.remove(worker)
+                        scheduler.task_done(task, now - worker.assign_time, None)
+                        yield task, None, "The conversion timed out after {0} seconds on the worker {1}" \
+                            .format(self._task_timeout, worker.name)
+                    elif now - worker.last_seen_time >= self._heartbeat_timeout:
+                        logger.warning("The worker {0} has not been heard from for {1} seconds."
+                                       .format(worker.name, self._heartbeat_timeout))
+                        worker.lost = True
+
+            for outcome in self._drop_lost_workers(scheduler, queued_tasks, attempts):
+                yield outcome
+
+    def close(self):
+        """
+        Tell the workers there is no more task, and stop listening.
+        """
+        with self._lock:
+            self._closed = True
+            new_connections, self._new_connections = self._new_connections, []
+        for connection in new_connections:
+            self._workers.append(_RemoteWorker(connection))
+        for worker in self._workers:
+            worker.send(("done",))
+            worker.close()
+        self._workers = []
+
+        # Closing the listener does not interrupt the thread waiting for a connection, which a dummy connection does
+        try:
+            family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+            with socket.socket(family) as wakeup_socket:
+                wakeup_socket.connect(self.address)
+        except OSError:
+            pass
+        self._accept_thread.join(1)
+        self._listener.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except (AuthenticationError, OSError, EOFError) as error:
+                if self._closed:
+                    break
+                if isinstance(error, AuthenticationError):
+                    logger.warning("Rejected a worker that failed to authenticate. {0}".format(error))
+                continue
+            with self._lock:
+                if self._closed:
+                    connection.close()
+                    break
+                self._new_connections.append(connection)
+                self._wakeup_writer.send(None)
+
+    def _adopt_new_connections(self):
+        with self._lock:
+            new_connections, self._new_connections = self._new_connections, []
+        for connection in new_connections:
+            worker = _RemoteWorker(connection)
+            if connection.poll(HEARTBEAT_INTERVAL) and worker.receive() and worker.name:
+                logger.info("The worker {0} has connected.".format(worker.name))
+                self._workers.append(worker)
+            else:
+                worker.close()
+        self.worker_count = max(self.worker_count, len(self._workers))
+
+    def _drop_lost_workers(self, scheduler, queued_tasks, attempts):
+        """
+        Remove the workers that have been lost, giving their tasks to other workers, or reporting them as failed once
+        they have been lost with too many workers.
+
+        Yields : tuple
+        -------
+            (task, None, error) for each task reported as failed
+        """
+        for worker in [worker for worker in self._workers if worker.lost]:
+            worker.close()
+            self._workers.remove(worker)
+            if worker.task is None:
+                continue
+
+            task = worker.task
+            filename = task[0]
+            attempts[filename] = attempts.get(filename, 0) + 1
+            if attempts[filename] >= self._max_attempts:
+                scheduler.task_done(task, time.time() - worker.assign_time, None)
+                yield task, None, "The worker {0} was lost while converting the file, for the {1} time" \
+                    .format(worker.name, _ordinal(attempts[filename]))
+            else:
+                logger.warning("The worker {0} was lost while converting file '{1}'. Giving the file to another "
+                               "worker...".format(worker.name, filename))
+                queued_tasks.append(task)
+
+    def _map_dependency(self, worker, dependency):
+        # The files staged on the worker are tracked as the files staged on the coordinator
+        if worker.input_dir and dependency.startswith(os.path.join(worker.input_dir, '')):
+            return os.path.join(self._input_dir, dependency[len(worker.input_dir) + 1:])
+        return dependency
+
+
+class _RemoteWorker:
+    """
+    The coordinator's handle on a connected worker.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.name = None
+        self.input_dir = None
+        self.task = None
+        self.assign_time = None
+        self.last_seen_time = time.time()
+        self.lost = False
+
+    def assign(self, task, source):
+        self.task = task
+        self.assign_time = self.last_seen_time = time.time()
+        self.send(("task", task[0], source, task[1]))
+
+    def send(self, message):
+        try:
+            self.connection.send(message)
+        except (OSError, ValueError):
+            self.lost = True
+
+    def receive(self):
+        """
+        Receive a message from the worker.
+
+        Returns
+        -------
+        The message, or None if the worker has been lost, or the message is a heartbeat : tuple
+        """
+        try:
+            message = self.connection.recv()
+        except (EOFError, OSError, ValueError) as error:
+            if self.name:
+                logger.warning("The worker {0} has disconnected. {1}".format(self.name, error))
+            self.lost = True
+            return None
+
+        self.last_seen_time = time.time()
+        if message[0] == "hello":
+            _, self.name, self.input_dir = message
+        elif message[0] == "result":
+            self.task = None
+        elif message[0] != "heartbeat":
+            logger.warning("Unexpected message from the worker {0}: {1}".format(self.name, message[0]))
+            return None
+        return message
+
+    def close(self):
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+
+
+def run_workers(address, authkey, process_count=1, connect_timeout=30.0, bytecode_cache_dir=None):
+    """
+    Run worker processes converting the tasks pulled from a coordinator, until the coordinator has no more task.
+
+    A worker process that crashes, or that is abandoned by the coordinator in the middle of a conversion, e.g. after a
+    timeout, is replaced.
+
+    Parameters
+    ----------
+    address : tuple(str, int) or str
+        The address of the coordinator
+    authkey : bytes
+        The key to authenticate with
+    process_count : int
+        The number of worker processes, each converting one file at a time
+    connect_timeout : float
+        The duration, in seconds, to keep trying to connect, e.g. if the coordinator has not started yet
+    bytecode_cache_dir : str
+        The local directory to cache the code of the files in, if any, instead of the coordinator's
+
+    Raises
+    ------
+    OSError
+        If no worker process could connect to the coordinator
+    """
+    context = multiprocessing.get_context()
+    log_queue = get_process_queue(context)
+
+    def start_process():
+        process = context.Process(target=_run_worker_process,
+                                  args=(address, authkey, connect_timeout, bytecode_cache_dir, log_queue,
+                                        logging.getLogger().getEffectiveLevel()))
+        process.start()
+        return process
+
+    processes = [start_process() for _ in range(max(1, process_count))]
+    connected = False
+    while processes:
+        wait([process.sentinel for process in processes])
+        for process in [process for process in processes if process.exitcode is not None]:
+            processes.remove(process)
+            if process.exitcode == 0:
+                connected = True
+            elif process.exitcode != _CONNECTION_FAILED_EXIT_CODE:
+                connected = True
+                logger.warning("The worker process {0} has exited with code {1}. Starting another one..."
+                               .format(process.pid, process.exitcode))
+                processes.append(start_process())
+
+    if not connected:
+        raise OSError("No worker process could connect to the coordinator.")
+
+
+# The exit code of a worker process that cannot connect to the coordinator, which is not replaced
+_CONNECTION_FAILED_EXIT_CODE = 2
+
+
+def _run_worker_process(address, authkey, connect_timeout, bytecode_cache_dir, log_queue, log_level):
+    configure_worker_logging(log_queue, log_level)
+    try:
+        file_count = _run_worker(address, authkey, connect_timeout, bytecode_cache_dir)
+    except (OSError, EOFError) as error:
+        logger.error("Cannot connect to the coordinator on {0}. {1}".format(address, error))
+        sys.exit(_CONNECTION_FAILED_EXIT_CODE)
+    logger.info("Converted {0} files for the coordinator.".format(file_count))
+
+
+def _run_worker(address, authkey, connect_timeout, bytecode_cache_dir):
+    """
+    The main loop of a worker: pull a task, stage its file, convert it, and push back the result. If the coordinator
+    disconnects the worker, e.g. after a timeout, the worker connects again.
+
+    Returns
+    -------
+    The number of files converted : int
+    """
+    name = "{0}:{1}".format(socket.gethostname(), os.getpid())
+    input_dir = os.path.abspath("input")
+    if not os.path.isdir(input_dir):
+        os.makedirs(input_dir)
+
+    file_count = 0
+    connected = False
+    while True:
+        try:
+            connection = _connect(address, authkey, connect_timeout)
+        except (OSError, EOFError):
+            if not connected:
+                raise
+            logger.info("The coordinator has stopped.")
+            break
+        connected = True
+
+        try:
+            done, converted_count = _serve(connection, name, input_dir, bytecode_cache_dir)
+        finally:
+            connection.close()
+        file_count += converted_count
+        if done:
+            break
+        logger.warning("The coordinator has disconnected. Connecting again...")
+    return file_count
+
+
+def _serve(connection, name, input_dir, bytecode_cache_dir):
+    """
+    Convert the tasks sent by the coordinator on a connection.
+
+    Returns
+    -------
+    True if the coordinator has no more task, or False if it has disconnected, and the number of files converted :
+    tuple(bool, int)
+    """
+    send_lock = threading.Lock()
+    connection.send(("hello", name, input_dir))
+
+    file_count = 0
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return False, file_count
+        if message[0] != "task":
+            return True, file_count
+
+        _, filename, source, options = message
+        if options.bytecode_cache_dir:
+            options.bytecode_cache_dir = bytecode_cache_dir
+        write_file(os.path.join(input_dir, filename), source)
+
+        converted = threading.Event()
+        heartbeat_thread = threading.Thread(target=_send_heartbeats, args=(connection, send_lock, converted))
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+        _reset_peak_memory()
+        start_time = time.time()
+        result = convert_file(filename, options)
+        duration = time.time() - start_time
+
+        converted.set()
+        heartbeat_thread.join()
+        try:
+            with send_lock:
+                connection.send(("result", result, duration, _get_peak_memory()))
+        except (OSError, ValueError):
+            return False, file_count
+        file_count += 1
+
+
+def _connect(address, authkey, connect_timeout):
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except (OSError, EOFError):
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+
+
+def _send_heartbeats(connection, send_lock, converted):
+    # The coordinator sends nothing during a conversion, unless it stops, and the connection only becomes readable if
+    # the coordinator closes it, e.g. after a timeout. The conversion is then abandoned.
+    while not converted.wait(HEARTBEAT_INTERVAL):
+        try:
+            abandoned = connection.poll()
+            if not abandoned:
+                with send_lock:
+                    connection.send(("heartbeat",))
+        except (OSError, ValueError):
+            abandoned = True
+        if abandoned and not converted.is_set():
+            logger.warning("The coordinator has abandoned the conversion. Exiting...")
+            os._exit(1)
+
+
+def _ordinal(number):
+    return {1: "first", 2: "second", 3: "third"}.get(number, "{0}th".format(number))
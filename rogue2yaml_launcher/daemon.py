@@ -0,0 +1,507 @@
+# Serve the conversions from a long-lived daemon, which keeps pyrogue and the settings loaded between the requests
+
+import os
+import hmac
+import json
+import stat
+import time
+import shutil
+import socket
+import ipaddress
+import threading
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from rogue2yaml.output_writer import write_file
+from rogue2yaml.sidecar import SIDECAR_FORMATS
+from rogue2yaml_launcher.conversion import ConversionOptions, ConversionResult, convert_class, convert_file
+from rogue2yaml_launcher.dependencies import get_file_signature
+from rogue2yaml_launcher.discovery import _compile_exclusions, _find_root, _is_selected
+from rogue2yaml_launcher.preflight import BROKEN, HARDWARE_MODULES, NEEDS_STUB, classify_file
+from rogue2yaml_launcher.worker_pool import WorkerPool
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The number of requests handled at the same time. The requests beyond it are rejected, to be retried by the clients.
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+
+# The number of seconds the clients of a rejected request are told to wait before retrying it
+RETRY_AFTER_SECONDS = 1
+
+_YAML_CONTENT_TYPE = "text/yaml; charset=utf-8"
+_JSON_CONTENT_TYPE = "application/json"
+_METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestError(Exception):
+    """
+    A request that cannot be served, with the HTTP status to answer it with.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ConversionService:
+    """
+    Convert the requested files and classes in a warm worker process, which keeps the modules imported by the previous
+    conversions until their source files change.
+
+    The worker is forked from a template process that has already imported pyrogue, and is replaced if a conversion
+    crashes it or times out, or if a source file it has imported changes. The conversions run one at a time, as the
+    imported modules are shared by the conversions of the worker. The requests waiting for a conversion count toward
+    the concurrency limit.
+    """
+    def __init__(self, exclusions=None, bytecode_cache_dir=None,
+                 max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS, preflight=True, task_timeout=0,
+                 output_root="output", input_dirs=None):
+        """
+        Initialize the service.
+
+        Parameters
+        ----------
+        exclusions : dict
+            The reasons why files must not be converted, keyed by the file names, glob patterns, paths and regular
+            expressions of the files, as in the settings
+        bytecode_cache_dir : str
+            If provided, the directory to cache the code objects of the staged files in, by content
+        max_concurrent_requests : int
+            The number of conversion requests handled at the same time, beyond which the requests are rejected
+        preflight : bool
+            True to classify each file before converting it, stubbing the hardware modules it needs
+        task_timeout : float
+            The duration, in seconds, beyond which a conversion is abandoned, and its worker replaced. 0 means no limit.
+        output_root : str
+            The directory the outputs are written under. The relative output paths of the requests are relative to it,
+            and the requests writing elsewhere are rejected.
+        input_dirs : list
+            The input roots the paths of the exclusions are relative to
+        """
+        self.exclusions = dict(exclusions or {})
+        self.output_root = os.path.realpath(os.path.expandvars(os.path.expanduser(output_root)))
+        self.input_dirs = list(input_dirs or [])
+        self._compiled_exclusions = _compile_exclusions(list(self.exclusions))
+        self.bytecode_cache_dir = bytecode_cache_dir
+        self.max_concurrent_requests = max_concurrent_requests
+        self.preflight = preflight
+        self.task_timeout = task_timeout
+
+        self._slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self._conversion_lock = threading.Lock()
+        self._start_time = time.time()
+        self._pool = None
+
+        # The signatures of the source files the worker has imported, the staged files it has imported, and the source
+        # of each staged file, with its signature when staged
+        self._signatures = {}
+        self._loaded_files = set()
+        self._staged_files = {}
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = OrderedDict([("requests_total", 0), ("conversions_succeeded_total", 0),
+                                     ("conversions_failed_total", 0), ("requests_rejected_total", 0),
+                                     ("requests_in_flight", 0), ("conversion_seconds_sum", 0.0),
+                                     ("worker_restarts_total", 0)])
+
+    def start(self):
+        """
+        Start the worker, so that the first request does not wait for pyrogue to be imported.
+        """
+        with self._conversion_lock:
+            self._start_worker()
+
+    def close(self):
+        """
+        Stop the worker.
+        """
+        with self._conversion_lock:
+            if self._pool:
+                self._pool.close()
+                self._pool = None
+
+    def convert(self, request):
+        """
+        Serve a conversion request.
+
+        Parameters
+        ----------
+        request : dict
+            Either "path", the path of a Rogue Python file, or "module" and "class", the class of an importable module,
+            to convert. Optionally, "output", the path of the CPSW YAML file or of its directory, to write the outputs
+            to instead of returning the CPSW YAML contents, "sidecar", a list of sidecar formats, and "address_map", to
+            also write the address maps.
+
+        Returns
+        -------
+        The HTTP status, content type and body of the response : tuple(int, str, bytes)
+
+        Raises
+        ------
+        RequestError
+            If the request is invalid, or if too many requests are already being handled
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count("requests_rejected_total")
+            raise RequestError(503, "Too many concurrent requests. Retry in {0} second(s).".format(RETRY_AFTER_SECONDS))
+
+        self._count("requests_total")
+        self._count("requests_in_flight")
+        try:
+            options = self._get_options(request)
+            start_time = time.time()
+            result = self._convert(request, options)
+            duration = time.time() - start_time
+            self._count("conversions_succeeded_total" if result.succeeded else "conversions_failed_total")
+            self._count("conversion_seconds_sum", duration)
+            return self._respond(request, result, duration)
+        finally:
+            self._count("requests_in_flight", -1)
+            self._slots.release()
+
+    def get_health(self):
+        """
+        Get the health of the service.
+
+        Returns
+        -------
+        The status, uptime and load of the service : OrderedDict
+        """
+        with self._metrics_lock:
+            in_flight = self._metrics["requests_in_flight"]
+        return OrderedDict([("status", "ok"), ("uptime", round(time.time() - self._start_time, 3)),
+                            ("requests_in_flight", in_flight),
+                            ("max_concurrent_requests", self.max_concurrent_requests)])
+
+    def render_metrics(self):
+        """
+        Render the metrics of the service in the Prometheus text format.
+
+        Returns
+        -------
+        The metrics : str
+        """
+        with self._metrics_lock:
+            metrics = list(self._metrics.items())
+        lines = []
+        for name, value in metrics + [("uptime_seconds", time.time() - self._start_time)]:
+            metric_type = "gauge" if name in ("requests_in_flight", "uptime_seconds") else "counter"
+            lines.append("# TYPE rogue2yaml_{0} {1}".format(name, metric_type))
+            lines.append("rogue2yaml_{0} {1}".format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def _count(self, name, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def _get_options(self, request):
+        if not isinstance(request, dict):
+            raise RequestError(400, "The request must be a JSON object.")
+
+        sidecar_formats = request.get("sidecar") or ()
+        unknown_formats = [sidecar_format for sidecar_format in sidecar_formats
+                           if sidecar_format not in SIDECAR_FORMATS]
+        if unknown_formats:
+            raise RequestError(400, "Unknown sidecar format(s) {0}. Choose from {1}."
+                               .format(', '.join(unknown_formats), ', '.join(sorted(SIDECAR_FORMATS))))
+        address_map = bool(request.get("address_map"))
+        if (sidecar_formats or address_map) and not request.get("output"):
+            raise RequestError(400, "The sidecars and the address maps can only be written to an output path.")
+        if request.get("output"):
+            # Rejected before the conversion, rather than once converted
+            self._resolve_output(request["output"])
+        return ConversionOptions(sidecar_formats=sidecar_formats, address_map=address_map,
+                                 bytecode_cache_dir=self.bytecode_cache_dir)
+
+    def _convert(self, request, options):
+        if request.get("path"):
+            path = os.path.abspath(os.path.expandvars(os.path.expanduser(request["path"])))
+            filename = os.path.basename(path)
+            if not filename.endswith(".py"):
+                raise RequestError(400, "The file '{0}' is not a Python file.".format(path))
+            if not os.path.isfile(path):
+                raise RequestError(404, "The file '{0}' does not exist.".format(path))
+            reason = self._get_exclusion_reason(path)
+            if reason is not None:
+                return ConversionResult(filename[:-3], False, reason)
+
+            with self._conversion_lock:
+                self._restart_worker_if_changed()
+                staged_path = self._stage(path, filename)
+                if self.preflight:
+                    verdict = classify_file(staged_path)
+                    if verdict.verdict == BROKEN:
+                        return ConversionResult(filename[:-3], False, "Preflight: " + verdict.reason)
+                    if verdict.verdict == NEEDS_STUB:
+                        options = options.with_stub_modules(HARDWARE_MODULES)
+                self._loaded_files.add(filename)
+                return self._run((filename, options, None))
+
+        if request.get("module") and request.get("class"):
+            with self._conversion_lock:
+                self._restart_worker_if_changed()
+                return self._run((request["class"] + ".py", options, request["module"]))
+
+        raise RequestError(400, "The request must name either a 'path', or a 'module' and a 'class', to convert.")
+
+    def _get_exclusion_reason(self, path):
+        """
+        Match a file against the exclusions the same way as the launcher does, relative to its input root.
+        """
+        root = _find_root(path, self.input_dirs)
+        if _is_selected(path, root, self._compiled_exclusions, (), ()):
+            return None
+        for exclusion, reason in self.exclusions.items():
+            if not _is_selected(path, root, _compile_exclusions([exclusion]), (), ()):
+                return reason
+
+    def _resolve_output(self, output):
+        """
+        Resolve the output path of a request, relative to the output root, following the symbolic links.
+
+        Returns
+        -------
+        The absolute output path, and whether it is a directory : tuple(str, bool)
+        """
+        output = os.path.join(self.output_root, os.path.expandvars(os.path.expanduser(output)))
+        is_dir = os.path.isdir(output) or output.endswith(os.sep)
+        output = os.path.realpath(output)
+        if output != self.output_root and not output.startswith(os.path.join(self.output_root, '')):
+            raise RequestError(403, "The output '{0}' is not under the output directory '{1}' of the daemon."
+                               .format(output, self.output_root))
+        return output, is_dir
+
+    def _run(self, task):
+        if not self._pool:
+            self._start_worker()
+        for _, result, error in self._pool.imap_unordered([task]):
+            if error:
+                # The worker has been stopped by the pool, and is replaced ahead of the next request
+                logger.error("Cannot convert '{0}'. {1}.".format(task[0], error))
+                self._reset_worker_state()
+                self._count("worker_restarts_total")
+                self._start_worker()
+                return ConversionResult(task[0][:-3], False, error)
+            for dependency in result.dependencies:
+                if dependency not in self._signatures:
+                    self._signatures[dependency] = get_file_signature(dependency)
+            return result
+
+    def _stage(self, path, filename):
+        """
+        Copy a file into the "input" directory, unless the same unchanged file is already staged. Replace the worker if
+        it has imported the previous version of the file.
+        """
+        staged_path = os.path.join("input", filename)
+        previous_path, previous_signature = self._staged_files.get(filename, (None, None))
+        signature = get_file_signature(path, previous_signature if previous_path == path else None)
+        if previous_path == path and signature == previous_signature and os.path.isfile(staged_path):
+            return staged_path
+
+        if filename in self._loaded_files:
+            logger.info("Restarting the worker, as the file '{0}' has changed.".format(filename))
+            self._restart_worker()
+        if not os.path.isdir("input"):
+            os.makedirs("input")
+        shutil.copyfile(path, staged_path)
+        self._staged_files[filename] = (path, signature)
+        return staged_path
+
+    def _restart_worker_if_changed(self):
+        for filename, signature in self._signatures.items():
+            current_signature = get_file_signature(filename, signature)
+            if current_signature is None or current_signature.get("sha1") != signature.get("sha1"):
+                logger.info("Restarting the worker, as the source file '{0}' has changed.".format(filename))
+                self._restart_worker()
+                return
+
+    def _start_worker(self):
+        if not self._pool:
+            self._pool = WorkerPool(_convert_request, 1, task_timeout=self.task_timeout)
+        self._pool.start()
+
+    def _restart_worker(self):
+        if self._pool:
+            self._pool.close()
+        self._reset_worker_state()
+        self._count("worker_restarts_total")
+        self._start_worker()
+
+    def _reset_worker_state(self):
+        self._signatures.clear()
+        self._loaded_files.clear()
+
+    def _respond(self, request, result, duration):
+        if not result.succeeded:
+            return 422, _JSON_CONTENT_TYPE, _dump_json(OrderedDict([("succeeded", False), ("name", result.filename),
+                                                                    ("message", result.message)]))
+
+        output = request.get("output")
+        if not output:
+            return 200, _YAML_CONTENT_TYPE, result.contents.encode("utf-8")
+
+        output, is_dir = self._resolve_output(output)
+        if is_dir:
+            output = os.path.join(output, '.'.join([result.filename, "yaml"]))
+        output_dir = os.path.dirname(output)
+        written_files = [output]
+        try:
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            write_file(output, result.contents)
+            for sidecar_filename, sidecar_contents in result.sidecars.items():
+                written_files.append(os.path.join(output_dir, sidecar_filename))
+                write_file(written_files[-1], sidecar_contents)
+        except (IOError, OSError) as error:
+            raise RequestError(500, "Cannot write the output file '{0}'. {1}".format(written_files[-1], error))
+        return 200, _JSON_CONTENT_TYPE, _dump_json(OrderedDict([("succeeded", True), ("name", result.filename),
+                                                                ("files", written_files),
+                                                                ("duration", round(duration, 6))]))
+
+
+def _convert_request(filename, options, module_name=None):
+    """
+    Convert a staged file, or a class of a module if a module name is provided, in the worker process.
+    """
+    if module_name:
+        return convert_class(module_name, filename[:-3], options)
+    return convert_file(filename, options)
+
+
+def create_server(address, service, authkey=None):
+    """
+    Create the HTTP server of a conversion service, on a local address.
+
+    The Unix socket is only accessible to the user running the daemon. As any local user can connect to a TCP socket,
+    its requests must carry the key, as a bearer token.
+
+    Parameters
+    ----------
+    address : tuple(str, int) or str
+        Either the host and the port of a loopback TCP socket, e.g. ("localhost", 8765), or the path of a Unix socket
+    service : ConversionService
+        The service to serve the requests with
+    authkey : bytes
+        The key the requests authenticate with, e.g. from get_authkey(). Required on a TCP socket.
+
+    Returns
+    -------
+    The server, whose requests are served by threads once serve_forever() is called : socketserver.BaseServer
+
+    Raises
+    ------
+    ValueError
+        If the TCP host is not a loopback address, or if no key is provided for a TCP socket
+    """
+    if isinstance(address, tuple):
+        if not _is_loopback(address[0]):
+            raise ValueError("The daemon only listens on the loopback addresses, not on '{0}'.".format(address[0]))
+        if not authkey:
+            raise ValueError("A key is required to listen on a TCP socket, which any local user can connect to.")
+        server = _ThreadingHTTPServer(address, _RequestHandler)
+    else:
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            # Left by a daemon that has not been shut down
+            os.remove(address)
+        server = _UnixHTTPServer(address, _RequestHandler)
+        os.chmod(address, 0o600)
+    server.service = service
+    server.authkey = authkey
+    return server
+
+
+def _is_loopback(host):
+    try:
+        return all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback
+                   for info in socket.getaddrinfo(host, None))
+    except (socket.error, ValueError):
+        return False
+
+
+def _dump_json(value):
+    return json.dumps(value, indent=1).encode("utf-8")
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Answer the conversion, health and metrics requests.
+    """
+    server_version = "rogue2yaml"
+
+    def do_GET(self):
+        if not self._is_authorized():
+            return
+        if self.path == "/health":
+            self._send(200, _JSON_CONTENT_TYPE, _dump_json(self.server.service.get_health()))
+        elif self.path == "/metrics":
+            self._send(200, _METRICS_CONTENT_TYPE, self.server.service.render_metrics().encode("utf-8"))
+        else:
+            self._send_error(RequestError(404, "Unknown endpoint '{0}'.".format(self.path)))
+
+    def do_POST(self):
+        if not self._is_authorized():
+            return
+        if self.path != "/convert":
+            self._send_error(RequestError(404, "Unknown endpoint '{0}'.".format(self.path)))
+            return
+        try:
+            content_type = (self.headers.get("Content-Type") or "").split(';')[0].strip().lower()
+            if content_type != _JSON_CONTENT_TYPE:
+                raise RequestError(415, "The request must be of the content type '{0}'.".format(_JSON_CONTENT_TYPE))
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+            except ValueError as error:
+                raise RequestError(400, "The request is not valid JSON. {0}".format(error))
+            self._send(*self.server.service.convert(request))
+        except RequestError as error:
+            self._send_error(error)
+        except Exception as error:
+            logger.error("Unexpected exception while serving a request. Exception type: {0}. Exception: {1}"
+                         .format(type(error), error))
+            self._send_error(RequestError(500, "Unexpected exception. {0}".format(error)))
+
+    def log_message(self, format, *args):
+        # The client address of a Unix socket is empty
+        logger.debug(format % args)
+
+    def _is_authorized(self):
+        if not self.server.authkey:
+            return True
+        authorization = self.headers.get("Authorization") or ""
+        if authorization.startswith("Bearer ") and hmac.compare_digest(authorization[7:].strip().encode("utf-8"),
+                                                                        self.server.authkey):
+            return True
+        self._send_error(RequestError(401, "The request must carry the key of the daemon, as a bearer token."))
+        return False
+
+    def _send_error(self, error):
+        headers = {"Retry-After": str(RETRY_AFTER_SECONDS)} if error.status == 503 else {}
+        if error.status == 401:
+            headers["WWW-Authenticate"] = "Bearer"
+        self._send(error.status, _JSON_CONTENT_TYPE,
+                   _dump_json(OrderedDict([("succeeded", False), ("message", error.message)])), headers)
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
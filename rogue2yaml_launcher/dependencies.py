@@ -0,0 +1,196 @@
+# Track the source files each converted file depends on, to reconvert only the outputs whose sources have changed
+
+import os
+import sys
+import json
+import hashlib
+
+from rogue2yaml.output_writer import write_file
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The dependency manifest is kept in the output directory, next to the outputs it describes
+DEPENDENCY_MANIFEST_FILENAME = ".rogue2yaml_dependencies.json"
+
+DEPENDENCY_MANIFEST_VERSION = 1
+
+
+def find_source_files(pyrogue_device, module_names_before=()):
+    """
+    Find the source files of the modules a device has been built from.
+
+    These are the modules imported while building the device, and the modules defining the classes, and their base
+    classes, of every node of the device hierarchy. The latter also catch the modules already imported by a previous
+    conversion in the same process.
+
+    Parameters
+    ----------
+    pyrogue_device : pyrogue.Device
+        The device
+    module_names_before : set
+        The names of the modules imported before building the device
+
+    Returns
+    -------
+    The absolute paths of the source files, which include library files, e.g. pyrogue's : set
+    """
+    module_names = set(name for name in list(sys.modules) if name not in module_names_before)
+
+    nodes = [pyrogue_device]
+    while nodes:
+        node = nodes.pop()
+        for cls in type(node).__mro__:
+            module_names.add(cls.__module__)
+        children = getattr(node, "nodes", None)
+        if isinstance(children, dict):
+            nodes.extend(children.values())
+
+    source_files = set()
+    for name in module_names:
+        filename = getattr(sys.modules.get(name), "__file__", None)
+        if filename and filename.endswith(".py"):
+            source_files.add(os.path.abspath(filename))
+    return source_files
+
+
+def get_file_signature(filename, previous_signature=None):
+    """
+    Get the signature of a file, to detect its changes.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file
+    previous_signature : dict
+        The previous signature of the file, if any. If the file has the same modification time and size, the content
+        hash is reused instead of being computed again.
+
+    Returns
+    -------
+    The modification time, size and content hash of the file, or None if the file does not exist : dict
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    signature = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    if previous_signature and previous_signature.get("mtime_ns") == signature["mtime_ns"] and \
+            previous_signature.get("size") == signature["size"]:
+        signature["sha1"] = previous_signature.get("sha1")
+        return signature
+
+    with open(filename, 'rb') as source_file:
+        signature["sha1"] = hashlib.sha1(source_file.read()).hexdigest()
+    return signature
+
+
+class DependencyManifest:
+    """
+    The source files each output has been converted from, with their signatures at the time of the conversion.
+    """
+    def __init__(self, filename):
+        """
+        Load the dependency manifest, if it exists.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the dependency manifest file
+        """
+        self.filename = filename
+        self._outputs = {}
+        self._modified = False
+
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as manifest_file:
+                    manifest = json.load(manifest_file)
+                if manifest.get("version") == DEPENDENCY_MANIFEST_VERSION:
+                    self._outputs = manifest.get("outputs", {})
+            except (OSError, ValueError) as error:
+                logger.warning("Ignoring the dependency manifest '{0}', which cannot be read. {1}"
+                               .format(filename, error))
+
+    def get_changed_dependencies(self, output_filename):
+        """
+        Get the source files of an output that have changed since its conversion.
+
+        Parameters
+        ----------
+        output_filename : str
+            The name of the output file, e.g. "AxiVersion.yaml"
+
+        Returns
+        -------
+        The changed or removed source files, or None if the dependencies of the output are unknown : list
+        """
+        dependencies = self._outputs.get(output_filename)
+        if dependencies is None:
+            return None
+
+        changed_files = []
+        for source_filename, signature in dependencies.items():
+            current_signature = get_file_signature(source_filename, signature)
+            if current_signature is None or current_signature["sha1"] != signature.get("sha1"):
+                changed_files.append(source_filename)
+            elif current_signature != signature:
+                # Only touched, e.g. by a checkout. Keep the new time to avoid hashing the file again next time.
+                dependencies[source_filename] = current_signature
+                self._modified = True
+        return changed_files
+
+    def record(self, output_filename, source_files):
+        """
+        Record the source files an output has just been converted from.
+
+        Parameters
+        ----------
+        output_filename : str
+            The name of the output file
+        source_files : iterable
+            The names of the source files
+        """
+        dependencies = {}
+        for source_filename in sorted(source_files):
+            signature = get_file_signature(source_filename)
+            if signature is not None:
+                dependencies[source_filename] = signature
+        self._outputs[output_filename] = dependencies
+        self._modified = True
+
+    def forget(self, output_filename):
+        """
+        Forget the dependencies of an output, e.g. if it could not be written, so that it is converted again.
+
+        Parameters
+        ----------
+        output_filename : str
+            The name of the output file
+        """
+        if self._outputs.pop(output_filename, None) is not None:
+            self._modified = True
+
+    def update(self, other):
+        """
+        Add the dependencies of the outputs of another manifest, e.g. of another shard of the batch, replacing those of
+        the same outputs.
+
+        Parameters
+        ----------
+        other : DependencyManifest
+            The other manifest
+        """
+        if other._outputs:
+            self._outputs.update(other._outputs)
+            self._modified = True
+
+    def save(self):
+        """
+        Save the dependency manifest, if it has changed.
+        """
+        if self._modified:
+            write_file(self.filename, json.dumps({"version": DEPENDENCY_MANIFEST_VERSION, "outputs": self._outputs},
+                                                 indent=1, sort_keys=True))
+            self._modified = False
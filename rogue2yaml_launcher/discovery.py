@@ -0,0 +1,337 @@
+# Select the Rogue Python files to convert
+
+import os
+import re
+import sys
+import queue
+import threading
+from fnmatch import fnmatch
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCAN_THREAD_COUNT = 8
+
+# The prefix of the exclusions that are regular expressions, e.g. "re:^surf/.*Top$"
+REGEX_EXCLUSION_PREFIX = "re:"
+
+# The directories that never contain Rogue Python files to convert
+DEFAULT_IGNORED_DIRECTORIES = (".git", ".svn", ".hg", "__pycache__", "build", ".tox", ".venv", "*.egg-info")
+
+
+def find_rogue_files(roots, exclusion_list, manifest_paths=None, include_patterns=(), exclude_patterns=(),
+                     thread_count=DEFAULT_SCAN_THREAD_COUNT, ignored_directories=DEFAULT_IGNORED_DIRECTORIES):
+    """
+    Find the Rogue Python files to convert.
+
+    If a manifest is given, only the paths it lists are considered, and the input roots are never scanned. Otherwise,
+    every input root is scanned. The files are yielded as soon as they are found.
+
+    Parameters
+    ----------
+    roots : list
+        The directories that contain the Rogue Python files
+    exclusion_list : list
+        The files to be excluded from being converted. Each exclusion is either a file name without the ".py"
+        extension, e.g. "AxiVersion", a glob pattern, e.g. "*TopLevel*", a path, e.g. "surf/axi/AxiVersion.py", or a
+        regular expression prefixed with "re:", e.g. "re:^surf/.*Top$". The patterns and regular expressions are
+        matched against the file name and the path relative to its input root, both without the ".py" extension.
+    manifest_paths : list
+        The file and directory paths to consider instead of walking the input roots
+    include_patterns : list
+        If given, only select the files whose path, relative to their input root, or name matches one of these glob
+        patterns
+    exclude_patterns : list
+        Do not select the files whose path, relative to their input root, or name matches one of these glob patterns
+    thread_count : int
+        The number of threads scanning the directories
+    ignored_directories : list
+        The glob patterns of the names of the directories to prune from the scan
+
+    Yields : str
+    -------
+        The path of the next selected Rogue Python file
+    """
+    roots = [os.path.expandvars(os.path.expanduser(root)) for root in roots]
+
+    if manifest_paths is None:
+        candidates = scan_files(roots, thread_count, ignored_directories)
+    else:
+        candidates = _resolve_manifest_paths(manifest_paths, roots, thread_count, ignored_directories)
+
+    exclusions = _compile_exclusions(exclusion_list)
+    for root, path in candidates:
+        if _is_selected(path, root, exclusions, include_patterns, exclude_patterns):
+            yield path
+
+
+def read_manifest(manifest_filename):
+    """
+    Read the list of paths to convert from a manifest file, one path per line. Blank lines and lines starting with '#'
+    are ignored.
+
+    Parameters
+    ----------
+    manifest_filename : str
+        The name of the manifest file, or '-' to read the list from the standard input
+
+    Returns
+    -------
+    The listed paths : list
+    """
+    if manifest_filename == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(os.path.expandvars(os.path.expanduser(manifest_filename)), 'r') as manifest_file:
+            lines = manifest_file.readlines()
+
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+def scan_files(directories, thread_count=DEFAULT_SCAN_THREAD_COUNT, ignored_directories=()):
+    """
+    Find all the files under some directory trees, scanning the subdirectories concurrently.
+
+    The files are yielded as soon as they are found, so that the caller can start working on them before the scan
+    finishes. The order of the files is therefore not deterministic.
+
+    Like os.walk(), symbolic links to directories are not followed.
+
+    Parameters
+    ----------
+    directories : list
+        The top directories to scan
+    thread_count : int
+        The number of scanning threads
+    ignored_directories : list
+        The glob patterns of the names of the directories to prune from the scan
+
+    Yields : tuple
+    -------
+        (top directory, path) for the next file found
+    """
+    directory_queue = queue.Queue()
+    file_queue = queue.Queue()
+    stop_event = threading.Event()
+
+    # The number of directories queued or being scanned. The scan is over when it drops to 0.
+    pending_directories = [0]
+    pending_lock = threading.Lock()
+
+    def queue_directory(top_directory, directory):
+        with pending_lock:
+            pending_directories[0] += 1
+        directory_queue.put((top_directory, directory))
+
+    def scan():
+        while not stop_event.is_set():
+            item = directory_queue.get()
+            if item is None:
+                break
+            top_directory, directory = item
+            try:
+                # Hand the files over one directory at a time to keep the queueing overhead low
+                paths = []
+                for entry in os.scandir(directory):
+                    try:
+                        is_directory = entry.is_dir()
+                    except OSError:
+                        is_directory = False
+                    if not is_directory:
+                        paths.append(entry.path)
+                    elif not entry.is_symlink() and \
+                            not any(fnmatch(entry.name, pattern) for pattern in ignored_directories):
+                        queue_directory(top_directory, entry.path)
+                if paths:
+                    file_queue.put((top_directory, paths))
+            except OSError as error:
+                logger.error("Cannot scan the directory '{0}'. Exception: {1}".format(directory, error))
+            finally:
+                with pending_lock:
+                    pending_directories[0] -= 1
+                    scan_finished = not pending_directories[0]
+                if scan_finished:
+                    file_queue.put(None)
+
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+    if not directories:
+        return
+    for directory in directories:
+        queue_directory(directory, directory)
+
+    threads = []
+    for _ in range(max(1, thread_count)):
+        thread = threading.Thread(target=scan)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    try:
+        while True:
+            item = file_queue.get()
+            if item is None:
+                break
+            top_directory, paths = item
+            for path in paths:
+                yield top_directory, path
+    finally:
+        stop_event.set()
+        for _ in threads:
+            directory_queue.put(None)
+
+
+def _resolve_manifest_paths(manifest_paths, roots, thread_count, ignored_directories):
+    """
+    Resolve the paths listed in a manifest. A relative path is looked up from the working directory first, then from
+    each input root. A directory path is scanned.
+
+    Parameters
+    ----------
+    manifest_paths : list
+        The paths listed in the manifest
+    roots : list
+        The input roots
+    thread_count : int
+        The number of threads scanning the directories
+    ignored_directories : list
+        The glob patterns of the names of the directories to prune from the scan
+
+    Yields : tuple
+    -------
+        (root, path) for the next file, where root is the directory the path is considered relative to
+    """
+    for manifest_path in manifest_paths:
+        manifest_path = os.path.expandvars(os.path.expanduser(manifest_path))
+        candidates = [manifest_path]
+        if not os.path.isabs(manifest_path):
+            candidates += [os.path.join(root, manifest_path) for root in roots]
+
+        for path in candidates:
+            if os.path.isdir(path):
+                # The files are relative to the input root containing the directory, or to the directory itself
+                directory_root = _find_root(os.path.join(path, os.curdir), roots)
+                for _, file_path in scan_files([path], thread_count, ignored_directories):
+                    yield directory_root, file_path
+                break
+            elif os.path.isfile(path):
+                yield _find_root(path, roots), path
+                break
+        else:
+            logger.error("Cannot find the manifest path '{0}'.".format(manifest_path))
+
+
+def _find_root(path, roots):
+    """
+    Find the input root a file is under.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    roots : list
+        The input roots
+
+    Returns
+    -------
+    The input root containing the file, or the directory of the file if it is not under any input root : str
+    """
+    absolute_path = os.path.abspath(path)
+    for root in roots:
+        absolute_root = os.path.abspath(root)
+        if absolute_path.startswith(os.path.join(absolute_root, '')):
+            return root
+    return os.path.dirname(path)
+
+
+def _compile_exclusions(exclusion_list):
+    """
+    Compile the exclusions, so that the file names are looked up in a set, and only the patterns, paths and
+    regular expressions are matched one by one.
+
+    Parameters
+    ----------
+    exclusion_list : list
+        The file names, glob patterns, paths and regular expressions of the files to exclude
+
+    Returns
+    -------
+    The excluded file names, without the ".py" extension, and a function telling whether a file, given its name, its
+    path relative to its input root and its absolute path, all without the ".py" extension, matches any other
+    exclusion, or None if there is no other exclusion : tuple(set, callable)
+    """
+    names = set()
+    patterns = []
+    paths = []
+    regular_expressions = []
+    for exclusion in exclusion_list:
+        if exclusion.startswith(REGEX_EXCLUSION_PREFIX):
+            regular_expressions.append(re.compile(exclusion[len(REGEX_EXCLUSION_PREFIX):]))
+            continue
+
+        exclusion = exclusion.replace(os.sep, '/')
+        if exclusion.endswith(".py"):
+            exclusion = exclusion[:-3]
+        if any(character in exclusion for character in "*?["):
+            patterns.append(exclusion)
+        elif '/' in exclusion:
+            paths.append(exclusion if os.path.isabs(exclusion) else exclusion.strip('/'))
+        else:
+            names.add(exclusion)
+
+    if not patterns and not paths and not regular_expressions:
+        return names, None
+
+    def matches(name, relative_path, absolute_path):
+        if any(fnmatch(name, pattern) or fnmatch(relative_path, pattern) for pattern in patterns):
+            return True
+        if any(relative_path == path or relative_path.endswith('/' + path) or absolute_path == path
+               for path in paths):
+            return True
+        return any(regular_expression.search(name) or regular_expression.search(relative_path)
+                   for regular_expression in regular_expressions)
+
+    return names, matches
+
+
+def _is_selected(path, root, exclusions, include_patterns, exclude_patterns):
+    """
+    Check if a file is to be converted.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    root : str
+        The input root the file is under
+    exclusions : tuple
+        The compiled exclusions, as returned by _compile_exclusions()
+    include_patterns : list
+        If given, the file must match one of these glob patterns
+    exclude_patterns : list
+        The file must not match any of these glob patterns
+
+    Returns
+    -------
+    True if the file is to be converted; False otherwise : bool
+    """
+    filename = os.path.basename(path)
+    if filename[-3:] != ".py":
+        return False
+
+    excluded_names, matches_exclusion = exclusions
+    if filename[:-3] in excluded_names:
+        return False
+    if not include_patterns and not exclude_patterns and not matches_exclusion:
+        return True
+
+    relative_path = os.path.relpath(path, root).replace(os.sep, '/')
+    if matches_exclusion and matches_exclusion(filename[:-3], relative_path[:-3],
+                                               os.path.abspath(path)[:-3].replace(os.sep, '/')):
+        return False
+
+    def matches(patterns):
+        return any(fnmatch(relative_path, pattern) or fnmatch(filename, pattern) for pattern in patterns)
+
+    if include_patterns and not matches(include_patterns):
+        return False
+    return not matches(exclude_patterns)
@@ -0,0 +1,264 @@
+# Run the conversions on the threads or the subinterpreters of the launcher process, where the runtime allows them to
+# run in parallel, instead of in worker processes
+
+import sys
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from concurrent.futures import InterpreterPoolExecutor
+except ImportError:
+    InterpreterPoolExecutor = None
+
+from rogue2yaml_launcher.worker_pool import WorkerPool, _IteratorScheduler
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+ENGINE_AUTO = "auto"
+ENGINE_PROCESSES = "processes"
+ENGINE_THREADS = "threads"
+ENGINE_INTERPRETERS = "interpreters"
+ENGINES = (ENGINE_AUTO, ENGINE_PROCESSES, ENGINE_THREADS, ENGINE_INTERPRETERS)
+
+
+def is_free_threaded():
+    """
+    Check if the threads of this interpreter run Python code in parallel, i.e. on a free-threaded build of CPython with
+    the GIL disabled.
+
+    Returns
+    -------
+    True if the GIL is disabled : bool
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def select_engine(engine, task_timeout=0):
+    """
+    Resolve the engine to run the conversions with.
+
+    The automatic choice is the threads of the launcher process on a free-threaded build, unless the conversions have a
+    timeout, as only a worker process running a conversion can be stopped. Otherwise, it is worker processes.
+
+    Parameters
+    ----------
+    engine : str
+        One of ENGINES
+    task_timeout : float
+        The duration, in seconds, beyond which a conversion is abandoned. 0 means no limit.
+
+    Returns
+    -------
+    The engine, i.e. ENGINE_PROCESSES, ENGINE_THREADS or ENGINE_INTERPRETERS : str
+    """
+    if engine != ENGINE_AUTO:
+        return engine
+    if is_free_threaded() and not task_timeout:
+        return ENGINE_THREADS
+    return ENGINE_PROCESSES
+
+
+def create_pool(target, worker_count, engine=ENGINE_PROCESSES, **worker_pool_options):
+    """
+    Create the pool running the conversions with an engine, falling back to worker processes if the runtime does not
+    support the engine.
+
+    Parameters
+    ----------
+    target : callable
+        A module-level function to call with each task's arguments
+    worker_count : int
+        The number of conversions running at the same time
+    engine : str
+        One of ENGINES
+    worker_pool_options : dict
+        The options of the WorkerPool, if worker processes are used
+
+    Returns
+    -------
+    The pool, which provides imap_unordered() and close(), and is a context manager : WorkerPool or InProcessPool
+    """
+    engine = select_engine(engine, worker_pool_options.get("task_timeout", 0))
+    if engine == ENGINE_THREADS and not is_free_threaded():
+        logger.warning("The GIL of this Python build is enabled, so that the conversion threads will not run in "
+                       "parallel.")
+    if engine == ENGINE_INTERPRETERS:
+        try:
+            return InProcessPool(target, worker_count, engine)
+        except (RuntimeError, ImportError) as error:
+            logger.warning("Cannot convert in subinterpreters. Converting in worker processes instead. {0}"
+                           .format(error))
+            engine = ENGINE_PROCESSES
+    if engine == ENGINE_THREADS:
+        return InProcessPool(target, worker_count, engine)
+    return WorkerPool(target, worker_count, **worker_pool_options)
+
+
+class InProcessPool:
+    """
+    Run conversions on a pool of threads, or of subinterpreters, of the launcher process, which share a single copy of
+    the libraries in the former case.
+
+    The threads share the imported modules, so that the conversions stubbing the hardware modules, which change the
+    imported modules, run while no other conversion does. The subinterpreters each import their own modules, and
+    can only convert if all the imported extension modules, e.g. rogue's, support them.
+
+    Unlike with worker processes, a running conversion cannot be stopped, e.g. after a timeout.
+    """
+    def __init__(self, target, worker_count, engine=ENGINE_THREADS):
+        """
+        Initialize the pool.
+
+        Parameters
+        ----------
+        target : callable
+            A module-level function to call with each task's arguments
+        worker_count : int
+            The number of conversions running at the same time
+        engine : str
+            ENGINE_THREADS or ENGINE_INTERPRETERS
+
+        Raises
+        ------
+        RuntimeError
+            If the runtime does not support subinterpreters, or the conversion modules cannot be imported in them
+        """
+        self._target = target
+        self._worker_count = max(1, worker_count)
+        self._engine = engine
+        self._module_lock = _SharedExclusiveLock()
+
+        if engine == ENGINE_INTERPRETERS:
+            if InterpreterPoolExecutor is None:
+                raise RuntimeError("This version of Python does not provide subinterpreter pools.")
+            # The subinterpreters start with the default module search path, and logging level
+            self._executor = InterpreterPoolExecutor(self._worker_count, initializer=_initialize_interpreter,
+                                                     initargs=(list(sys.path),
+                                                               logging.getLogger().getEffectiveLevel()))
+            try:
+                # Import the conversion modules, and the Rogue libraries, in a subinterpreter first
+                self._executor.submit(_import_modules, _INTERPRETER_MODULES).result()
+            except Exception as error:
+                self._executor.shutdown(cancel_futures=True)
+                raise RuntimeError("Cannot import the conversion modules in a subinterpreter. {0}".format(error))
+        else:
+            self._executor = ThreadPoolExecutor(self._worker_count, thread_name_prefix="Converter")
+
+    def imap_unordered(self, tasks, scheduler=None):
+        """
+        Run the target on each task, yielding the outcomes as they complete. See WorkerPool.imap_unordered().
+
+        Yields : tuple
+        -------
+            (task, result, error). If the target raised an exception, result is None, and error describes it.
+        """
+        if scheduler is None:
+            scheduler = _IteratorScheduler(tasks)
+
+        running = {}
+        while True:
+            while not scheduler.exhausted and len(running) < self._worker_count:
+                task = scheduler.pop()
+                if task is None:
+                    break
+                if self._engine == ENGINE_INTERPRETERS:
+                    future = self._executor.submit(self._target, *task)
+                else:
+                    future = self._executor.submit(self._run_in_thread, task)
+                running[future] = task, time.time()
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, start_time = running.pop(future)
+                scheduler.task_done(task, time.time() - start_time, None)
+                result, error = None, None
+                try:
+                    result = future.result()
+                except Exception as exception:
+                    error = "The conversion raised an unexpected exception. Exception type: {0}. Exception: {1}" \
+                        .format(type(exception), exception)
+                yield task, result, error
+
+    def close(self):
+        """
+        Stop the pool, once the running conversions are complete.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run_in_thread(self, task):
+        # The options of a conversion are its second argument, which may require stubbing modules
+        options = task[1] if len(task) > 1 else None
+        if getattr(options, "stub_modules", None):
+            with self._module_lock.exclusive():
+                return self._target(*task)
+        with self._module_lock.shared():
+            return self._target(*task)
+
+
+# The modules the subinterpreters must be able to import to convert
+_INTERPRETER_MODULES = ("rogue2yaml.yaml_converter", "rogue2yaml_launcher.conversion")
+
+
+def _initialize_interpreter(sys_path, log_level):
+    sys.path[:] = sys_path
+    from rogue2yaml.converter_logging import configure_logging
+    configure_logging(level=log_level)
+
+
+def _import_modules(module_names):
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+class _SharedExclusiveLock:
+    """
+    A lock held either by any number of threads at once, or by a single thread. A thread waiting to hold it alone
+    keeps new threads from holding it together.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared_count = 0
+        self._exclusive = False
+        self._exclusive_waiting_count = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._exclusive or self._exclusive_waiting_count:
+                self._condition.wait()
+            self._shared_count += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared_count -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._exclusive_waiting_count += 1
+            while self._exclusive or self._shared_count:
+                self._condition.wait()
+            self._exclusive_waiting_count -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
@@ -0,0 +1,122 @@
+# Journal the outcome of each conversion as it completes, so that an interrupted batch can be resumed
+
+import os
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The journal is kept in the output directory, next to the outputs it describes
+JOURNAL_FILENAME = ".rogue2yaml_journal.jsonl"
+
+# The outcomes of the files
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class RunJournal:
+    """
+    An append-only journal of the conversion runs, with one JSON record per line.
+
+    Each run starts with a "start" record, then has one "outcome" record per file, written and synced as soon as the
+    file completes, and ends with an "end" record, unless it has been killed. A resumed run continues the batch of the
+    run it resumes, so the outcomes of a batch may be spread over several runs.
+    """
+    def __init__(self, filename):
+        """
+        Initialize the journal. Nothing is written until the run starts.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the journal file
+        """
+        self.filename = filename
+        self._file = None
+        self._batch = None
+
+    def load_last_batch(self):
+        """
+        Read the outcomes of the files of the last batch, i.e. of the last run and of the runs it resumes.
+
+        Returns
+        -------
+        The identifier of the last batch, or None if there is none, and the last outcome of each file of the batch, as
+        (outcome, message), keyed by file name : tuple(str, OrderedDict)
+        """
+        batch = None
+        outcomes = OrderedDict()
+        if not os.path.exists(self.filename):
+            return batch, outcomes
+
+        with open(self.filename, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # e.g. a line cut short by a crash
+                    continue
+
+                if record.get("event") == "start":
+                    if record.get("batch") != batch:
+                        batch = record.get("batch")
+                        outcomes = OrderedDict()
+                elif record.get("event") == "outcome" and record.get("batch") == batch:
+                    outcomes.pop(record["file"], None)
+                    outcomes[record["file"]] = (record["outcome"], record.get("message", ''))
+        return batch, outcomes
+
+    def start(self, mode, batch=None):
+        """
+        Start a run.
+
+        Parameters
+        ----------
+        mode : str
+            The mode of the run, e.g. "resume", for the record
+        batch : str
+            The identifier of the batch to continue, or None to start a new batch
+        """
+        self._batch = batch or uuid.uuid4().hex
+        self._file = open(self.filename, 'a')
+        self._append({"event": "start", "batch": self._batch, "mode": mode, "pid": os.getpid()})
+
+    def record(self, filename, outcome, message=''):
+        """
+        Record the outcome of a file.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the Rogue Python file
+        outcome : str
+            SUCCEEDED, FAILED or SKIPPED
+        message : str
+            The reason why the file failed, or has been skipped
+        """
+        self._append({"event": "outcome", "batch": self._batch, "file": filename, "outcome": outcome,
+                      "message": message})
+
+    def finish(self, interrupted=False):
+        """
+        End the run, and close the journal.
+
+        Parameters
+        ----------
+        interrupted : bool
+            True if the run has been interrupted, e.g. by Ctrl-C
+        """
+        if self._file:
+            self._append({"event": "end", "batch": self._batch, "interrupted": interrupted})
+            self._file.close()
+            self._file = None
+
+    def _append(self, record):
+        record["time"] = time.time()
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
@@ -2,33 +2,62 @@
 
 import sys
 import os
-import shutil
+import time
+import errno
+import signal
 import json
+import hashlib
 import traceback
-
-from pydoc import locate, ErrorDuringImport
+from collections import OrderedDict
 
 import rogue2yaml
 from rogue2yaml.arg_parser import ArgParser
+from rogue2yaml.output_writer import WriteBehindWriter, write_file
+from rogue2yaml.register_index import NODE_KINDS, RegisterIndex
+from rogue2yaml.sidecar import SIDECAR_FORMATS, msgpack
+from rogue2yaml.yaml_comparator import compare_directories, compare_files
+from rogue2yaml_launcher.journal import FAILED, JOURNAL_FILENAME, SKIPPED, SUCCEEDED, RunJournal
+from rogue2yaml_launcher.dependencies import DEPENDENCY_MANIFEST_FILENAME, DependencyManifest
+from rogue2yaml_launcher.bytecode_cache import DEFAULT_MAX_AGE_DAYS, get_default_cache_dir, prune_bytecode_cache
+from rogue2yaml_launcher.coordinator import AUTHKEY_ENVIRONMENT_VARIABLE, Coordinator, get_authkey, parse_address, \
+    run_workers
+from rogue2yaml_launcher.daemon import DEFAULT_MAX_CONCURRENT_REQUESTS, ConversionService, create_server
+from rogue2yaml_launcher.engines import ENGINE_AUTO, ENGINE_PROCESSES, ENGINES, create_pool, \
+    select_engine
+from rogue2yaml_launcher.conversion import ConversionOptions, ConversionResult, convert_file
+from rogue2yaml_launcher.preflight import BROKEN, HARDWARE_MODULES, NEEDS_STUB, preflight_files
+from rogue2yaml_launcher.quarantine import QUARANTINE_FILENAME, Quarantine
+from rogue2yaml_launcher.shared_outputs import DEFAULT_SHARED_OUTPUT_THRESHOLD
+from rogue2yaml_launcher.sharding import merge_reports, parse_shard, select_shard, write_report
+from rogue2yaml_launcher.scheduler import DEFAULT_LOOKAHEAD, HISTORY_FILENAME, ConversionHistory, CostModelScheduler
+from rogue2yaml_launcher.discovery import DEFAULT_IGNORED_DIRECTORIES, DEFAULT_SCAN_THREAD_COUNT, _find_root, \
+    find_rogue_files, read_manifest
 
 from version import CPSW_YAML_SCHEMA_VERSION
 
-from rogue2yaml.converter_logging import logging
+from rogue2yaml.converter_logging import configure_logging, logging
 logger = logging.getLogger(__name__)
 
 
 def main():
+    # Dispatch the subcommands, e.g. "rogue2yaml compare", which take their own arguments
+    if len(sys.argv) > 1 and sys.argv[1] in _SUBCOMMANDS:
+        return _SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
     logger.info("Starting a new conversion session...\n")
     logger.info(''.join(['-' * 80, '\n']))
 
     # Parsing command arguments
     args = _parse_arguments()
+    configure_logging(level=getattr(logging, args.log_level), max_bytes=args.log_max_bytes,
+                      backup_count=args.log_backups)
 
     rogue_dir = vars(args)["rogue_collection_dir"]
     sys.path.insert(1, os.path.expandvars(os.path.expanduser(rogue_dir)))
 
-    rogue_python_file_dir = vars(args)["rogue_python_file_dir"]
-    sys.path.insert(1, os.path.expandvars(os.path.expanduser(rogue_python_file_dir)))
+    rogue_python_file_dirs = [vars(args)["rogue_python_file_dir"]] + vars(args)["input_dirs"]
+    for rogue_python_file_dir in rogue_python_file_dirs:
+        sys.path.insert(1, os.path.expandvars(os.path.expanduser(rogue_python_file_dir)))
     output_file_dir = _process_output_file_dir(vars(args).get("output_file_dir", None))
 
     # Records to keep track of successfully converted and unsuccessfully converted (and skipped) files
@@ -40,14 +69,87 @@ def main():
     for k, _ in failure_files.items():
         exclusion_list.append(k)
 
-    # Copy all the Rogue Python files scattered across the Rogue directories to one single input location
-    _collect_rogue_files(rogue_python_file_dir, exclusion_list)
+    manifest_paths = None
+    if vars(args)["manifest"]:
+        manifest_paths = read_manifest(vars(args)["manifest"])
+
+    # The files that have timed out or crashed their worker before are skipped, until their source changes
+    quarantine = None
+    if not args.no_quarantine:
+        quarantine = Quarantine(os.path.join(output_file_dir, QUARANTINE_FILENAME))
+
+    shard_history = ConversionHistory(args.shard_history) if args.shard_history else None
+
+    # Copy all the Rogue Python files scattered across the Rogue directories to one single input location, converting
+    # them as they are discovered. The copies of a file vendored in several places are only converted once.
+    duplicate_files = OrderedDict()
+    filenames = _collect_rogue_files(rogue_python_file_dirs, exclusion_list, manifest_paths=manifest_paths,
+                                     include_patterns=vars(args)["include"], exclude_patterns=vars(args)["exclude"],
+                                     scan_thread_count=vars(args)["scan_threads"],
+                                     ignored_directories=DEFAULT_IGNORED_DIRECTORIES + tuple(vars(args)["ignore_dir"]),
+                                     quarantine=quarantine, failure_files=failure_files, shard=args.shard,
+                                     shard_history=shard_history, duplicate_files=duplicate_files)
+
+    # Journal the outcome of each file, to resume the batch if this run is interrupted
+    journal = RunJournal(os.path.join(output_file_dir, JOURNAL_FILENAME))
+    batch, previous_outcomes = None, None
+    if args.resume or args.retry_failed:
+        batch, previous_outcomes = journal.load_last_batch()
+        if batch is None:
+            logger.warning("No previous run found in '{0}'. Converting all the files.".format(journal.filename))
+            previous_outcomes = None
+    journal.start("resume" if args.resume else "retry-failed" if args.retry_failed else "new", batch=batch)
+
+    # Stop gracefully if the launcher is terminated, e.g. by a shutdown, as if interrupted with Ctrl-C
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    # The code objects of the staged files are cached by content, as the staging changes their timestamps
+    bytecode_cache_dir = None
+    if not args.no_bytecode_cache:
+        bytecode_cache_dir = os.path.expandvars(os.path.expanduser(args.bytecode_cache or get_default_cache_dir()))
 
     # Convert the files
-    _convert_files(output_file_dir, success_files, failure_files)
+    interrupted = _convert_files(filenames, output_file_dir, success_files, failure_files, worker_count=args.workers,
+                                 max_files_per_worker=args.max_files_per_worker,
+                                 max_worker_memory=args.max_worker_memory, timeout=args.timeout,
+                                 engine=args.engine, longest_first=args.schedule == SCHEDULE_LONGEST_FIRST,
+                                 memory_budget=args.memory_budget,
+                                 options=ConversionOptions(sidecar_formats=args.sidecar, address_map=args.address_map,
+                                                           device_model=bool(args.index_db),
+                                                           bytecode_cache_dir=bytecode_cache_dir),
+                                 index_filename=args.index_db, source_dirs=rogue_python_file_dirs + ["input"],
+                                 journal=journal, previous_outcomes=previous_outcomes,
+                                 retry_failed=args.retry_failed, quarantine=quarantine,
+                                 preflight=not args.no_preflight, coordinator_address=args.coordinator,
+                                 authkey=args.authkey)
+    journal.finish(interrupted)
+    if bytecode_cache_dir:
+        prune_bytecode_cache(bytecode_cache_dir)
 
     # Conversion summary
-    _summarize(success_files, failure_files)
+    _summarize(success_files, failure_files, duplicate_files)
+    report_filename = args.report
+    if args.shard and not report_filename:
+        report_filename = os.path.join(output_file_dir, REPORT_FILENAME_FORMAT.format(*args.shard))
+    if report_filename:
+        write_report(report_filename, success_files, failure_files, shard=args.shard, interrupted=interrupted)
+        logger.info("The report has been written to '{0}'.".format(report_filename))
+    if interrupted:
+        logger.warning("The conversions have been interrupted. Run again with --resume to convert the remaining "
+                       "files.")
+        return 128 + signal.SIGINT
+
+
+# The name of the report of a shard, in its output directory
+REPORT_FILENAME_FORMAT = "rogue2yaml_report.{0}-of-{1}.json"
+
+# The levels of the messages to log
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# The orders of the conversions on the worker processes
+SCHEDULE_LONGEST_FIRST = "longest-first"
+SCHEDULE_DISCOVERY = "discovery"
+SCHEDULES = (SCHEDULE_LONGEST_FIRST, SCHEDULE_DISCOVERY)
 
 
 def _parse_arguments():
@@ -65,11 +167,147 @@ def _parse_arguments():
     parser.add_argument("output_file_dir", nargs='?', default="",
                         help="The directory that contains the output CPSW YAML files.")
 
+    parser.add_argument("--input-dir", dest="input_dirs", action="append", default=[],
+                        help="An additional directory that contains Python Rogue files to convert. Can be repeated.")
+    parser.add_argument("--manifest",
+                        help="A file listing the Python Rogue files (or directories) to convert, one per line. Use '-' "
+                             "to read the list from the standard input. Only the listed paths are converted, and the "
+                             "input directories are not walked.")
+    parser.add_argument("--include", action="append", default=[],
+                        help="Only convert the files whose path, relative to their input directory, or name matches "
+                             "this glob pattern. Can be repeated.")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="Do not convert the files whose path, relative to their input directory, or name matches "
+                             "this glob pattern. Can be repeated.")
+    parser.add_argument("--ignore-dir", action="append", default=[],
+                        help="Do not look for files to convert in the directories with this name (glob pattern), in "
+                             "addition to {0}. Can be repeated.".format(', '.join(DEFAULT_IGNORED_DIRECTORIES)))
+    parser.add_argument("--scan-threads", type=int, default=DEFAULT_SCAN_THREAD_COUNT,
+                        help="The number of threads scanning the input directories (default: {0})."
+                        .format(DEFAULT_SCAN_THREAD_COUNT))
+    parser.add_argument("--sidecar", action="append", default=[], choices=sorted(SIDECAR_FORMATS),
+                        help="Also output each device model, with its anchors and merge keys resolved, in this "
+                             "machine-friendly format, e.g. AxiVersion.json next to AxiVersion.yaml. Can be repeated.")
+    parser.add_argument("--address-map", action="store_true",
+                        help="Also output the absolute address of every register of each device hierarchy, sorted by "
+                             "address, as CSV (e.g. AxiVersion.addrmap.csv) and in a binary form that can be searched "
+                             "by bisection (e.g. AxiVersion.addrmap.bin).")
+    parser.add_argument("--index-db",
+                        help="Also index the devices, registers and commands of each converted file into this SQLite "
+                             "database, for 'rogue2yaml query'. The files converted again replace their previous "
+                             "entries; the others are kept.")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes to convert the files in parallel. The workers are forked "
+                             "from a template process with pyrogue already imported. If 0 (default), convert the files "
+                             "one by one in the launcher process.")
+    parser.add_argument("--engine", choices=ENGINES, default=ENGINE_AUTO,
+                        help="What runs the --workers conversions: worker processes, the threads of the launcher "
+                             "process, which run in parallel on a free-threaded Python build, or its subinterpreters, "
+                             "with Python 3.14 or later and if the Rogue libraries support them. The threads and the "
+                             "subinterpreters share a single launcher process, but their conversions cannot be "
+                             "abandoned or recycled. 'auto' (default) selects the threads on a free-threaded build, "
+                             "unless --timeout is set, and the worker processes otherwise.")
+    parser.add_argument("--coordinator", metavar="ADDRESS",
+                        help="Serve the conversions to the workers started with 'rogue2yaml worker' on any number of "
+                             "nodes, which connect to this address, either HOST:PORT or the path of a Unix socket, and "
+                             "pull the files one at a time. A TCP address requires the {0} environment variable to be "
+                             "set to a shared secret.".format(AUTHKEY_ENVIRONMENT_VARIABLE))
+    parser.add_argument("--max-files-per-worker", type=int, default=0,
+                        help="Recycle a worker process after it has converted this number of files. If 0 (default), "
+                             "never recycle.")
+    parser.add_argument("--max-worker-memory", type=int, default=0,
+                        help="Recycle a worker process once its resident memory exceeds this number of MB. If 0 "
+                             "(default), never recycle.")
+    parser.add_argument("--timeout", type=float, default=0,
+                        help="Abandon a conversion after this number of seconds, and kill its worker process. Only "
+                             "with --workers or --coordinator. If 0 (default), no limit.")
+    parser.add_argument("--no-quarantine", action="store_true",
+                        help="Convert the files quarantined by the previous runs, and do not quarantine any file. By "
+                             "default, the files that time out or crash their worker process are quarantined, and "
+                             "skipped by the next runs until their source changes.")
+    parser.add_argument("--bytecode-cache", metavar="DIR",
+                        help="The directory to cache the compiled code of the collected files in, by content, so that "
+                             "the unchanged files are not compiled again by the next runs. Defaults to "
+                             "~/.cache/rogue2yaml/bytecode. The entries unused for {0} days are removed."
+                             .format(DEFAULT_MAX_AGE_DAYS))
+    parser.add_argument("--no-bytecode-cache", action="store_true",
+                        help="Compile the collected files on every run, without caching their code.")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="Do not classify the files by static analysis before converting them. By default, the "
+                             "files that cannot compile, import a missing module or define no class named after the "
+                             "file fail without being imported, and the files that access the hardware are converted "
+                             "with the hardware modules replaced by inert stubs.")
+    parser.add_argument("--schedule", choices=SCHEDULES, default=SCHEDULE_DISCOVERY,
+                        help="The order of the conversions on the worker processes. '{0}' (default) converts the files "
+                             "as they are discovered, the longest of the next few files first, according to their "
+                             "durations in the previous runs. '{1}' waits for all the files to be discovered, then "
+                             "converts them from the longest to the shortest.".format(SCHEDULE_DISCOVERY,
+                                                                                      SCHEDULE_LONGEST_FIRST))
+    parser.add_argument("--memory-budget", type=int, default=0,
+                        help="Do not start a conversion if the peak memory of the running conversions, according to "
+                             "the previous runs, would exceed this number of MB. If 0 (default), no limit.")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO",
+                        help="The level of the messages to log, in the launcher and in the worker processes (default: "
+                             "INFO). DEBUG also logs each capitalization variation tried for the class names.")
+    parser.add_argument("--log-max-bytes", type=int, default=0,
+                        help="Rotate logs/rogue2yaml.log once it exceeds this number of bytes. If 0 (default), never "
+                             "rotate.")
+    parser.add_argument("--log-backups", type=int, default=5,
+                        help="The number of rotated log files to keep (default: 5).")
+    parser.add_argument("--shard", metavar="K/N",
+                        help="Only convert the K-th of N shards of the files, e.g. 2/4, to spread a batch over several "
+                             "nodes. The files are assigned to the shards by a hash of their names, or by their "
+                             "durations with --shard-history. The report of the shard is written to the output "
+                             "directory, unless --report is provided.")
+    parser.add_argument("--shard-history", metavar="FILE",
+                        help="Assign the files to the shards so that each shard takes about the same time, according "
+                             "to this conversion history, e.g. the one merged from the shards of a previous batch. "
+                             "Every shard must be given the same history and the same files.")
+    parser.add_argument("--report", metavar="FILE",
+                        help="Write the outcome of each file to this JSON report, e.g. to merge it with the reports "
+                             "of the other shards with 'rogue2yaml merge'.")
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--resume", action="store_true",
+                       help="Continue the previous run where it stopped, e.g. if it has been interrupted or killed, "
+                            "without converting again the files it completed.")
+    group.add_argument("--retry-failed", action="store_true",
+                       help="Only convert again the files that failed in the previous run.")
+
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--version", action="version", version=rogue2yaml.__version__)
     group.add_argument("--cpsw-schema-version", action="version", version=CPSW_YAML_SCHEMA_VERSION)
 
     args = parser.parse_args()
+    if args.shard:
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.shard_history and not args.shard:
+        parser.error("--shard-history requires --shard.")
+    if args.timeout and not (args.workers or args.coordinator):
+        parser.error("--timeout requires --workers or --coordinator, to convert the files in worker processes that "
+                     "can be abandoned.")
+    if args.engine not in (ENGINE_AUTO, ENGINE_PROCESSES):
+        if args.coordinator:
+            parser.error("--engine {0} cannot be used with --coordinator, whose workers are processes."
+                         .format(args.engine))
+        if args.timeout or args.max_files_per_worker or args.max_worker_memory:
+            parser.error("--engine {0} cannot be used with --timeout, --max-files-per-worker or --max-worker-memory, "
+                         "which only apply to worker processes.".format(args.engine))
+    args.authkey = None
+    if args.coordinator:
+        if args.workers:
+            parser.error("--coordinator and --workers cannot be used together. Start the workers with 'rogue2yaml "
+                         "worker' instead.")
+        args.coordinator = parse_address(args.coordinator)
+        try:
+            args.authkey = get_authkey(args.coordinator)
+        except ValueError as error:
+            parser.error(str(error))
+    if "msgpack" in args.sidecar and msgpack is None:
+        parser.error("The msgpack sidecar format requires the msgpack package. Install it with 'pip install msgpack'.")
     return args
 
 
@@ -97,42 +335,161 @@ def _process_output_file_dir(output_file_dir):
             os.makedirs(output_file_dir)
         except os.error as err:
             # It's OK if the output directory exists. This is to be compatible with Python 2.7
-            if err.errno != os.errno.EEXIST:
+            if err.errno != errno.EEXIST:
                 raise err
     return output_file_dir
 
 
-def _collect_rogue_files(rogue_python_file_dir, exclusion_list):
+def _collect_rogue_files(rogue_python_file_dirs, exclusion_list, manifest_paths=None, include_patterns=(),
+                         exclude_patterns=(), scan_thread_count=DEFAULT_SCAN_THREAD_COUNT,
+                         ignored_directories=DEFAULT_IGNORED_DIRECTORIES, quarantine=None, failure_files=None,
+                         shard=None, shard_history=None, duplicate_files=None):
     """
     Collect all the input files to a common location for the batch conversion.
 
+    A file is converted into the output named after it, from the class named after it, so that only one of the files
+    of the same name is collected: the first by the order of the input directories, and then by path. As the
+    concurrent scan discovers the files in any order, they are collected once the discovery finishes, so that every
+    run collects the same file. Its copies with the same content, e.g. of a library vendored in several firmware
+    repositories, are converted once with it. The files of the same name but with a different content are reported,
+    rather than silently replacing the collected file.
+
     Parameters
     ----------
-    rogue_python_file_dir : str
-        The name of the directory containing the files to be converted
-
+    rogue_python_file_dirs : list
+        The names of the directories containing the files to be converted
     exclusion_list : list
-        A list of names of the files to be excluded from being converted
+        A list of names, glob patterns, paths or regular expressions of the files to be excluded from being converted
+    manifest_paths : list
+        If provided, only collect these files and directories, instead of walking the input directories
+    include_patterns : list
+        If provided, only collect the files matching one of these glob patterns
+    exclude_patterns : list
+        Do not collect the files matching any of these glob patterns
+    scan_thread_count : int
+        The number of threads scanning the input directories
+    ignored_directories : list
+        The glob patterns of the names of the directories not to scan
+    quarantine : Quarantine
+        If provided, do not collect the files in this quarantine, unless their source has changed
+    failure_files : list
+        A name list of files that are unsuccessfully converted, and files that are skipped from being converted, to
+        add the quarantined files to
+    shard : tuple(int, int)
+        If provided, the 1-based index of the shard, and the number of shards, to only collect the files of the shard
+    shard_history : ConversionHistory
+        If provided with a shard, split the files into shards by their durations in this history, rather than by the
+        hash of their names
+    duplicate_files : OrderedDict
+        If provided, the files not collected as a file of the same name has been, to add to with the reason, keyed by
+        path
+
+    Yields : str
+    -------
+        The name of the next collected file
     """
     try:
         os.makedirs("input")
     except os.error as err:
         # It's OK if the "input" directory exists. This is to be compatible with Python 2.7
-        if err.errno != os.errno.EEXIST:
+        if err.errno != errno.EEXIST:
             raise err
 
-    for root, directories, filenames in os.walk(os.path.expanduser(rogue_python_file_dir)):
-        for filename in filenames:
-            if filename[-3:] == ".py" and filename[:-3] not in exclusion_list:
-                shutil.copyfile(os.path.join(root, filename), os.path.join("input", filename))
+    paths = find_rogue_files(rogue_python_file_dirs, exclusion_list, manifest_paths=manifest_paths,
+                             include_patterns=include_patterns, exclude_patterns=exclude_patterns,
+                             thread_count=scan_thread_count, ignored_directories=ignored_directories)
+    if shard:
+        paths = select_shard(paths, shard[0], shard[1], history=shard_history)
+    roots = [os.path.expandvars(os.path.expanduser(root)) for root in rogue_python_file_dirs]
+    paths = sorted(paths, key=lambda path: _get_collection_rank(path, roots))
+
+    # The path and the hash of the content of each collected file, keyed by name
+    collected_files = {}
+    for path in paths:
+        filename = os.path.basename(path)
+        if filename in collected_files:
+            _record_duplicate(path, collected_files[filename], duplicate_files)
+            continue
+        if quarantine:
+            record = quarantine.check(filename, path)
+            if record:
+                failure_message = "Skipping file '{0}' as it has been quarantined on {1}, and has not changed since. " \
+                                  "{2}".format(filename, record["time"], record["reason"])
+                logger.info(failure_message)
+                if failure_files is not None:
+                    failure_files[filename[:-3]] = failure_message
+                # The other files of the same name are not collected instead, nor released from the quarantine
+                collected_files[filename] = path, record["sha1"]
+                continue
+
+        with open(path, 'rb') as source_file:
+            contents = source_file.read()
+        collected_files[filename] = path, hashlib.sha1(contents).hexdigest()
+        # The staged file is replaced in one step, as the conversion of a previous file may be importing it
+        write_file(os.path.join("input", filename), contents)
+        yield filename
+
+
+def _get_collection_rank(path, roots):
+    """
+    Rank a file among the files of the same name, by the order of the input directories, and then by path.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    roots : list
+        The input directories
+
+    Returns
+    -------
+    The rank, the lowest being collected : tuple(int, str, str)
+    """
+    root = _find_root(path, roots)
+    return roots.index(root) if root in roots else len(roots), os.path.relpath(path, root), path
+
+
+def _record_duplicate(path, collected_file, duplicate_files):
+    """
+    Report a file not collected as a file of the same name has been.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file not collected
+    collected_file : tuple(str, str)
+        The path of the collected file of the same name, and the sha1 of its content
+    duplicate_files : OrderedDict
+        If provided, the files not collected, to add the file to with the reason, keyed by path
+    """
+    collected_path, collected_sha1 = collected_file
+    try:
+        with open(path, 'rb') as source_file:
+            sha1 = hashlib.sha1(source_file.read()).hexdigest()
+    except (IOError, OSError) as error:
+        sha1 = None
+        logger.warning("Cannot read file '{0}'. {1}".format(path, error))
+
+    if sha1 == collected_sha1:
+        message = "Identical to '{0}', which is converted instead.".format(collected_path)
+        logger.info("Skipping file '{0}'. {1}".format(path, message))
+    else:
+        message = "Differs from '{0}', which has the same name and is converted instead.".format(collected_path)
+        logger.warning("Skipping file '{0}'. {1}".format(path, message))
+    if duplicate_files is not None:
+        duplicate_files[path] = message
 
 
-def _convert_files(output_file_dir, success_files, failure_files):
+def _convert_files(filenames, output_file_dir, success_files, failure_files, worker_count=0, max_files_per_worker=0,
+                   max_worker_memory=0, timeout=0, engine=ENGINE_PROCESSES, longest_first=False, memory_budget=0,
+                   options=None, index_filename=None, source_dirs=None, journal=None, previous_outcomes=None,
+                   retry_failed=False, quarantine=None, preflight=False, coordinator_address=None, authkey=None):
     """
     Convert the Rogue Python files into CPSW YAML files.
 
-    First, check if the YAML file is already available in the output directory. If so, log and skip the file from
-    converting it.
+    First, check if the YAML file is already available in the output directory. If so, and if none of the source files
+    it has been converted from has changed since, log and skip the file from converting it. The source files of each
+    output are recorded in a dependency manifest in the output directory.
 
     Next, convert the Rogue Python file if its corresponding YAML file is not in the output directory. If the
     conversion fails, retry the conversion by varying capitalization of the filename.
@@ -142,77 +499,300 @@ def _convert_files(output_file_dir, success_files, failure_files):
 
     Parameters
     ----------
+    filenames : iterable
+        The names of the collected Rogue Python files to convert. The files are converted as they are collected.
     output_file_dir : str
         The directory to output the converted files
     success_files : list
         A name list of files that are successfully converted
     failure_files : list
         A name list of files that are unsuccessfully converted, and files that are skipped from being converted
+    worker_count : int
+        The number of worker processes to convert the files with. 0 means converting in the launcher process.
+    max_files_per_worker : int
+        The number of files after which a worker process is recycled. 0 means never.
+    max_worker_memory : int
+        The resident memory, in MB, beyond which a worker process is recycled. 0 means never.
+    timeout : float
+        With worker processes, the duration, in seconds, beyond which a conversion is abandoned. 0 means no limit.
+    engine : str
+        What runs the conversions if worker_count is set: one of ENGINES, e.g. ENGINE_THREADS to convert in the
+        threads of the launcher process
+    longest_first : bool
+        With worker processes, True to convert the files from the longest to the shortest according to the conversion
+        history. The conversions then start once all the files are collected. Otherwise, the longest of the next few
+        collected files is converted first. The history is updated with the durations and memory peaks of this run.
+    memory_budget : int
+        With worker processes, the peak memory, in MB, of the running conversions, according to the conversion
+        history, beyond which no conversion starts. 0 means no limit.
+    options : ConversionOptions
+        The additional outputs of each conversion
+    index_filename : str
+        If provided, the SQLite database to index the device model of each converted file into. The options must
+        request the device models.
+    source_dirs : list
+        The directories of the source files to track the changes of, e.g. not the pyrogue ones. If None, all the
+        source files are tracked.
+    journal : RunJournal
+        If provided, the started journal to record the outcome of each file into
+    previous_outcomes : OrderedDict
+        If provided, the outcomes of the files in the previous run, as (outcome, message), keyed by file name. The
+        files completed in the previous run are not converted again, except the files whose output has disappeared,
+        and the failed files if retry_failed is True.
+    retry_failed : bool
+        True to only convert the files that failed in the previous run
+    quarantine : Quarantine
+        If provided, the quarantine to add the files that time out or crash their worker process to
+    preflight : bool
+        True to classify the files by static analysis first. The files found broken fail without being imported, and
+        the files accessing the hardware are converted with the hardware modules stubbed.
+    coordinator_address : tuple(str, int) or str
+        If provided, serve the conversions to the remote workers connecting to this address, e.g. with
+        "rogue2yaml worker", instead of converting the files in this node. The worker options do not apply.
+    authkey : bytes
+        The key the remote workers must authenticate with
+
+    Returns
+    -------
+    True if the conversions have been interrupted, e.g. by Ctrl-C; False otherwise : bool
     """
-    from rogue2yaml.yaml_converter import YamlConverter
+    # Collect the names of the files already converted
+    output_filenames = set()
+    for _, _, output_files in os.walk(output_file_dir):
+        output_filenames.update(output_files)
+
+    dependency_manifest = DependencyManifest(os.path.join(output_file_dir, DEPENDENCY_MANIFEST_FILENAME))
+    if source_dirs is not None:
+        source_dirs = [os.path.join(os.path.abspath(os.path.expandvars(os.path.expanduser(source_dir))), '')
+                       for source_dir in source_dirs]
 
-    for _, _, filenames in os.walk("input"):
+    def get_pending_filenames():
         for filename in filenames:
-            output_file_found = False
-
-            # Check if the file is already converted. If found, skip that file
-            for _, _, output_files in os.walk(output_file_dir):
-                output_filename = filename[:-3] + ".yaml"
-                if output_filename in output_files:
-                    failure_message = "Skipping file '{0}' as its converted file '{1}' is found in the output " \
-                                      "directory '{2}'.".format(filename, output_filename, output_file_dir)
-                    failure_files[output_filename] = failure_message
-                    logger.info(failure_message)
-                    output_file_found = True
-
-            if not output_file_found and filename.endswith(".py"):
-                logger.info("Converting file '{0}'...".format(filename))
-                filename = filename[:-3]
-                class_name = filename
-
-                if class_name[0] == '_':
-                    class_name = class_name[1:]
-
-                class_rep = None
-                trial_count = 0
-
-                original_class_name = class_name
-                output = _generate_class_name_variations(original_class_name)
-
-                while not class_rep and trial_count < 2 ** len(class_name):
-                    class_name = next(output)
-                    logger.debug("Trying class name variation '{0}'...".format(class_name))
-
-                    class_rep = locate('.'.join(["input", filename, class_name]))
-                    if not class_rep:
-                        trial_count += 1
-                try:
-                    # Instantiate the Rogue device
-                    pyrogue_device = class_rep()
-
-                    # Instantiate the YAML Converter
-                    converter = YamlConverter(pyrogue_device)
-
-                    # Convert to YAML and save to the output file
-                    converter.convert('.'.join([filename, "yaml"]), export_dirname=output_file_dir)
-                    success_files.append(filename)
-                except (TypeError, AttributeError, SyntaxError, NameError, ErrorDuringImport) as error:
-                    failure_files[filename] = '. '.join(["Make sure the file name and the class name are the same",
-                                                         str(type(error)), str(error)])
-                    logger.error("Cannot instantiate the object of type '{0}'. Make sure the file name and the class "
-                                 "name are the same (case-sensitive). Exception Type: {1}. Exception: {2}"
-                                 .format(filename, type(error), error))
-                except Exception as e:
-                    logger.error("Unexpected exception during the conversion of file '{0}'. Exception type: {1}. "
-                                 "Exception: {2}".format(filename, type(e), e))
-
-
-def _summarize(success_files, failure_files):
+            output_filename = filename[:-3] + ".yaml"
+            if previous_outcomes is not None:
+                outcome, message = previous_outcomes.get(filename, (None, ''))
+                if (outcome == SUCCEEDED and output_filename in output_filenames) or outcome == SKIPPED or \
+                        (outcome == FAILED and not retry_failed) or (outcome is None and retry_failed):
+                    _restore_outcome(filename, outcome, message, success_files, failure_files)
+                    continue
+
+            changed_files = None
+            if output_filename in output_filenames:
+                changed_files = dependency_manifest.get_changed_dependencies(output_filename)
+                if changed_files:
+                    logger.info("Reconverting file '{0}' as its source files have changed: {1}"
+                                .format(filename, ', '.join(changed_files)))
+            if output_filename in output_filenames and not changed_files:
+                failure_message = "Skipping file '{0}' as its converted file '{1}' is found in the output " \
+                                  "directory '{2}'.".format(filename, output_filename, output_file_dir)
+                failure_files[output_filename] = failure_message
+                logger.info(failure_message)
+                if journal:
+                    journal.record(filename, SKIPPED, failure_message)
+            else:
+                yield filename
+
+    options = options or ConversionOptions()
+    if worker_count and not coordinator_address and select_engine(engine, timeout) == ENGINE_PROCESSES:
+        # The large outputs of the worker processes are read from shared memory, rather than unpickled from their pipes
+        options = options.with_shared_outputs(DEFAULT_SHARED_OUTPUT_THRESHOLD)
+    stub_options = options.with_stub_modules(HARDWARE_MODULES)
+    stubbed_filenames = set()
+
+    def get_preflighted_filenames():
+        if not preflight:
+            for filename in get_pending_filenames():
+                yield filename
+            return
+
+        for result in preflight_files((os.path.join("input", filename) for filename in get_pending_filenames()),
+                                      search_path=sys.path, worker_count=worker_count):
+            if result.verdict == BROKEN:
+                failure_message = "Preflight: {0}".format(result.reason)
+                logger.error("Cannot convert file '{0}'. {1}".format(result.filename, failure_message))
+                failure_files[result.filename[:-3]] = failure_message
+                if journal:
+                    journal.record(result.filename, FAILED, failure_message)
+                continue
+
+            if result.verdict == NEEDS_STUB:
+                logger.info("Converting file '{0}' with the hardware modules stubbed. {1}"
+                            .format(result.filename, result.reason))
+                stubbed_filenames.add(result.filename)
+            yield result.filename
+
+    def get_options(filename):
+        return stub_options if filename in stubbed_filenames else options
+
+    index = RegisterIndex(index_filename) if index_filename else None
+
+    # The output files are written in the background while the next files are being converted. If interrupted, e.g. by
+    # Ctrl-C, the outputs of the completed conversions are still written out, and journaled.
+    interrupted = False
+    writer = WriteBehindWriter()
+    try:
+        with writer:
+            if worker_count or coordinator_address:
+                tasks = ((filename, get_options(filename)) for filename in get_preflighted_filenames())
+                # Unless ordering all the files first, the conversions start as the files are discovered
+                history = ConversionHistory(os.path.join(output_file_dir, HISTORY_FILENAME))
+                scheduler = CostModelScheduler(tasks, history, memory_budget=memory_budget,
+                                               lookahead=0 if longest_first else DEFAULT_LOOKAHEAD)
+
+                start_time = time.time()
+                if coordinator_address:
+                    pool = Coordinator(coordinator_address, authkey, task_timeout=timeout)
+                else:
+                    pool = create_pool(convert_file, worker_count, engine, max_tasks_per_worker=max_files_per_worker,
+                                       max_worker_memory=max_worker_memory, task_timeout=timeout)
+                with pool:
+                    for task, result, error in pool.imap_unordered(tasks, scheduler=scheduler):
+                        if error:
+                            result = ConversionResult(task[0][:-3], False, error)
+                            logger.error("Cannot convert file '{0}'. {1}".format(task[0], error))
+                            if quarantine:
+                                quarantine.add(task[0], os.path.join("input", task[0]), error)
+                        _record_result(result, output_file_dir, writer, success_files, failure_files, index, journal)
+                        _record_dependencies(result, dependency_manifest, source_dirs)
+
+                if coordinator_address:
+                    worker_count = pool.worker_count
+                history.save()
+                logger.info("Converted in {0:.2f}s with {1} workers. The ideal schedule would take at least {2:.2f}s, "
+                            "plus the start of the workers."
+                            .format(time.time() - start_time, worker_count, scheduler.get_ideal_makespan(worker_count)))
+            else:
+                for filename in get_preflighted_filenames():
+                    result = convert_file(filename, get_options(filename))
+                    _record_result(result, output_file_dir, writer, success_files, failure_files, index, journal)
+                    _record_dependencies(result, dependency_manifest, source_dirs)
+    except KeyboardInterrupt:
+        interrupted = True
+        logger.warning("Interrupted. Writing out the completed conversions...")
+
+    if index:
+        index.close()
+
+    for filename, error in writer.errors.items():
+        if filename in success_files:
+            success_files.remove(filename)
+        failure_files[filename] = error
+        dependency_manifest.forget(filename + ".yaml")
+        if journal:
+            journal.record(filename + ".py", FAILED, error)
+    dependency_manifest.save()
+    if quarantine:
+        quarantine.save()
+    return interrupted
+
+
+def _restore_outcome(filename, outcome, message, success_files, failure_files):
+    """
+    Add the outcome of a file in the previous run to the conversion records.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the Rogue Python file
+    outcome : str
+        The outcome of the file in the previous run, or None if the file was not in the previous run
+    message : str
+        The reason why the file failed, or has been skipped, in the previous run
+    success_files : list
+        A name list of files that are successfully converted
+    failure_files : list
+        A name list of files that are unsuccessfully converted, and files that are skipped from being converted
+    """
+    if outcome == SUCCEEDED:
+        success_files.append(filename[:-3])
+    elif outcome == FAILED:
+        failure_files[filename[:-3]] = message
+    elif outcome == SKIPPED:
+        failure_files[filename[:-3] + ".yaml"] = message
+
+
+def _record_result(result, output_file_dir, writer, success_files, failure_files, index=None, journal=None):
+    """
+    Add the outcome of a file conversion to the conversion records, and queue its output file to be written.
+
+    Parameters
+    ----------
+    result : ConversionResult
+        The outcome of the file conversion
+    output_file_dir : str
+        The directory to output the converted files
+    writer : WriteBehindWriter
+        The writer of the output files
+    success_files : list
+        A name list of files that are successfully converted
+    failure_files : list
+        A name list of files that are unsuccessfully converted, and files that are skipped from being converted
+    index : RegisterIndex
+        If provided, the index to add the device model of the converted file to
+    journal : RunJournal
+        If provided, the journal to record the outcome of the file into
+    """
+    if result.succeeded and result.shared_outputs:
+        try:
+            views = result.shared_outputs.open()
+        except OSError as error:
+            logger.error("Cannot read the outputs of file '{0}' from shared memory. {1}".format(result.filename, error))
+            result.succeeded = False
+            result.message = "Cannot read the outputs from shared memory. {0}".format(error)
+        else:
+            for output_name, view in views.items():
+                path = os.path.join(output_file_dir, output_name or '.'.join([result.filename, "yaml"]))
+                writer.submit(path, view, name=result.filename, on_written=result.shared_outputs.release)
+    elif result.succeeded:
+        writer.submit(os.path.join(output_file_dir, '.'.join([result.filename, "yaml"])), result.contents,
+                      name=result.filename)
+        for sidecar_filename, sidecar_contents in result.sidecars.items():
+            writer.submit(os.path.join(output_file_dir, sidecar_filename), sidecar_contents, name=result.filename)
+
+    if result.succeeded:
+        if index and result.device_model is not None:
+            index.update(result.filename, result.device_model)
+        success_files.append(result.filename)
+    else:
+        failure_files[result.filename] = result.message
+    if journal:
+        journal.record(result.filename + ".py", SUCCEEDED if result.succeeded else FAILED, result.message)
+
+
+def _record_dependencies(result, dependency_manifest, source_dirs):
+    """
+    Record the source files a successfully converted file depends on.
+
+    Parameters
+    ----------
+    result : ConversionResult
+        The outcome of the file conversion
+    dependency_manifest : DependencyManifest
+        The dependency manifest to record into
+    source_dirs : list
+        The absolute directories, ending with a separator, of the source files to record. If None, all the source
+        files are recorded.
+    """
+    if not result.succeeded:
+        return
+    dependencies = result.dependencies
+    if source_dirs is not None:
+        dependencies = [filename for filename in dependencies
+                        if any(filename.startswith(source_dir) for source_dir in source_dirs)]
+    dependency_manifest.record(result.filename + ".yaml", dependencies)
+
+
+def _interrupt(signal_number, frame):
+    raise KeyboardInterrupt()
+
+
+def _summarize(success_files, failure_files, duplicate_files=None):
     """
     Log the summary of the conversions.
 
     Print out the number of files successfully converted, and not. Also print out the names of such files. For failure
     files, print out the reasons why the files could not be converted, and any applicable errors and potential reasons.
+    Also print out the files not converted as another file of the same name has been.
 
     Parameters
     ----------
@@ -220,13 +800,18 @@ def _summarize(success_files, failure_files):
         A name list of files that are successfully converted
     failure_files : list
         A name list of files that are unsuccessfully converted, and files that are skipped from being converted
+    duplicate_files : OrderedDict
+        If provided, the files not converted as another file of the same name has been, with the reason, keyed by path
     """
     success_count = len(success_files)
     failure_count = len(failure_files)
+    duplicate_count = len(duplicate_files) if duplicate_files else 0
 
     logger.info(''.join(['\n', "-" * 80, '\n']))
     logger.info("Number of files successfully converted: {0}".format(success_count))
     logger.info("Number of files unsuccessfully converted: {0}".format(failure_count))
+    if duplicate_count:
+        logger.info("Number of files skipped as duplicates: {0}".format(duplicate_count))
 
     if success_count:
         logger.info(''.join(['\n', "-" * 80]))
@@ -238,40 +823,285 @@ def _summarize(success_files, failure_files):
         logger.info("\nUnsuccessfully converted files:\n ")
         for k, v in failure_files.items():
             logger.info(''.join([k, ' ' * (30 - len(k)), '=>', ' ' * 5, v]))
+    if duplicate_count:
+        logger.info(''.join(['\n', "-" * 80]))
+        logger.info("\nDuplicate files:\n ")
+        for k, v in duplicate_files.items():
+            logger.info(''.join([k, '  =>  ', v]))
     logger.info(''.join(['\n', "#" * 80, '\n']))
 
 
-def _generate_class_name_variations(class_name):
+def _compare(argv):
     """
-    Attempt to guess the class name by varying the capitalization of character combos in the class name string.
+    Compare two converted CPSW YAML files, or two directories of them, register by register, and log the differences.
 
     Parameters
     ----------
-    class_name : str
-        The name of a Python Rogue class
+    argv : list
+        The subcommand arguments
 
-    Yields : str
+    Returns
     -------
-        The next name with the next capitalization variation
+    0 if there is no difference; 1 otherwise : int
     """
-    if class_name is not None:
-        class_name_length = len(class_name)
-        for value in range(0, 2 ** class_name_length):
-            bit_pattern = [value >> i & 1 for i in range(class_name_length - 1, -1, -1)]
-            set_bit_indices = []
-            for i in range(0, len(bit_pattern)):
-                if bit_pattern[i]:
-                    set_bit_indices.append(i)
-            processed_name = class_name
-            for set_bit_index in set_bit_indices:
-                processed_name = ''.join([processed_name[:set_bit_index], processed_name[set_bit_index].upper(),
-                                          processed_name[set_bit_index + 1:]])
-            yield processed_name
+    parser = ArgParser(prog="rogue2yaml compare",
+                       description="Compare converted CPSW YAML files, e.g. from two firmware releases, register by "
+                                   "register, regardless of their formatting and ordering.")
+    parser.add_argument("old_path", help="The CPSW YAML file, or directory of files, to compare from.")
+    parser.add_argument("new_path", help="The CPSW YAML file, or directory of files, to compare to.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="The number of processes comparing the files in parallel (default: the number of CPUs).")
+    args = parser.parse_args(argv)
+
+    old_path = os.path.expandvars(os.path.expanduser(args.old_path))
+    new_path = os.path.expandvars(os.path.expanduser(args.new_path))
+    if os.path.isdir(old_path):
+        added_files, removed_files, changed_files = compare_directories(old_path, new_path, args.workers)
+    else:
+        diff = compare_files(old_path, new_path)
+        added_files, removed_files, changed_files = [], [], {os.path.basename(new_path): diff} if diff else {}
+
+    for filename in added_files:
+        logger.info("+ file {0}".format(filename))
+    for filename in removed_files:
+        logger.info("- file {0}".format(filename))
+    for filename, diff in changed_files.items():
+        logger.info("~ file {0}".format(filename))
+        for line in diff.format():
+            logger.info(''.join(["    ", line]))
+
+    logger.info("Files added: {0}, removed: {1}, changed: {2}".format(len(added_files), len(removed_files),
+                                                                      len(changed_files)))
+    return 1 if added_files or removed_files or changed_files else 0
+
+
+def _query(argv):
+    """
+    Look up the registers of the converted files in a register index, by address or by name, and log them.
+
+    Parameters
+    ----------
+    argv : list
+        The subcommand arguments
+
+    Returns
+    -------
+    0 if anything is found; 1 otherwise : int
+    """
+    parser = ArgParser(prog="rogue2yaml query",
+                       description="Look up the registers, commands and devices of the converted files in the index "
+                                   "populated by the launcher with --index-db.")
+    parser.add_argument("index_db", help="The SQLite register index.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--address", type=lambda value: int(value, 0),
+                       help="Find the registers and commands spanning this address, e.g. 0x20000104, within the "
+                            "device of each file.")
+    group.add_argument("--name", help="Find the nodes whose name matches this glob pattern, e.g. '*Reset*'.")
+    parser.add_argument("--kind", choices=NODE_KINDS, help="Only find this kind of nodes, with --name.")
+    parser.add_argument("--file", help="Only search this converted file, e.g. AxiVersion.")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.index_db):
+        parser.error("The register index '{0}' does not exist.".format(args.index_db))
+
+    with RegisterIndex(args.index_db) as index:
+        if args.address is not None:
+            nodes = index.find_by_address(args.address, filename=args.file)
+        else:
+            nodes = index.find_by_name(args.name, kind=args.kind, filename=args.file)
+
+    for node in nodes:
+        details = [node["kind"], hex(node["address"])]
+        if node["size_bits"] is not None:
+            details.append("{0} bits @ {1}".format(node["size_bits"], node["ls_bit"] or 0))
+        if node["mode"]:
+            details.append(node["mode"])
+        logger.info("{0}: {1}  ({2})".format(node["filename"], node["path"], ', '.join(details)))
+    logger.info("Found: {0}".format(len(nodes)))
+    return 0 if nodes else 1
+
+
+def _merge(argv):
+    """
+    Merge the reports of the shards of a batch, and log the summary of the whole batch.
+
+    Parameters
+    ----------
+    argv : list
+        The subcommand arguments
+
+    Returns
+    -------
+    0 if the reports cover all the shards of the batch; 1 otherwise : int
+    """
+    parser = ArgParser(prog="rogue2yaml merge",
+                       description="Merge the reports of the shards of a batch converted with --shard into the summary "
+                                   "of the whole batch.")
+    parser.add_argument("reports", nargs='+', help="The reports of the shards.")
+    parser.add_argument("--output-dir",
+                        help="Also merge the dependency manifests and the conversion histories found next to the "
+                             "reports into this directory, e.g. where the outputs of the shards are gathered.")
+    parser.add_argument("--report", metavar="FILE", help="Write the merged report to this file.")
+    args = parser.parse_args(argv)
+
+    try:
+        success_files, failure_files, problems = merge_reports(args.reports)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.output_dir:
+        output_file_dir = _process_output_file_dir(args.output_dir)
+        dependency_manifest = DependencyManifest(os.path.join(output_file_dir, DEPENDENCY_MANIFEST_FILENAME))
+        history = ConversionHistory(os.path.join(output_file_dir, HISTORY_FILENAME))
+        for report_dir in sorted(set(os.path.dirname(os.path.abspath(report)) for report in args.reports)):
+            if report_dir != os.path.abspath(output_file_dir):
+                dependency_manifest.update(DependencyManifest(os.path.join(report_dir, DEPENDENCY_MANIFEST_FILENAME)))
+                history.update(ConversionHistory(os.path.join(report_dir, HISTORY_FILENAME)))
+        dependency_manifest.save()
+        history.save()
+
+    _summarize(success_files, failure_files)
+    if args.report:
+        write_report(args.report, success_files, failure_files, interrupted=bool(problems))
+    for problem in problems:
+        logger.warning(problem)
+    return 1 if problems else 0
+
+
+def _worker(argv):
+    """
+    Convert the files served by a coordinator, i.e. a launcher run with --coordinator, until it has no more file.
+
+    Parameters
+    ----------
+    argv : list
+        The subcommand arguments
+
+    Returns
+    -------
+    0 once the coordinator has no more file; 1 if it cannot be reached : int
+    """
+    parser = ArgParser(prog="rogue2yaml worker",
+                       description="Pull the files to convert from a coordinator, i.e. a launcher run with "
+                                   "--coordinator, possibly on another node, and push back the results.")
+    parser.add_argument("address", help="The address of the coordinator, either HOST:PORT or the path of a Unix "
+                                        "socket.")
+    parser.add_argument("rogue_collection_dir", help="The name of the Python Rogue directory on this node.")
+    parser.add_argument("--input-dir", dest="input_dirs", action="append", default=[],
+                        help="A directory of Python Rogue files on this node, e.g. the shared firmware libraries, "
+                             "that the converted files import. Can be repeated.")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="The number of worker processes on this node, each converting one file at a time "
+                             "(default: 1).")
+    parser.add_argument("--connect-timeout", type=float, default=30.0,
+                        help="Keep trying to connect to the coordinator for this number of seconds, e.g. while it is "
+                             "starting (default: 30).")
+    parser.add_argument("--no-bytecode-cache", action="store_true",
+                        help="Compile the received files on every run, without caching their code.")
+    args = parser.parse_args(argv)
+
+    address = parse_address(args.address)
+    try:
+        authkey = get_authkey(address)
+    except ValueError as error:
+        parser.error(str(error))
+
+    for directory in [args.rogue_collection_dir] + args.input_dirs:
+        sys.path.insert(1, os.path.expandvars(os.path.expanduser(directory)))
+
+    try:
+        run_workers(address, authkey, process_count=args.processes, connect_timeout=args.connect_timeout,
+                    bytecode_cache_dir=None if args.no_bytecode_cache else get_default_cache_dir())
+    except OSError as error:
+        logger.error(str(error))
+        return 1
+    return 0
+
+
+def _serve(argv):
+    """
+    Serve the conversion requests from a long-lived daemon, until it is interrupted.
+
+    Parameters
+    ----------
+    argv : list
+        The subcommand arguments
+
+    Returns
+    -------
+    0 once interrupted; 1 if the daemon cannot listen on the address : int
+    """
+    parser = ArgParser(prog="rogue2yaml serve",
+                       description="Convert the files and classes requested over HTTP, on a Unix socket or on "
+                                   "localhost, keeping pyrogue and the settings loaded between the requests.")
+    parser.add_argument("address", help="The address to listen on, either localhost:PORT or the path of a Unix "
+                                        "socket.")
+    parser.add_argument("rogue_collection_dir", help="The name of the Python Rogue directory.")
+    parser.add_argument("--input-dir", dest="input_dirs", action="append", default=[],
+                        help="A directory of Python Rogue files, e.g. the shared firmware libraries, that the "
+                             "converted files import. Can be repeated.")
+    parser.add_argument("--output-dir", default="output",
+                        help="The directory the outputs of the requests are written under, the relative output paths "
+                             "being relative to it (default: output).")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                        help="The number of conversion requests handled at the same time, beyond which the requests "
+                             "are rejected with the status 503 (default: {0}).".format(DEFAULT_MAX_CONCURRENT_REQUESTS))
+    parser.add_argument("--timeout", type=float, default=0,
+                        help="Abandon a conversion running for longer than this number of seconds, and replace the "
+                             "worker process. 0 means no limit (default: 0).")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="Do not classify the files before converting them, i.e. never stub the hardware modules.")
+    parser.add_argument("--no-bytecode-cache", action="store_true",
+                        help="Compile the requested files on every change, without caching their code.")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO",
+                        help="The level of the messages to log (default: INFO).")
+    args = parser.parse_args(argv)
+    if args.max_concurrent < 1:
+        parser.error("The number of concurrent requests must be at least 1.")
+    configure_logging(level=getattr(logging, args.log_level))
+
+    for directory in [args.rogue_collection_dir] + args.input_dirs:
+        sys.path.insert(1, os.path.expandvars(os.path.expanduser(directory)))
+
+    with open(os.path.join("settings", "exclusions.json"), 'r') as exclusion_file:
+        exclusions = json.load(exclusion_file)
+    service = ConversionService(exclusions=exclusions,
+                                bytecode_cache_dir=None if args.no_bytecode_cache else get_default_cache_dir(),
+                                max_concurrent_requests=args.max_concurrent, preflight=not args.no_preflight,
+                                task_timeout=args.timeout, output_root=args.output_dir, input_dirs=args.input_dirs)
+    try:
+        address = parse_address(args.address)
+        # The Unix socket is protected by its permissions instead
+        server = create_server(address, service, authkey=get_authkey(address) if isinstance(address, tuple) else None)
+    except (ValueError, OSError) as error:
+        logger.error("Cannot listen on '{0}'. {1}".format(args.address, error))
+        return 1
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    service.start()
+    logger.info("Serving the conversions on '{0}'...".format(args.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("The daemon has been stopped.")
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+_SUBCOMMANDS = {
+    "compare": _compare,
+    "merge": _merge,
+    "query": _query,
+    "serve": _serve,
+    "worker": _worker,
+}
 
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except Exception as error:
         logger.error("Unexpected exception during the conversion process. Exception type: {0}. Exception: {1}"
                      .format(type(error), error))
@@ -0,0 +1,509 @@
+# Classify the Rogue Python files by static analysis, before paying for their import and instantiation
+
+import os
+import re
+import ast
+import sys
+import types
+import importlib.machinery
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The verdicts of the preflight
+SAFE = "safe"
+NEEDS_STUB = "needs-stub"
+BROKEN = "broken"
+
+# The modules that access the hardware, e.g. by opening a DMA device or a network connection. They are replaced by
+# inert stubs to convert the files that use them.
+HARDWARE_MODULES = ("rogue.hardware", "rogue.protocols", "pyrogue.protocols")
+
+# The constructor defaults that point to hardware, e.g. dev="/dev/datadev_0" or ip="192.168.2.10"
+_HARDWARE_DEFAULT_PATTERN = re.compile(r"^(/dev/|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$)")
+
+# The communication types of the constructors that do not connect to any hardware
+_OFFLINE_COMM_TYPES = ("sim", "none", '')
+
+_IMPORT_ERRORS = ("ImportError", "ModuleNotFoundError", "Exception", "BaseException")
+
+
+PreflightResult = namedtuple("PreflightResult", ["filename", "verdict", "reason"])
+
+
+def classify_file(path, search_path=None):
+    """
+    Classify a Rogue Python file without importing it.
+
+    The file is byte-compiled, and its syntax tree is inspected for the modules it imports, the hardware it accesses,
+    and the class to instantiate and its constructor defaults.
+
+    Parameters
+    ----------
+    path : str
+        The path of the Rogue Python file
+    search_path : list
+        The directories to look for the imported modules in. Defaults to sys.path.
+
+    Returns
+    -------
+    The verdict, i.e. SAFE, NEEDS_STUB if the file accesses the hardware, or BROKEN if it cannot be converted, and the
+    reason for it : PreflightResult
+    """
+    filename = os.path.basename(path)
+    search_path = list(search_path if search_path is not None else sys.path)
+    try:
+        with open(path, 'rb') as source_file:
+            source = source_file.read()
+    except (IOError, OSError) as error:
+        return PreflightResult(filename, BROKEN, "Cannot read the file. {0}".format(error))
+
+    try:
+        tree = compile(source, path, "exec", ast.PyCF_ONLY_AST, dont_inherit=True)
+        compile(tree, path, "exec", dont_inherit=True)
+    except SyntaxError as error:
+        return PreflightResult(filename, BROKEN, "{0}: {1} (line {2})".format(type(error).__name__, error.msg,
+                                                                            error.lineno))
+    except ValueError as error:
+        return PreflightResult(filename, BROKEN, "Cannot compile the file. {0}".format(error))
+
+    visitor = _ImportVisitor()
+    visitor.visit(tree)
+
+    for module_name, level, lineno in visitor.imports:
+        if level:
+            found = _find_relative_module(module_name, level, path)
+        else:
+            found = _is_hardware_module(module_name) or _find_module(module_name, search_path)
+        if not found:
+            return PreflightResult(filename, BROKEN, "Imports the missing module '{0}{1}' (line {2})"
+                                   .format('.' * level, module_name, lineno))
+
+    class_name = get_class_name(filename).lower()
+    class_node = next((node for node in tree.body if isinstance(node, ast.ClassDef) and
+                       node.name.lower() == class_name), None)
+    # The class may also be bound by a star import, or by an assignment, e.g. "Device = _DeviceImpl"
+    bound_names = visitor.imported_names | _get_assigned_names(tree)
+    if class_node is None and not visitor.star_import and class_name not in (name.lower() for name in bound_names):
+        return PreflightResult(filename, BROKEN, "Defines no class named '{0}', with any capitalization"
+                               .format(get_class_name(filename)))
+
+    reasons = ["Accesses the hardware through '{0}' (line {1})".format(name, lineno)
+               for name, lineno in visitor.hardware_accesses[:1]]
+    if class_node is not None:
+        reasons += ["Connects to the hardware by default, with {0}={1!r} (line {2})".format(name, value, lineno)
+                    for name, value, lineno in _find_hardware_defaults(class_node)[:1]]
+    if reasons:
+        return PreflightResult(filename, NEEDS_STUB, ". ".join(reasons))
+    return PreflightResult(filename, SAFE, '')
+
+
+def get_class_name(filename):
+    """
+    Get the name of the class a Rogue Python file is converted from, i.e. the name of the file without its extension,
+    and without one leading underscore, e.g. of "_AxiVersion.py".
+
+    Parameters
+    ----------
+    filename : str
+        The name of the Rogue Python file
+
+    Returns
+    -------
+    The name of the class, up to its capitalization : str
+    """
+    class_name = filename[:-3]
+    if class_name.startswith('_'):
+        class_name = class_name[1:]
+    return class_name
+
+
+def preflight_files(paths, search_path=None, worker_count=0):
+    """
+    Classify Rogue Python files, in this process, or in parallel in worker processes.
+
+    Parameters
+    ----------
+    paths : iterable
+        The paths of the Rogue Python files. The iterable is consumed lazily, a few files ahead of the results.
+    search_path : list
+        The directories to look for the imported modules in. Defaults to sys.path.
+    worker_count : int
+        The number of worker processes. 0 means classifying the files one by one in this process.
+
+    Yields : PreflightResult
+    -------
+        The result of each file, in order
+    """
+    search_path = list(search_path if search_path is not None else sys.path)
+    if not worker_count:
+        for path in paths:
+            yield classify_file(path, search_path)
+        return
+
+    # The workers are not forked from the launcher, whose logging, writer and scan threads may hold locks, but from the
+    # forkserver template process of the conversion workers, where available
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context()
+    window = 4 * worker_count
+    with ProcessPoolExecutor(worker_count, mp_context=context) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(classify_file, path, search_path))
+            while pending and (pending[0].done() or len(pending) >= window):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+@contextmanager
+def stub_modules(module_names=HARDWARE_MODULES):
+    """
+    Replace modules, and their submodules, with inert stubs, e.g. to instantiate a device without connecting to the
+    hardware. Any attribute of a stub module is a stub class, whose instances accept any call, and have any attribute.
+
+    The original modules are restored on exit, and the modules imported in the meantime are forgotten, as they may hold
+    on to the stubs.
+
+    Parameters
+    ----------
+    module_names : tuple
+        The names of the modules to stub. Nothing is stubbed if empty.
+    """
+    if not module_names:
+        yield
+        return
+
+    module_names_before = set(sys.modules)
+    finder = _StubFinder(module_names)
+    saved_modules = {}
+    saved_attributes = []
+    for name in list(sys.modules):
+        if finder.is_stubbed(name):
+            saved_modules[name] = sys.modules.pop(name)
+
+    for module_name in module_names:
+        parent_name, _, child_name = module_name.rpartition('.')
+        parent = sys.modules.get(parent_name)
+        if parent is not None:
+            saved_attributes.append((parent, child_name, getattr(parent, child_name, _MISSING)))
+            stub = sys.modules[module_name] = _StubModule(module_name)
+            setattr(parent, child_name, stub)
+
+    sys.meta_path.insert(0, finder)
+    try:
+        yield
+    finally:
+        sys.meta_path.remove(finder)
+        for name in list(sys.modules):
+            if finder.is_stubbed(name) or name not in module_names_before:
+                del sys.modules[name]
+        sys.modules.update(saved_modules)
+        for parent, child_name, value in reversed(saved_attributes):
+            if value is _MISSING:
+                if hasattr(parent, child_name):
+                    delattr(parent, child_name)
+            else:
+                setattr(parent, child_name, value)
+
+
+class _ImportVisitor(ast.NodeVisitor):
+    """
+    Collect the imports of a module, except those guarded against an ImportError, the names they bind, whether any
+    binds unknown names with "import *", and the attribute chains reaching into the hardware modules.
+    """
+    def __init__(self):
+        self.imports = []
+        self.imported_names = set()
+        self.star_import = False
+        self.hardware_accesses = []
+        self._aliases = {}
+        self._guard_depth = 0
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.asname:
+                self._aliases[alias.asname] = alias.name
+            else:
+                top_name = alias.name.partition('.')[0]
+                self._aliases[top_name] = top_name
+            self._add_import(alias.name, 0, node.lineno)
+
+    def visit_ImportFrom(self, node):
+        module_name = node.module or ''
+        for alias in node.names:
+            if alias.name == '*':
+                self.star_import = True
+                continue
+            local_name = alias.asname or alias.name
+            self.imported_names.add(local_name)
+            if not node.level:
+                self._aliases[local_name] = '.'.join([module_name, alias.name])
+                # e.g. "from pyrogue import protocols"
+                if not _is_hardware_module(module_name) and _is_hardware_module(self._aliases[local_name]):
+                    self.hardware_accesses.append((self._aliases[local_name], node.lineno))
+        self._add_import(module_name, node.level, node.lineno)
+
+    def visit_Try(self, node):
+        guarded = any(_catches_import_errors(handler) for handler in node.handlers)
+        self._guard_depth += guarded
+        for statement in node.body:
+            self.visit(statement)
+        self._guard_depth -= guarded
+        for statement in node.handlers + node.orelse + node.finalbody:
+            self.visit(statement)
+
+    def visit_Attribute(self, node):
+        dotted_name = _get_dotted_name(node)
+        if dotted_name:
+            first_name, _, rest = dotted_name.partition('.')
+            resolved_name = '.'.join(filter(None, [self._aliases.get(first_name, first_name), rest]))
+            if _is_hardware_module(resolved_name):
+                self.hardware_accesses.append((resolved_name, node.lineno))
+                return
+        self.generic_visit(node)
+
+    def _add_import(self, module_name, level, lineno):
+        if not level and _is_hardware_module(module_name):
+            self.hardware_accesses.append((module_name, lineno))
+        if not self._guard_depth:
+            self.imports.append((module_name, level, lineno))
+
+
+class _StubFinder:
+    """
+    Serve the stub modules on import.
+    """
+    def __init__(self, module_names):
+        self._module_names = tuple(module_names)
+
+    def is_stubbed(self, name):
+        return any(name == module_name or name.startswith(module_name + '.') for module_name in self._module_names)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if self.is_stubbed(fullname):
+            return importlib.machinery.ModuleSpec(fullname, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        return _StubModule(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+
+class _StubModule(types.ModuleType):
+    """
+    A module whose every attribute is a stub class.
+    """
+    def __init__(self, name):
+        super(_StubModule, self).__init__(name)
+        self.__path__ = []
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        stub_class = type(name, (_Stub,), {"__module__": self.__name__})
+        setattr(self, name, stub_class)
+        return stub_class
+
+
+class _StubType(type):
+    """
+    The type of the stub classes, whose any attribute is a stub class too, e.g. rogue.hardware.axi.AxiStreamDma.
+    """
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _StubType(name, (_Stub,), {"__module__": cls.__module__})
+
+
+class _Stub(metaclass=_StubType):
+    """
+    An object that accepts any call, and has any attribute, e.g. a DMA channel.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Stub()
+
+    def __rshift__(self, other):
+        # e.g. "dma >> packetizer", which connects streams
+        return other
+
+    def __lshift__(self, other):
+        return self
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return id(self)
+
+    def __bool__(self):
+        return True
+
+
+_MISSING = object()
+
+
+def _is_hardware_module(module_name):
+    return any(module_name == name or module_name.startswith(name + '.') for name in HARDWARE_MODULES)
+
+
+def _catches_import_errors(handler):
+    if handler.type is None:
+        return True
+    types_caught = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(type_caught, ast.Name) and type_caught.id in _IMPORT_ERRORS for type_caught in types_caught)
+
+
+def _get_dotted_name(node):
+    """
+    Get the dotted name of an attribute chain, e.g. "rogue.hardware.axi.AxiMemMap".
+
+    Parameters
+    ----------
+    node : ast.Attribute
+        The outermost attribute of the chain
+
+    Returns
+    -------
+    The dotted name, or None if the chain does not start with a name, e.g. a call : str
+    """
+    names = []
+    while isinstance(node, ast.Attribute):
+        names.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    names.append(node.id)
+    return '.'.join(reversed(names))
+
+
+def _find_module(module_name, search_path):
+    """
+    Check whether a module can be imported, without importing it.
+
+    Parameters
+    ----------
+    module_name : str
+        The dotted name of the module
+    search_path : list
+        The directories to look for the module in
+
+    Returns
+    -------
+    True if the module can be found; False otherwise : bool
+    """
+    parts = module_name.split('.')
+    if parts[0] in sys.builtin_module_names:
+        return True
+
+    locations = search_path
+    for i in range(len(parts)):
+        name = '.'.join(parts[:i + 1])
+        if name in sys.modules:
+            module = sys.modules[name]
+            locations = getattr(module, "__path__", None)
+        else:
+            spec = importlib.machinery.PathFinder.find_spec(name, locations)
+            if spec is None:
+                return False
+            locations = spec.submodule_search_locations
+        if locations is None:
+            # Not a package, so what follows is an attribute, e.g. os.path
+            return True
+    return True
+
+
+def _find_relative_module(module_name, level, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    for _ in range(level - 1):
+        directory = os.path.dirname(directory)
+    if not module_name:
+        return True
+    module_path = os.path.join(directory, *module_name.split('.'))
+    return os.path.isdir(module_path) or os.path.isfile(module_path + ".py")
+
+
+def _get_assigned_names(tree):
+    """
+    Get the names bound by the assignments of a module, at its top level.
+
+    Parameters
+    ----------
+    tree : ast.Module
+        The syntax tree of the module
+
+    Returns
+    -------
+    The assigned names : set
+    """
+    assigned_names = set()
+    targets = []
+    for node in tree.body:
+        targets += node.targets if isinstance(node, ast.Assign) else \
+            [node.target] if isinstance(node, ast.AnnAssign) else []
+    while targets:
+        # Only the names themselves, e.g. not those of "module.name = value", are bound
+        target = targets.pop()
+        if isinstance(target, ast.Name):
+            assigned_names.add(target.id)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            targets += target.elts
+        elif isinstance(target, ast.Starred):
+            targets.append(target.value)
+    return assigned_names
+
+
+def _find_hardware_defaults(class_node):
+    """
+    Find the defaults of the constructor of a class that point to hardware.
+
+    Parameters
+    ----------
+    class_node : ast.ClassDef
+        The class
+
+    Returns
+    -------
+    The name, value and line of each such default : list
+    """
+    constructor = next((node for node in class_node.body if isinstance(node, ast.FunctionDef) and
+                        node.name == "__init__"), None)
+    if constructor is None:
+        return []
+
+    arguments = constructor.args
+    positional_arguments = arguments.posonlyargs + arguments.args if hasattr(arguments, "posonlyargs") else \
+        arguments.args
+    defaults = list(zip(positional_arguments[len(positional_arguments) - len(arguments.defaults):],
+                        arguments.defaults))
+    defaults += [(argument, default) for argument, default in zip(arguments.kwonlyargs, arguments.kw_defaults)
+                 if default is not None]
+
+    hardware_defaults = []
+    for argument, default in defaults:
+        value = getattr(default, "value", None)
+        if not isinstance(value, str):
+            continue
+        if _HARDWARE_DEFAULT_PATTERN.match(value) or \
+                (argument.arg.lower() == "commtype" and value.lower() not in _OFFLINE_COMM_TYPES):
+            hardware_defaults.append((argument.arg, value, default.lineno))
+    return hardware_defaults
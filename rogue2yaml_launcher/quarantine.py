@@ -0,0 +1,106 @@
+# Quarantine the files that hang or crash their worker, so that the next runs skip them until their source changes
+
+import os
+import json
+import time
+import hashlib
+
+from rogue2yaml.output_writer import write_file
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The quarantine is kept in the output directory, next to the outputs of the batch
+QUARANTINE_FILENAME = ".rogue2yaml_quarantine.json"
+
+QUARANTINE_VERSION = 1
+
+
+class Quarantine:
+    """
+    The files that have timed out or crashed their worker, with the reason, the time, and the hash of their source.
+    """
+    def __init__(self, filename):
+        """
+        Load the quarantine, if it exists.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the quarantine file
+        """
+        self.filename = filename
+        self._files = {}
+        self._modified = False
+
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as quarantine_file:
+                    quarantine = json.load(quarantine_file)
+                if quarantine.get("version") == QUARANTINE_VERSION:
+                    self._files = quarantine.get("files", {})
+            except (OSError, ValueError) as error:
+                logger.warning("Ignoring the quarantine '{0}', which cannot be read. {1}".format(filename, error))
+
+    def check(self, filename, path):
+        """
+        Check whether a file is quarantined. A quarantined file whose source has changed since is released.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the Rogue Python file
+        path : str
+            The path of the source of the file
+
+        Returns
+        -------
+        The quarantine record of the file, with its reason, time and sha1, or None if the file is not quarantined : dict
+        """
+        record = self._files.get(filename)
+        if record is None:
+            return None
+        if _hash_file(path) == record.get("sha1"):
+            return record
+
+        logger.info("Releasing file '{0}' from the quarantine, as its source has changed.".format(filename))
+        del self._files[filename]
+        self._modified = True
+        return None
+
+    def add(self, filename, path, reason):
+        """
+        Quarantine a file.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the Rogue Python file
+        path : str
+            The path of the source of the file, to hash
+        reason : str
+            Why the file is quarantined, e.g. a timeout
+        """
+        sha1 = _hash_file(path)
+        if sha1 is None:
+            return
+        logger.warning("Quarantining file '{0}'. {1}".format(filename, reason))
+        self._files[filename] = {"reason": reason, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "sha1": sha1}
+        self._modified = True
+
+    def save(self):
+        """
+        Save the quarantine, if it has changed.
+        """
+        if self._modified:
+            write_file(self.filename, json.dumps({"version": QUARANTINE_VERSION, "files": self._files}, indent=1,
+                                                 sort_keys=True))
+            self._modified = False
+
+
+def _hash_file(path):
+    try:
+        with open(path, 'rb') as source_file:
+            return hashlib.sha1(source_file.read()).hexdigest()
+    except (IOError, OSError):
+        return None
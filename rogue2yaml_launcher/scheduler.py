@@ -0,0 +1,257 @@
+# Schedule the conversions on the worker processes using the durations and memory peaks of the previous runs
+
+import os
+import json
+
+from rogue2yaml.output_writer import write_file
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The conversion history is kept in the output directory, next to the outputs it describes
+HISTORY_FILENAME = ".rogue2yaml_history.json"
+
+HISTORY_VERSION = 1
+
+# The weight of the latest run in the estimates, the previous runs weighing the rest
+HISTORY_SMOOTHING = 0.5
+
+# The number of discovered tasks the longest one is picked among, when not waiting for all of them
+DEFAULT_LOOKAHEAD = 16
+
+
+class ConversionHistory:
+    """
+    The conversion duration and peak memory of each file, from the previous runs.
+    """
+    def __init__(self, filename):
+        """
+        Load the conversion history, if it exists.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the conversion history file
+        """
+        self.filename = filename
+        self._files = {}
+        self._modified = False
+
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as history_file:
+                    history = json.load(history_file)
+                if history.get("version") == HISTORY_VERSION:
+                    self._files = history.get("files", {})
+            except (OSError, ValueError) as error:
+                logger.warning("Ignoring the conversion history '{0}', which cannot be read. {1}"
+                               .format(filename, error))
+
+        # The files never converted before are assumed to be typical ones
+        self._default_estimate = (_median([entry["duration"] for entry in self._files.values()]),
+                                  _median([entry["peak_memory"] for entry in self._files.values()]))
+
+    def estimate(self, filename):
+        """
+        Estimate the conversion cost of a file.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the Rogue Python file
+
+        Returns
+        -------
+        The estimated duration, in seconds, and peak memory, in MB : tuple(float, float)
+        """
+        entry = self._files.get(filename)
+        if entry is None:
+            return self._default_estimate
+        return entry["duration"], entry["peak_memory"]
+
+    def record(self, filename, duration, peak_memory):
+        """
+        Record the cost of a conversion, which is blended into the previous ones.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the Rogue Python file
+        duration : float
+            The conversion duration, in seconds
+        peak_memory : float
+            The peak resident memory of the worker during the conversion, in MB, or None if unknown
+        """
+        entry = self._files.get(filename)
+        if entry is None:
+            entry = self._files[filename] = {"duration": duration, "peak_memory": peak_memory or 0.0}
+        else:
+            entry["duration"] = HISTORY_SMOOTHING * duration + (1 - HISTORY_SMOOTHING) * entry["duration"]
+            if peak_memory is not None:
+                entry["peak_memory"] = HISTORY_SMOOTHING * peak_memory + \
+                    (1 - HISTORY_SMOOTHING) * entry["peak_memory"]
+        self._modified = True
+
+    def update(self, other):
+        """
+        Add the costs of the files of another history, e.g. of another shard of the batch, replacing those of the same
+        files.
+
+        Parameters
+        ----------
+        other : ConversionHistory
+            The other history
+        """
+        if other._files:
+            self._files.update(other._files)
+            self._modified = True
+
+    def save(self):
+        """
+        Save the conversion history, if it has changed.
+        """
+        if self._modified:
+            write_file(self.filename, json.dumps({"version": HISTORY_VERSION, "files": self._files}, indent=1,
+                                                 sort_keys=True))
+            self._modified = False
+
+
+class CostModelScheduler:
+    """
+    Hand out the conversion tasks to the worker pool longest first, so that the longest conversions do not start last
+    and dominate the total duration, while keeping the estimated peak memory of the running conversions within a
+    budget.
+
+    The tasks are either all collected up front, and then all ordered, or taken as they come, e.g. as the files are
+    discovered, the longest of the next few tasks running first.
+
+    The scheduler implements the task source interface of WorkerPool.imap_unordered().
+    """
+    def __init__(self, tasks, history, memory_budget=0, get_filename=None, get_size=None, lookahead=0):
+        """
+        Initialize the scheduler.
+
+        Parameters
+        ----------
+        tasks : iterable
+            The tasks to schedule. The iterable is consumed lazily, a lookahead ahead of the running tasks.
+        history : ConversionHistory
+            The conversion history to estimate the costs from, and to record the new costs into
+        memory_budget : float
+            The total estimated peak memory, in MB, of the conversions running concurrently. 0 means no limit. A
+            conversion estimated to exceed the budget on its own is only run when nothing else is.
+        get_filename : callable
+            Get the name of the Rogue Python file of a task. Defaults to the first item of the task.
+        get_size : callable
+            Get the size of a task, to order the tasks with the same estimated duration, e.g. files never converted
+            before. Defaults to the size of the file in the "input" directory.
+        lookahead : int
+            The number of pending tasks to pick the next one among. 0 means collecting all the tasks up front.
+        """
+        self._history = history
+        self._memory_budget = memory_budget
+        self._get_filename = get_filename or (lambda task: task[0])
+        self._get_size = get_size or (lambda task: _get_file_size(os.path.join("input", self._get_filename(task))))
+        self._lookahead = lookahead
+
+        self._tasks = iter(tasks)
+        self._estimates = {}
+        self._sort_keys = {}
+        self._pending = []
+        self._fill()
+
+        self._running = {}
+        self._running_memory = 0.0
+        self._durations = []
+
+    @property
+    def exhausted(self):
+        self._fill()
+        return not self._pending
+
+    def pop(self):
+        """
+        Get the next task to run: the longest one that fits within the memory budget.
+
+        Returns
+        -------
+        The next task, or None if no task fits within the memory budget until a running task completes : tuple
+        """
+        self._fill()
+        for i, task in enumerate(self._pending):
+            memory = self._estimates[self._get_filename(task)][1]
+            if not self._memory_budget or not self._running or \
+                    self._running_memory + memory <= self._memory_budget:
+                del self._pending[i]
+                self._running[self._get_filename(task)] = memory
+                self._running_memory += memory
+                return task
+        return None
+
+    def task_done(self, task, duration, peak_memory):
+        """
+        Record the cost of a completed task, and release its memory reservation.
+
+        Parameters
+        ----------
+        task : tuple
+            The completed task
+        duration : float
+            The duration of the task, in seconds
+        peak_memory : float
+            The peak resident memory of the worker during the task, in MB, or None if unknown
+        """
+        filename = self._get_filename(task)
+        self._running_memory -= self._running.pop(filename, 0.0)
+        self._durations.append(duration)
+        self._history.record(filename, duration, peak_memory)
+
+    def _fill(self):
+        """
+        Take the next tasks, up to the lookahead, keeping the pending tasks ordered from the longest to the shortest.
+        """
+        if self._tasks is None or (self._lookahead and len(self._pending) >= self._lookahead):
+            return
+        for task in self._tasks:
+            filename = self._get_filename(task)
+            self._estimates[filename] = self._history.estimate(filename)
+            self._sort_keys[filename] = (self._estimates[filename][0], self._get_size(task))
+            self._pending.append(task)
+            if self._lookahead and len(self._pending) >= self._lookahead:
+                break
+        else:
+            self._tasks = None
+        self._pending.sort(key=lambda task: self._sort_keys[self._get_filename(task)], reverse=True)
+
+    def get_ideal_makespan(self, worker_count):
+        """
+        Get a lower bound of the total duration of the completed tasks with a number of workers, i.e. the longest task
+        or the even share of the total duration of the tasks, whichever is longer.
+
+        Parameters
+        ----------
+        worker_count : int
+            The number of workers
+
+        Returns
+        -------
+        The lower bound of the total duration, in seconds : float
+        """
+        if not self._durations:
+            return 0.0
+        return max(max(self._durations), sum(self._durations) / max(1, worker_count))
+
+
+def _median(values):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def _get_file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
@@ -0,0 +1,206 @@
+# Split a conversion batch into shards, e.g. to run on several build nodes, and merge the reports of the shards
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+from rogue2yaml.output_writer import write_file
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+
+def parse_shard(shard_spec):
+    """
+    Parse a shard specification, e.g. "2/4" for the second shard of four.
+
+    Parameters
+    ----------
+    shard_spec : str
+        The shard specification, "K/N", with 1 <= K <= N
+
+    Returns
+    -------
+    The 1-based index of the shard, and the number of shards : tuple(int, int)
+
+    Raises
+    ------
+    ValueError
+        If the specification is invalid
+    """
+    try:
+        shard_index, shard_count = [int(part) for part in shard_spec.split('/')]
+    except ValueError:
+        raise ValueError("The shard must be given as K/N, e.g. 2/4, not '{0}'.".format(shard_spec))
+    if not 1 <= shard_index <= shard_count:
+        raise ValueError("The shard index must be between 1 and the number of shards, not {0}.".format(shard_spec))
+    return shard_index, shard_count
+
+
+def get_hashed_shard(filename, shard_count):
+    """
+    Get the shard of a file from a stable hash of its name, which is the same on every node and in every run.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the Rogue Python file
+    shard_count : int
+        The number of shards
+
+    Returns
+    -------
+    The 1-based index of the shard of the file : int
+    """
+    return int(hashlib.sha1(filename.encode("utf-8")).hexdigest(), 16) % shard_count + 1
+
+
+def get_balanced_shards(filenames, shard_count, history):
+    """
+    Split files into shards of about the same total duration, from the durations of the previous runs.
+
+    The longest files are assigned first, each to the shard with the shortest total so far, or with the fewest files
+    for the same total, e.g. if the history is empty. The split only depends on the names of the files and on the
+    history, so that every node computes the same split from the same inputs.
+
+    Parameters
+    ----------
+    filenames : iterable
+        The names of the Rogue Python files
+    shard_count : int
+        The number of shards
+    history : ConversionHistory
+        The conversion history to estimate the durations from
+
+    Returns
+    -------
+    The 1-based index of the shard of each file, keyed by file name : dict
+    """
+    durations = dict((filename, history.estimate(filename)[0]) for filename in set(filenames))
+    loads = [(0.0, 0)] * shard_count
+    shards = {}
+    for filename in sorted(durations, key=lambda name: (-durations[name], name)):
+        shard = loads.index(min(loads))
+        loads[shard] = (loads[shard][0] + durations[filename], loads[shard][1] + 1)
+        shards[filename] = shard + 1
+    return shards
+
+
+def select_shard(paths, shard_index, shard_count, history=None):
+    """
+    Select the files of a shard.
+
+    Parameters
+    ----------
+    paths : iterable
+        The paths of the Rogue Python files of the whole batch
+    shard_index : int
+        The 1-based index of the shard
+    shard_count : int
+        The number of shards
+    history : ConversionHistory
+        If provided, split the files by estimated duration, which requires collecting all the paths first. Otherwise,
+        split them by a hash of their names, as they come.
+
+    Yields : str
+    -------
+        The paths of the files of the shard
+    """
+    if history is None:
+        for path in paths:
+            if get_hashed_shard(os.path.basename(path), shard_count) == shard_index:
+                yield path
+        return
+
+    paths = list(paths)
+    shards = get_balanced_shards([os.path.basename(path) for path in paths], shard_count, history)
+    for path in paths:
+        if shards[os.path.basename(path)] == shard_index:
+            yield path
+
+
+def write_report(filename, success_files, failure_files, shard=None, interrupted=False):
+    """
+    Write the outcome of a run as a JSON report.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the report file
+    success_files : list
+        A name list of files that are successfully converted
+    failure_files : dict
+        The reasons why the files have not been converted, keyed by file name
+    shard : tuple(int, int)
+        The 1-based index of the shard of the run, and the number of shards, if sharded
+    interrupted : bool
+        True if the run has been interrupted
+    """
+    report = OrderedDict([("version", REPORT_VERSION), ("shard", list(shard) if shard else None),
+                          ("interrupted", interrupted), ("succeeded", list(success_files)),
+                          ("failed", OrderedDict(failure_files))])
+    write_file(filename, json.dumps(report, indent=1))
+
+
+def merge_reports(filenames):
+    """
+    Merge the reports of the shards of a batch.
+
+    The files excluded by the settings appear in the report of every shard, and are only kept once. A file that
+    succeeded in a shard is not reported as failed by another.
+
+    Parameters
+    ----------
+    filenames : list
+        The names of the report files
+
+    Returns
+    -------
+    The files successfully converted, sorted, the reasons why the other files have not been converted, keyed by file
+    name, and the problems found in the reports, e.g. missing shards : tuple(list, OrderedDict, list)
+
+    Raises
+    ------
+    ValueError
+        If a report cannot be read
+    """
+    success_files = set()
+    failure_files = OrderedDict()
+    problems = []
+    shards = set()
+    shard_count = None
+    for filename in filenames:
+        try:
+            with open(filename, 'r') as report_file:
+                report = json.load(report_file, object_pairs_hook=OrderedDict)
+        except (IOError, OSError, ValueError) as error:
+            raise ValueError("Cannot read the report '{0}'. {1}".format(filename, error))
+        if report.get("version") != REPORT_VERSION:
+            raise ValueError("The report '{0}' has the unsupported version {1}.".format(filename,
+                                                                                      report.get("version")))
+
+        if report.get("shard"):
+            shards.add(report["shard"][0])
+            if shard_count not in (None, report["shard"][1]):
+                problems.append("The report '{0}' is from a batch of {1} shards, not {2}."
+                                .format(filename, report["shard"][1], shard_count))
+            shard_count = report["shard"][1]
+        if report.get("interrupted"):
+            problems.append("The run of the report '{0}' has been interrupted.".format(filename))
+
+        success_files.update(report.get("succeeded", []))
+        for name, reason in report.get("failed", {}).items():
+            failure_files.setdefault(name, reason)
+
+    if shard_count:
+        missing_shards = sorted(set(range(1, shard_count + 1)) - shards)
+        if missing_shards:
+            problems.append("The reports of the shards {0} of {1} are missing."
+                            .format(', '.join(str(shard) for shard in missing_shards), shard_count))
+
+    for name in success_files:
+        failure_files.pop(name, None)
+    return sorted(success_files), failure_files, problems
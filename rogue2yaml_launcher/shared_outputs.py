@@ -0,0 +1,131 @@
+# Pass the large outputs of the worker processes to the launcher through shared memory, rather than through their pipes
+
+import threading
+from collections import OrderedDict
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from rogue2yaml.converter_logging import logging
+logger = logging.getLogger(__name__)
+
+# The outputs of a conversion smaller than this number of bytes in total are sent through the pipe of the worker, as
+# creating a shared memory segment costs more than pickling them
+DEFAULT_SHARED_OUTPUT_THRESHOLD = 256 * 1024
+
+
+class SharedOutputs:
+    """
+    The outputs of a conversion placed in a shared memory segment by a worker process.
+
+    Only the name of the segment, and the location of each output in it, are pickled back to the launcher, which reads
+    the outputs in place, and removes the segment once they are all written.
+    """
+    def __init__(self, segment_name, entries):
+        """
+        Initialize the descriptor.
+
+        Parameters
+        ----------
+        segment_name : str
+            The name of the shared memory segment
+        entries : list
+            The (output name, offset, length) of each output in the segment. The output name of the CPSW YAML contents
+            is None; the others are the names of the sidecars.
+        """
+        self.segment_name = segment_name
+        self.entries = entries
+        self._segment = None
+        self._pending_count = 0
+        self._lock = None
+
+    def __getstate__(self):
+        return {"segment_name": self.segment_name, "entries": self.entries}
+
+    def __setstate__(self, state):
+        self.__init__(state["segment_name"], state["entries"])
+
+    def open(self):
+        """
+        Attach the segment, in the launcher.
+
+        Returns
+        -------
+        A view of each output, keyed by its output name. Each view must be passed to release() once written. :
+        OrderedDict
+
+        Raises
+        ------
+        OSError
+            If the segment cannot be attached, e.g. if it has already been removed
+        """
+        self._segment = shared_memory.SharedMemory(self.segment_name)
+        self._pending_count = len(self.entries)
+        self._lock = threading.Lock()
+        return OrderedDict((name, self._segment.buf[offset:offset + length]) for name, offset, length in self.entries)
+
+    def release(self, view):
+        """
+        Release the view of an output, removing the segment once all the views are released. Thread-safe.
+
+        Parameters
+        ----------
+        view : memoryview
+            A view returned by open()
+        """
+        view.release()
+        with self._lock:
+            self._pending_count -= 1
+            if self._pending_count:
+                return
+        self._segment.close()
+        try:
+            self._segment.unlink()
+        except OSError:
+            pass
+        self._segment = None
+
+
+def share_outputs(result, threshold=DEFAULT_SHARED_OUTPUT_THRESHOLD):
+    """
+    Move the outputs of a successful conversion into a shared memory segment, in a worker process, if they are large
+    enough. Otherwise, or if the platform does not provide shared memory, the result is left as is.
+
+    Parameters
+    ----------
+    result : ConversionResult
+        The outcome of the conversion, whose contents and sidecars are replaced with a SharedOutputs descriptor
+    threshold : int
+        The total size, in bytes, of the outputs below which they are left in the result
+    """
+    if shared_memory is None or not result.succeeded:
+        return
+
+    outputs = [(None, result.contents)] + list(result.sidecars.items())
+    outputs = [(name, contents.encode("utf-8") if not isinstance(contents, bytes) else contents)
+               for name, contents in outputs]
+    size = sum(len(contents) for _, contents in outputs)
+    if size < threshold:
+        return
+
+    try:
+        segment = shared_memory.SharedMemory(create=True, size=size)
+    except (OSError, ValueError) as error:
+        # e.g. if /dev/shm is full
+        logger.debug("Cannot create a shared memory segment of {0} bytes. {1}".format(size, error))
+        return
+
+    entries = []
+    offset = 0
+    for name, contents in outputs:
+        segment.buf[offset:offset + len(contents)] = contents
+        entries.append((name, offset, len(contents)))
+        offset += len(contents)
+    # The segment is removed by the launcher, once it has written the outputs
+    segment.close()
+
+    result.contents = None
+    result.sidecars = OrderedDict()
+    result.shared_outputs = SharedOutputs(segment.name, entries)
@@ -0,0 +1,353 @@
+# A pool of pre-forked conversion workers sharing the preloaded Rogue libraries
+
+import os
+import time
+import signal
+import multiprocessing
+from multiprocessing.connection import wait
+
+from rogue2yaml.converter_logging import configure_worker_logging, get_process_queue, logging
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    Run conversions in a pool of worker processes.
+
+    Where the platform supports it, the workers are forked from a forkserver template process that has already imported
+    pyrogue, PyYAML, and the shared firmware libraries, such as surf. The workers then share those pages copy-on-write,
+    and each conversion only pays for the device-specific work.
+
+    A worker is recycled, i.e. replaced with a freshly forked worker, after it has converted a given number of files, or
+    when its resident memory exceeds a given threshold. A worker running a task for longer than a given timeout is
+    killed, and replaced.
+    """
+    # Modules to import once in the template process. Modules that cannot be imported are silently skipped.
+    DEFAULT_PRELOAD_MODULES = ("yaml", "pyrogue", "surf", "rogue2yaml.yaml_converter", "rogue2yaml_launcher.conversion")
+
+    def __init__(self, target, worker_count, max_tasks_per_worker=0, max_worker_memory=0, task_timeout=0,
+                 preload_modules=DEFAULT_PRELOAD_MODULES):
+        """
+        Initialize the pool. The workers are started on demand.
+
+        Parameters
+        ----------
+        target : callable
+            A module-level function to call with each task's arguments in a worker
+        worker_count : int
+            The maximum number of worker processes
+        max_tasks_per_worker : int
+            The number of tasks after which a worker is recycled. 0 means never.
+        max_worker_memory : int
+            The resident memory, in MB, beyond which a worker is recycled. 0 means never.
+        task_timeout : float
+            The duration, in seconds, beyond which a task is abandoned, and its worker killed. 0 means no limit.
+        preload_modules : tuple
+            The names of the modules to import in the template process
+        """
+        self._target = target
+        self._worker_count = max(1, worker_count)
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self._max_worker_memory = max_worker_memory
+        self._task_timeout = task_timeout
+
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(list(preload_modules))
+        else:
+            self._context = multiprocessing.get_context()
+
+        # The workers send their log records to the launcher, which writes them
+        self._log_queue = get_process_queue(self._context)
+        self._workers = []
+
+    def imap_unordered(self, tasks, scheduler=None):
+        """
+        Run the target on each task, yielding the outcomes as they complete.
+
+        Parameters
+        ----------
+        tasks : iterable
+            The tuples of arguments to call the target with. The iterable is consumed lazily, only when a worker
+            becomes available. Ignored if a scheduler is provided.
+        scheduler : object
+            If provided, the source of the tasks, which decides which task runs next. It provides pop(), which returns
+            the next task, or None if no task can start until a running task completes, and which must return a task
+            if no task is running; the exhausted property, which is True once all the tasks have been popped; and
+            task_done(task, duration, peak_memory), which is called as each task completes. It may also provide the
+            wakeup_connection attribute, a connection that becomes readable when new tasks can start, whose pending
+            data is then discarded.
+
+        Yields : tuple
+        -------
+            (task, result, error). If the worker died while running the task, or the task timed out, result is None, and
+            error describes what happened.
+        """
+        if scheduler is None:
+            scheduler = _IteratorScheduler(tasks)
+
+        while True:
+            while not scheduler.exhausted:
+                worker = self._get_idle_worker()
+                if not worker:
+                    break
+                task = scheduler.pop()
+                if task is None:
+                    break
+                worker.assign(task)
+
+            busy_workers = [worker for worker in self._workers if worker.task is not None]
+            if not busy_workers:
+                break
+
+            timeout = None
+            if self._task_timeout:
+                timeout = max(0.0, min(worker.assign_time for worker in busy_workers) + self._task_timeout -
+                              time.time())
+
+            wakeup_connection = getattr(scheduler, "wakeup_connection", None)
+            ready = wait([worker.connection for worker in busy_workers] +
+                         [worker.process.sentinel for worker in busy_workers] +
+                         ([wakeup_connection] if wakeup_connection else []), timeout)
+            if wakeup_connection in ready:
+                while wakeup_connection.poll():
+                    wakeup_connection.recv_bytes()
+            for worker in busy_workers:
+                if worker.connection not in ready and worker.process.sentinel not in ready:
+                    duration = time.time() - worker.assign_time
+                    if self._task_timeout and duration >= self._task_timeout:
+                        task = worker.task
+                        worker.task = None
+                        self._retire(worker, kill=True)
+                        scheduler.task_done(task, duration, None)
+                        yield task, None, "The conversion timed out after {0} seconds".format(self._task_timeout)
+                    continue
+
+                task = worker.task
+                worker.task = None
+                try:
+                    result, retiring, duration, peak_memory = worker.connection.recv()
+                except (EOFError, OSError):
+                    worker.process.join()
+                    self._retire(worker)
+                    scheduler.task_done(task, time.time() - worker.assign_time, None)
+                    yield task, None, "The worker process exited unexpectedly with code {0}".format(
+                        worker.process.exitcode)
+                    continue
+
+                if retiring:
+                    self._retire(worker)
+                scheduler.task_done(task, duration, peak_memory)
+                yield task, result, None
+
+    def start(self):
+        """
+        Start all the workers ahead of the first tasks, e.g. so that a daemon does not wait for them on its first
+        request.
+        """
+        while len(self._workers) < self._worker_count:
+            self._start_worker()
+
+    def close(self):
+        """
+        Stop all the workers.
+        """
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_idle_worker(self):
+        """
+        Get a worker that is not running any task, starting a new worker if the pool is not at full capacity yet.
+
+        Returns
+        -------
+        An idle worker, or None if all the workers are busy : _Worker
+        """
+        for worker in self._workers:
+            if worker.task is None:
+                return worker
+        if len(self._workers) < self._worker_count:
+            return self._start_worker()
+        return None
+
+    def _start_worker(self):
+        worker = _Worker(self._context, self._target, self._max_tasks_per_worker, self._max_worker_memory,
+                         self._log_queue)
+        self._workers.append(worker)
+        return worker
+
+    def _retire(self, worker, kill=False):
+        """
+        Remove a worker from the pool. A replacement will be started on demand.
+
+        Parameters
+        ----------
+        worker : _Worker
+            The worker to remove
+        kill : bool
+            True to kill the worker right away, e.g. if it is stuck; False to let it exit
+        """
+        logger.debug("Recycling worker process {0}...".format(worker.process.pid))
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        self._workers.remove(worker)
+
+
+class _IteratorScheduler:
+    """
+    Hand out the tasks of an iterable in order, as the workers become available.
+    """
+    def __init__(self, tasks):
+        self._tasks = iter(tasks)
+        self.exhausted = False
+
+    def pop(self):
+        try:
+            return next(self._tasks)
+        except StopIteration:
+            self.exhausted = True
+            return None
+
+    def task_done(self, task, duration, peak_memory):
+        pass
+
+
+class _Worker:
+    """
+    The launcher's handle on a worker process.
+    """
+    def __init__(self, context, target, max_tasks, max_memory, log_queue):
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=_work, args=(worker_connection, target, max_tasks, max_memory, log_queue,
+                                                           logging.getLogger().getEffectiveLevel()))
+        self.process.daemon = True
+        self.process.start()
+        worker_connection.close()
+        self.task = None
+        self.assign_time = None
+
+    def assign(self, task):
+        self.task = task
+        self.assign_time = time.time()
+        self.connection.send(task)
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except (OSError, ValueError):
+                pass
+            self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+def _work(connection, target, max_tasks, max_memory, log_queue, log_level):
+    """
+    The main loop of a worker process.
+
+    Parameters
+    ----------
+    connection : Connection
+        The worker's end of the pipe to the launcher
+    target : callable
+        The function to call with each task's arguments
+    max_tasks : int
+        The number of tasks after which the worker exits. 0 means never.
+    max_memory : int
+        The resident memory, in MB, beyond which the worker exits. 0 means never.
+    log_queue : multiprocessing.Queue
+        The queue to send the log records to the launcher through
+    log_level : int
+        The level of the records to log
+    """
+    configure_worker_logging(log_queue, log_level)
+
+    # Ctrl-C is handled by the launcher, which lets the running conversions complete, then stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    task_count = 0
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+
+        _reset_peak_memory()
+        start_time = time.time()
+        result = target(*task)
+        duration = time.time() - start_time
+        task_count += 1
+
+        retiring = bool((max_tasks and task_count >= max_tasks) or
+                        (max_memory and _get_resident_memory() >= max_memory))
+        connection.send((result, retiring, duration, _get_peak_memory()))
+        if retiring:
+            break
+
+
+def _get_resident_memory():
+    """
+    Get the current resident memory of this process.
+
+    Returns
+    -------
+    The resident memory in MB : float
+    """
+    try:
+        with open("/proc/self/statm", 'r') as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError):
+        # Fall back to the peak resident memory, which is reported in KB on Linux
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _reset_peak_memory():
+    """
+    Reset the peak resident memory of this process to its current resident memory, where the platform supports it.
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def _get_peak_memory():
+    """
+    Get the peak resident memory of this process since it was last reset.
+
+    Returns
+    -------
+    The peak resident memory in MB, or None if unknown : float
+    """
+    try:
+        with open("/proc/self/status", 'r') as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    # e.g. "VmHWM:     8752 kB"
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
@@ -2,13 +2,44 @@ import pytest
 
 import os
 import sys
+import json
+import pickle
+import asyncio
+import threading
+import multiprocessing
+import urllib.request
+import urllib.error
+from multiprocessing.connection import Client
+from collections import OrderedDict
 from pydoc import locate
 import difflib
 
 sys.path.insert(1, "/afs/slac.stanford.edu/g/lcls/vol9/package/pyrogue/rogue/v2.8.3/python")
 
-from rogue2yaml_launcher.main import _generate_class_name_variations
-from rogue2yaml.yaml_converter import YamlConverter
+import rogue2yaml_launcher.async_conversion
+from rogue2yaml_launcher.async_conversion import AsyncConverter
+from rogue2yaml_launcher.bytecode_cache import install_bytecode_cache, prune_bytecode_cache
+from rogue2yaml_launcher.coordinator import Coordinator, parse_address
+from rogue2yaml_launcher.daemon import ConversionService, create_server
+from rogue2yaml_launcher.conversion import ConversionOptions, ConversionResult, _generate_class_name_variations
+from rogue2yaml_launcher.dependencies import DependencyManifest
+from rogue2yaml_launcher.engines import ENGINE_PROCESSES, ENGINE_THREADS, InProcessPool, select_engine
+from rogue2yaml_launcher.discovery import find_rogue_files
+from rogue2yaml_launcher.journal import FAILED, SUCCEEDED, RunJournal
+from rogue2yaml_launcher.quarantine import Quarantine
+from rogue2yaml_launcher.main import _collect_rogue_files
+from rogue2yaml_launcher.preflight import BROKEN, NEEDS_STUB, SAFE, classify_file, preflight_files
+from rogue2yaml_launcher.scheduler import ConversionHistory, CostModelScheduler
+from rogue2yaml_launcher.shared_outputs import share_outputs
+from rogue2yaml_launcher.sharding import get_balanced_shards, merge_reports, parse_shard, select_shard, write_report
+from rogue2yaml.yaml_converter import DEFAULT_NODE_HANDLERS, YamlConverter
+from rogue2yaml.node_handlers import NodeHandler
+from rogue2yaml.output_writer import WriteBehindWriter
+from rogue2yaml.yaml_comparator import compare_directories, compare_files, load_register_map
+from rogue2yaml.sidecar import dump_sidecar
+from rogue2yaml.address_map import AddressMap, build_address_map, render_binary
+from rogue2yaml.register_index import RegisterIndex
+from rogue2yaml.converter_logging import log_context, logging
 
 
 @pytest.mark.parametrize("rogue_filename, class_name", [
@@ -64,3 +95,690 @@ def test_generate_class_name_variations(class_name):
     except Exception:
         assert False
     assert True
+
+
+class _Register:
+    def __init__(self, name, offset):
+        self.name = name
+        self.offset = offset
+
+
+class _SiteRegister(_Register):
+    pass
+
+
+class _SiteRegisterHandler(NodeHandler):
+    def serialize(self, converter, nodes, replica_count):
+        for name, node in nodes.items():
+            converter.add_child(name, [("at", {"offset": hex(node.offset)}), ("class", "SiteField")])
+
+
+def test_node_handlers():
+    node_handlers = DEFAULT_NODE_HANDLERS.copy()
+    handler = _SiteRegisterHandler()
+    node_handlers.register(_SiteRegister, handler)
+    # The subclasses share the handlers of their base class, unless registered themselves
+    assert node_handlers.get_handlers(type("_DerivedRegister", (_SiteRegister,), {})) == (handler,)
+    assert node_handlers.get_handlers(_Register) == ()
+    assert DEFAULT_NODE_HANDLERS.get_handlers(_SiteRegister) == ()
+
+    # A handler must implement serialize()
+    with pytest.raises(TypeError):
+        type("_IncompleteHandler", (NodeHandler,), {})()
+
+    class Device:
+        name = "SiteDevice"
+        nodes = OrderedDict([("Unknown", _Register("Unknown", 0)), ("Scratch", _SiteRegister("Scratch", 4))])
+
+    children = YamlConverter(Device(), node_handlers).build_model()["SiteDevice"]["children"]
+    assert list(children) == ["Scratch"]
+    assert children["Scratch"]["class"] == "SiteField" and children["Scratch"]["at"]["offset"] == 4
+
+
+def test_write_behind_writer(tmpdir):
+    with WriteBehindWriter(thread_count=2, max_pending_files=1) as writer:
+        for i in range(0, 10):
+            writer.submit(os.path.join(str(tmpdir), "file{0}.yaml".format(i)), "contents {0}".format(i),
+                          name="file{0}".format(i))
+        writer.submit(os.path.join(str(tmpdir), "missing_dir", "bad.yaml"), "contents", name="bad")
+
+    for i in range(0, 10):
+        with open(os.path.join(str(tmpdir), "file{0}.yaml".format(i))) as output_file:
+            assert output_file.read() == "contents {0}".format(i)
+    assert list(writer.errors.keys()) == ["bad"]
+    assert not [filename for filename in os.listdir(str(tmpdir)) if filename.endswith(".tmp")]
+
+
+def test_find_rogue_files(tmpdir):
+    for path in ["AxiVersion.py", "_top.py", "README.md", os.path.join("surf", "AxiStream.py"),
+                 os.path.join("surf", "build", "Generated.py")]:
+        tmpdir.ensure(path)
+    root = str(tmpdir)
+
+    # Build directories are pruned by default
+    found = sorted(os.path.relpath(path, root) for path in find_rogue_files([root], ["_top"]))
+    assert found == ["AxiVersion.py", os.path.join("surf", "AxiStream.py")]
+
+    found = sorted(os.path.relpath(path, root) for path in find_rogue_files([root], [], include_patterns=["surf/*"],
+                                                                            ignored_directories=()))
+    assert found == [os.path.join("surf", "AxiStream.py"), os.path.join("surf", "build", "Generated.py")]
+
+    found = [os.path.relpath(path, root) for path in find_rogue_files([root], [], include_patterns=["surf/*"],
+                                                                      exclude_patterns=["*/build/*"],
+                                                                      ignored_directories=())]
+    assert found == [os.path.join("surf", "AxiStream.py")]
+
+    # With a manifest, only the listed paths are considered
+    found = [os.path.relpath(path, root) for path in find_rogue_files([root], [],
+                                                                      manifest_paths=["_top.py", "missing.py"])]
+    assert found == ["_top.py"]
+
+    # The exclusions can be names, glob patterns, paths or regular expressions
+    def find_excluded(exclusion_list):
+        selected = set(find_rogue_files([root], exclusion_list))
+        return sorted(os.path.relpath(path, root) for path in find_rogue_files([root], []) if path not in selected)
+
+    assert find_excluded(["AxiVersion"]) == ["AxiVersion.py"]
+    assert find_excluded(["Axi*"]) == ["AxiVersion.py", os.path.join("surf", "AxiStream.py")]
+    assert find_excluded(["surf/AxiStream.py"]) == [os.path.join("surf", "AxiStream.py")]
+    assert find_excluded([os.path.join(root, "surf", "AxiStream")]) == [os.path.join("surf", "AxiStream.py")]
+    assert find_excluded(["re:^surf/.*Stream$"]) == [os.path.join("surf", "AxiStream.py")]
+    assert find_excluded(["re:^_"]) == ["_top.py"]
+
+
+def test_collect_duplicate_files(tmpdir, monkeypatch):
+    tmpdir.join("repo", "AxiVersion.py").write("class AxiVersion: pass\n", ensure=True)
+    tmpdir.join("vendored", "surf", "AxiVersion.py").write("class AxiVersion: pass\n", ensure=True)
+    tmpdir.join("other", "AxiVersion.py").write("class AxiVersion: size = 4\n", ensure=True)
+    monkeypatch.chdir(tmpdir)
+
+    duplicate_files = OrderedDict()
+    roots = [str(tmpdir.join(root)) for root in ("repo", "vendored", "other")]
+    assert list(_collect_rogue_files(roots, [], scan_thread_count=1, duplicate_files=duplicate_files)) == \
+        ["AxiVersion.py"]
+
+    # Only the first file is staged, the identical copy is converted with it, and the different one is reported
+    assert tmpdir.join("input", "AxiVersion.py").read() == "class AxiVersion: pass\n"
+    verdicts = {os.path.relpath(path, str(tmpdir)): message.split()[0] for path, message in duplicate_files.items()}
+    assert verdicts == {os.path.join("vendored", "surf", "AxiVersion.py"): "Identical",
+                        os.path.join("other", "AxiVersion.py"): "Differs"}
+
+    # The same file is collected by every concurrent scan, the first by the order of the input directories
+    for _ in range(5):
+        duplicate_files = OrderedDict()
+        assert list(_collect_rogue_files(roots[::-1], [], scan_thread_count=4, duplicate_files=duplicate_files)) == \
+            ["AxiVersion.py"]
+        assert tmpdir.join("input", "AxiVersion.py").read() == tmpdir.join("other", "AxiVersion.py").read()
+
+    # A quarantined file keeps the other files of the same name from being collected, and stays quarantined
+    quarantine = Quarantine(str(tmpdir.join("quarantine.json")))
+    quarantine.add("AxiVersion.py", str(tmpdir.join("repo", "AxiVersion.py")), "Timed out")
+    failure_files = OrderedDict()
+    duplicate_files = OrderedDict()
+    assert not list(_collect_rogue_files(roots, [], scan_thread_count=1, quarantine=quarantine,
+                                         failure_files=failure_files, duplicate_files=duplicate_files))
+    assert list(failure_files) == ["AxiVersion"] and len(duplicate_files) == 2
+    assert quarantine.check("AxiVersion.py", str(tmpdir.join("repo", "AxiVersion.py")))
+
+
+def test_compare_converted_files(tmpdir):
+    results_dir = os.path.join("tests", "results")
+    assert not compare_files(os.path.join(results_dir, "AppTop.yaml"), os.path.join(results_dir, "AppTop.yaml"))
+
+    # Reordering the registers is not a difference, but changing their attributes is
+    with open(os.path.join(results_dir, "_AxiVersion.yaml")) as yaml_file:
+        contents = yaml_file.read()
+    sections = contents.split("    " + "#" * 80 + "\n")
+    sections[1], sections[2] = sections[2], sections[1].replace("mode: RO", "mode: RW")
+    tmpdir.join("_AxiVersion.yaml").write(("    " + "#" * 80 + "\n").join(sections))
+
+    diff = compare_files(os.path.join(results_dir, "_AxiVersion.yaml"), str(tmpdir.join("_AxiVersion.yaml")))
+    assert not diff.added and not diff.removed
+    assert list(diff.changed.keys()) == ["FpgaVersion"]
+    assert diff.changed["FpgaVersion"]["mode"] == ("RO", "RW")
+
+    added_files, removed_files, changed_files = compare_directories(results_dir, str(tmpdir), worker_count=2)
+    assert added_files == []
+    assert removed_files == ["AppTop.yaml", "_AmcCryoDemoCore.yaml"]
+    assert list(changed_files.keys()) == ["_AxiVersion.yaml"]
+
+
+def test_json_sidecar_register_map(tmpdir):
+    device_model = {"AxiVersion": {"class": "MMIODev", "size": 8, "children": {
+        "ScratchPad": {"at": {"offset": 4, "byteOrder": "BE"}, "class": "IntField", "sizeBits": 32, "mode": "RW"},
+        "AxiStream": {"class": "MMIODev", "size": 8, "at": {"offset": 0x1000, "nelms": 2}, "children": {
+            "Enable": {"at": {"offset": 0}, "class": "IntField", "sizeBits": 1, "mode": "RW"}}}}}}
+    tmpdir.join("AxiVersion.json").write(dump_sidecar(device_model, "json"))
+
+    register_map = load_register_map(str(tmpdir.join("AxiVersion.json")))
+    assert list(register_map.keys()) == ["ScratchPad", "AxiStream", "AxiStream.Enable"]
+    assert register_map["AxiStream"]["kind"] == "device"
+    assert register_map["AxiStream"]["nelms"] == 2
+    assert register_map["AxiStream.Enable"]["kind"] == "register"
+
+
+def test_address_map():
+    device_model = {"AppTop": {"size": 8, "children": {
+        "Enable": {"at": {"offset": 0x10}, "class": "IntField", "sizeBits": 1, "lsBit": 3, "mode": "RW"},
+        "Reset": {"at": {"offset": 0x10}, "class": "IntField", "sizeBits": 1, "mode": "WO"},
+        "Start": {"at": {"offset": 0}, "class": "SequenceCommand"},
+        "Core": {"size": 8, "at": {"offset": 0x20000000, "nelms": 2, "stride": 0x1000}, "children": {
+            "Data": {"at": {"offset": 0x100, "nelms": 3, "stride": 8}, "class": "IntField", "sizeBits": 32,
+                     "mode": "RO"}}}}}}
+
+    entries = build_address_map(device_model)
+    assert [(hex(entry.address), entry.path) for entry in entries] == [
+        ("0x10", "Enable"), ("0x10", "Reset"),
+        ("0x20000100", "Core[0].Data[0]"), ("0x20000108", "Core[0].Data[1]"), ("0x20000110", "Core[0].Data[2]"),
+        ("0x20001100", "Core[1].Data[0]"), ("0x20001108", "Core[1].Data[1]"), ("0x20001110", "Core[1].Data[2]")]
+
+    address_map = AddressMap(render_binary(entries))
+    assert len(address_map) == len(entries)
+    assert [entry.path for entry in address_map.lookup(0x20001102)] == ["Core[1].Data[0]"]
+    assert [entry.path for entry in address_map.lookup(0x10)] == ["Enable", "Reset"]
+    assert address_map.lookup(0x20001102)[0].mode == "RO"
+    assert address_map.lookup(0x20001104) == []
+    assert address_map.lookup(0x4) == []
+
+
+def test_register_index(tmpdir):
+    device_model = {"AppTop": {"size": 8, "children": {
+        "SoftReset": {"at": {"offset": 0x10}, "class": "IntField", "sizeBits": 1, "mode": "WO"},
+        "Start": {"at": {"offset": 0x14}, "class": "SequenceCommand"},
+        "Core": {"size": 8, "at": {"offset": 0x20000000, "nelms": 2, "stride": 0x1000}, "children": {
+            "Data": {"at": {"offset": 0x100, "nelms": 2, "stride": 4}, "class": "IntField", "sizeBits": 32,
+                     "mode": "RO"},
+            "CoreReset": {"at": {"offset": 0x200}, "class": "IntField", "sizeBits": 8, "lsBit": 8, "mode": "RW"}}}}}}
+
+    with RegisterIndex(str(tmpdir.join("registers.db"))) as index:
+        index.update("AppTop", device_model)
+        index.update("Other", {"Other": {"children": {
+            "Data": {"at": {"offset": 0x104}, "class": "IntField", "sizeBits": 32, "mode": "RO"}}}})
+
+        assert [(node["filename"], node["path"]) for node in index.find_by_address(0x20000106)] == \
+            [("AppTop", "Core[0].Data[1]")]
+        assert [(node["filename"], node["path"]) for node in index.find_by_address(0x104)] == [("Other", "Data")]
+        assert [node["path"] for node in index.find_by_address(0x20001201)] == ["Core[1].CoreReset"]
+        assert index.find_by_address(0x20001202) == []
+        assert [node["kind"] for node in index.find_by_address(0x14)] == ["command"]
+
+        assert [node["path"] for node in index.find_by_name("*Reset*")] == \
+            ["SoftReset", "Core[0].CoreReset", "Core[1].CoreReset"]
+        assert [node["path"] for node in index.find_by_name("Core*", kind="device")] == ["Core[0]", "Core[1]"]
+        assert [node["name"] for node in index.get_children("AppTop", "Core[1]")] == ["Data[0]", "Data[1]",
+                                                                                     "CoreReset"]
+
+        # Reconverting a file replaces its entries only
+        del device_model["AppTop"]["children"]["SoftReset"]
+        index.update("AppTop", device_model)
+        assert [node["path"] for node in index.find_by_name("*Reset*")] == ["Core[0].CoreReset", "Core[1].CoreReset"]
+        assert index.get_filenames() == ["AppTop", "Other"]
+
+
+def test_dependency_manifest(tmpdir):
+    base_file = tmpdir.join("_Base.py")
+    base_file.write("class Base: pass\n")
+    top_file = tmpdir.join("Top.py")
+    top_file.write("from _Base import Base\n")
+    manifest_filename = str(tmpdir.join("dependencies.json"))
+
+    manifest = DependencyManifest(manifest_filename)
+    manifest.record("_Base.yaml", [str(base_file)])
+    manifest.record("Top.yaml", [str(top_file), str(base_file)])
+    manifest.save()
+
+    manifest = DependencyManifest(manifest_filename)
+    assert manifest.get_changed_dependencies("Other.yaml") is None
+    assert manifest.get_changed_dependencies("Top.yaml") == []
+
+    # Touching a file without changing it does not invalidate its dependents
+    os.utime(str(base_file), (0, 0))
+    assert manifest.get_changed_dependencies("Top.yaml") == []
+
+    base_file.write("class Base: x = 1\n")
+    assert manifest.get_changed_dependencies("_Base.yaml") == [str(base_file)]
+    assert manifest.get_changed_dependencies("Top.yaml") == [str(base_file)]
+
+    top_file.remove()
+    assert manifest.get_changed_dependencies("Top.yaml") == sorted([str(top_file), str(base_file)])
+
+
+def test_cost_model_scheduler(tmpdir):
+    history_filename = str(tmpdir.join("history.json"))
+    history = ConversionHistory(history_filename)
+    history.record("AppTop.py", 60.0, 3000.0)
+    history.record("AmcCarrier.py", 30.0, 2000.0)
+    history.record("AxiVersion.py", 1.0, 100.0)
+    history.record("AxiVersion.py", 3.0, 100.0)
+    history.save()
+
+    history = ConversionHistory(history_filename)
+    assert history.estimate("AxiVersion.py") == (2.0, 100.0)
+    # The files never converted before get the median estimates
+    assert history.estimate("New.py") == (30.0, 2000.0)
+
+    sizes = {"AppTop.py": 10, "AmcCarrier.py": 10, "AxiVersion.py": 10, "New.py": 20, "Small.py": 1}
+    scheduler = CostModelScheduler([(filename,) for filename in sorted(sizes)], history, memory_budget=4000,
+                                   get_size=lambda task: sizes[task[0]])
+
+    # Longest first, then the files that fit within the memory budget
+    assert scheduler.pop() == ("AppTop.py",)
+    assert scheduler.pop() == ("AxiVersion.py",)
+    assert scheduler.pop() is None
+    scheduler.task_done(("AppTop.py",), 50.0, 2500.0)
+    assert scheduler.pop() == ("New.py",)
+    assert scheduler.pop() is None
+    scheduler.task_done(("New.py",), 20.0, 1000.0)
+    scheduler.task_done(("AxiVersion.py",), 2.0, 100.0)
+    assert scheduler.pop() == ("AmcCarrier.py",)
+    assert scheduler.pop() == ("Small.py",)
+    assert scheduler.exhausted
+    assert scheduler.get_ideal_makespan(2) == 50.0
+    assert history.estimate("AppTop.py") == (55.0, 2750.0)
+
+    # With a lookahead, the tasks are taken as they come, the longest of the next ones first
+    taken = []
+
+    def get_tasks():
+        for filename in ["AxiVersion.py", "AppTop.py", "AmcCarrier.py"]:
+            taken.append(filename)
+            yield (filename,)
+
+    scheduler = CostModelScheduler(get_tasks(), history, lookahead=2, get_size=lambda task: sizes[task[0]])
+    assert taken == ["AxiVersion.py", "AppTop.py"]
+    assert scheduler.pop() == ("AppTop.py",)
+    assert [scheduler.pop(), scheduler.pop()] == [("AmcCarrier.py",), ("AxiVersion.py",)]
+    assert scheduler.exhausted
+
+
+def test_quarantine(tmpdir):
+    source = tmpdir.join("AppTop.py")
+    source.write("class AppTop: pass\n")
+    quarantine_filename = str(tmpdir.join("quarantine.json"))
+
+    quarantine = Quarantine(quarantine_filename)
+    assert quarantine.check("AppTop.py", str(source)) is None
+    quarantine.add("AppTop.py", str(source), "Timed out after 60s")
+    quarantine.save()
+
+    # The record survives the run while the source is unchanged
+    record = Quarantine(quarantine_filename).check("AppTop.py", str(source))
+    assert record["reason"] == "Timed out after 60s"
+
+    # A changed source is released, which is saved
+    source.write("class AppTop: size = 4\n")
+    quarantine = Quarantine(quarantine_filename)
+    assert quarantine.check("AppTop.py", str(source)) is None
+    quarantine.save()
+    source.write("class AppTop: pass\n")
+    assert Quarantine(quarantine_filename).check("AppTop.py", str(source)) is None
+
+
+def test_run_journal(tmpdir):
+    journal_filename = str(tmpdir.join("journal.jsonl"))
+    journal = RunJournal(journal_filename)
+    assert journal.load_last_batch() == (None, {})
+
+    journal.start("new")
+    journal.record("Old.py", SUCCEEDED)
+    journal.finish()
+
+    # A killed run, whose last record has been cut short
+    journal.start("new")
+    journal.record("AxiVersion.py", SUCCEEDED)
+    journal.record("AppTop.py", FAILED, "Timeout")
+    with open(journal_filename, 'a') as journal_file:
+        journal_file.write('{"event": "outcome", "file": "Amc')
+
+    batch, outcomes = RunJournal(journal_filename).load_last_batch()
+    assert list(outcomes.items()) == [("AxiVersion.py", (SUCCEEDED, '')), ("AppTop.py", (FAILED, "Timeout"))]
+
+    # The resumed run continues the batch, and its outcomes supersede the previous ones
+    journal = RunJournal(journal_filename)
+    journal.start("retry-failed", batch=batch)
+    journal.record("AppTop.py", SUCCEEDED)
+    journal.finish()
+
+    assert RunJournal(journal_filename).load_last_batch() == (batch, {"AxiVersion.py": (SUCCEEDED, ''),
+                                                                      "AppTop.py": (SUCCEEDED, '')})
+
+
+@pytest.mark.parametrize("filename, source, verdict", [
+    ("_Device.py", "import os\nclass Device:\n    def __init__(self, name='Device'):\n        pass\n", SAFE),
+    ("_Device.py", "class Device(\n", BROKEN),
+    ("_Device.py", "import no_such_module\nclass Device:\n    pass\n", BROKEN),
+    ("_Device.py", "try:\n    import no_such_module\nexcept ImportError:\n    pass\nclass Device:\n    pass\n", SAFE),
+    ("_Device.py", "import os\nclass Other:\n    pass\n", BROKEN),
+    ("_Device.py",
+     "import pyrogue.protocols\nclass DEVICE:\n    def __init__(self):\n        pyrogue.protocols.UdpRssiPack()\n",
+     NEEDS_STUB),
+    ("_Device.py", "class Device:\n    def __init__(self, dev='/dev/datadev_0'):\n        pass\n", NEEDS_STUB),
+    # Only one leading underscore is stripped from the name of the class, as by the conversion
+    ("__Device.py", "class _Device:\n    pass\n", SAFE),
+    ("__Device.py", "class Device:\n    pass\n", BROKEN),
+    # The class may be bound by a star import, or by an alias
+    ("_Device.py", "from os.path import *\n", SAFE),
+    ("_Device.py", "class _DeviceImpl:\n    pass\nDevice = _DeviceImpl\n", SAFE),
+    ("_Device.py", "class _DeviceImpl:\n    pass\nOther = _DeviceImpl\n", BROKEN),
+])
+def test_classify_file(tmpdir, filename, source, verdict):
+    rogue_file = tmpdir.join(filename)
+    rogue_file.write(source)
+
+    result = classify_file(str(rogue_file))
+    assert result.filename == filename
+    assert result.verdict == verdict
+    assert bool(result.reason) == (verdict != SAFE)
+
+
+@pytest.mark.parametrize("worker_count", [0, 2])
+def test_preflight_files(tmpdir, worker_count):
+    paths = []
+    for name, source in [("Safe.py", "class Safe:\n    pass\n"), ("Broken.py", "class Broken(\n")]:
+        tmpdir.join(name).write(source)
+        paths.append(str(tmpdir.join(name)))
+
+    results = list(preflight_files(iter(paths), worker_count=worker_count))
+    assert [(result.filename, result.verdict) for result in results] == [("Safe.py", SAFE), ("Broken.py", BROKEN)]
+
+
+def test_bytecode_cache(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir.join("cache"))
+    staging_dir = tmpdir.mkdir("input")
+    staging_dir.join("CachedDevice.py").write("VALUE = 1\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    for name in [name for name in sys.modules if name == "input" or name.startswith("input.")]:
+        monkeypatch.delitem(sys.modules, name)
+
+    install_bytecode_cache(cache_dir)
+    install_bytecode_cache(cache_dir)
+    assert locate("input.CachedDevice.VALUE") == 1
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Staging the same contents again hits the cache, whatever the timestamps
+    staging_dir.join("CachedDevice.py").write("VALUE = 1\n")
+    del sys.modules["input.CachedDevice"]
+    assert locate("input.CachedDevice.VALUE") == 1
+    assert len(os.listdir(cache_dir)) == 1
+
+    staging_dir.join("CachedDevice.py").write("VALUE = 2\n")
+    del sys.modules["input.CachedDevice"]
+    assert locate("input.CachedDevice.VALUE") == 2
+    assert len(os.listdir(cache_dir)) == 2
+    assert not staging_dir.join("__pycache__").check()
+
+    assert prune_bytecode_cache(cache_dir) == 0
+    assert prune_bytecode_cache(cache_dir, max_age_days=-1) == 2
+    del sys.modules["input.CachedDevice"]
+    del sys.modules["input"]
+
+
+def test_log_context():
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger().addHandler(handler)
+    try:
+        with log_context("AxiVersion.py"):
+            logging.getLogger(__name__).warning("Converting...")
+        logging.getLogger(__name__).warning("Done.")
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    assert [record.rogue_file for record in records] == ["AxiVersion.py", '-']
+
+
+def test_sharding(tmpdir):
+    assert parse_shard("2/4") == (2, 4)
+    for shard_spec in ("0/4", "5/4", "2", "a/b"):
+        with pytest.raises(ValueError):
+            parse_shard(shard_spec)
+
+    # Every file is in exactly one shard, whatever the order of discovery
+    paths = ["surf/File{0}.py".format(i) for i in range(50)]
+    shards = [list(select_shard(paths, shard_index, 3)) for shard_index in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == sorted(paths)
+    assert list(select_shard(reversed(paths), 2, 3)) == list(reversed(shards[1]))
+
+    history = ConversionHistory(str(tmpdir.join("history.json")))
+    for filename, duration in (("A.py", 8.0), ("B.py", 5.0), ("C.py", 4.0), ("D.py", 3.0)):
+        history.record(filename, duration, None)
+    assert get_balanced_shards(["D.py", "C.py", "B.py", "A.py"], 2, history) == {"A.py": 1, "B.py": 2, "C.py": 2,
+                                                                                "D.py": 1}
+
+    exclusions = {"TopLevel": "Excluded"}
+    write_report(str(tmpdir.join("1.json")), ["AxiVersion"], dict(exclusions, AppTop="Timeout"), shard=(1, 2))
+    write_report(str(tmpdir.join("2.json")), ["AmcCore"], exclusions, shard=(2, 2))
+    success_files, failure_files, problems = merge_reports([str(tmpdir.join("1.json")), str(tmpdir.join("2.json"))])
+    assert success_files == ["AmcCore", "AxiVersion"]
+    assert failure_files == {"TopLevel": "Excluded", "AppTop": "Timeout"}
+    assert problems == []
+
+    assert merge_reports([str(tmpdir.join("2.json"))])[2] == ["The reports of the shards 1 of 2 are missing."]
+
+
+def _run_fake_remote_worker(address, authkey, crash):
+    # Stands in for a worker launcher on another node, echoing the staged files as their conversions
+    connection = Client(address, authkey=authkey)
+    connection.send(("hello", "node-{0}".format(os.getpid()), "/nonexistent/input"))
+    while True:
+        message = connection.recv()
+        if message[0] != "task":
+            break
+        if crash:
+            os._exit(1)
+        _, filename, source, options = message
+        connection.send(("result", ConversionResult(filename[:-3], True, contents=source.decode()), 0.1, None))
+
+
+def test_coordinator(tmpdir, monkeypatch):
+    assert parse_address("buildhost:5000") == ("buildhost", 5000)
+    assert parse_address("/tmp/rogue2yaml.sock") == "/tmp/rogue2yaml.sock"
+
+    monkeypatch.chdir(tmpdir)
+    tmpdir.mkdir("input")
+    tasks = []
+    for i in range(6):
+        tmpdir.join("input", "Device{0}.py".format(i)).write("# {0}".format(i))
+        tasks.append(("Device{0}.py".format(i), None))
+
+    context = multiprocessing.get_context("fork")
+    with Coordinator(("127.0.0.1", 0), b"secret") as coordinator:
+        # The first node is lost with the first task it takes, which is then converted by another node
+        lost_node = context.Process(target=_run_fake_remote_worker, args=(coordinator.address, b"secret", True))
+        nodes = [context.Process(target=_run_fake_remote_worker, args=(coordinator.address, b"secret", False))
+                 for _ in range(2)]
+
+        def start_nodes():
+            lost_node.join()
+            for node in nodes:
+                node.start()
+
+        lost_node.start()
+        threading.Thread(target=start_nodes).start()
+        outcomes = list(coordinator.imap_unordered(tasks))
+
+    for node in nodes:
+        node.join(10)
+    assert lost_node.exitcode == 1
+    assert sorted(task for task, _, _ in outcomes) == sorted(tasks)
+    assert all(result.succeeded and not error for _, result, error in outcomes)
+    assert sorted(result.contents for _, result, _ in outcomes) == ["# {0}".format(i) for i in range(6)]
+    assert [node.exitcode for node in nodes] == [0, 0]
+
+
+def test_conversion_daemon(tmpdir):
+    service = ConversionService(exclusions={"TopLevel": "Connects to the hardware.", "legacy/*": "Obsolete."},
+                                max_concurrent_requests=1, output_root=str(tmpdir.join("output")),
+                                input_dirs=[str(tmpdir)])
+    with pytest.raises(ValueError):
+        create_server(("0.0.0.0", 0), service, authkey=b"secret")
+    with pytest.raises(ValueError):
+        create_server(("127.0.0.1", 0), service)
+
+    server = create_server(("127.0.0.1", 0), service, authkey=b"secret")
+    threading.Thread(target=server.serve_forever).start()
+    url = "http://127.0.0.1:{0}".format(server.server_address[1])
+
+    def request(path, data=None, token="secret", content_type="application/json"):
+        headers = {"Content-Type": content_type}
+        if token:
+            headers["Authorization"] = "Bearer " + token
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url + path, data=data, headers=headers),
+                                              timeout=10)
+        except urllib.error.HTTPError as error:
+            response = error
+        return response.getcode(), response.read().decode("utf-8")
+
+    def convert(request_body, **kwargs):
+        return request("/convert", json.dumps(request_body).encode("utf-8"), **kwargs)
+
+    try:
+        status, body = request("/health")
+        assert status == 200 and json.loads(body)["status"] == "ok"
+        assert request("/health", token=None)[0] == 401
+        assert request("/health", token="guess")[0] == 401
+
+        # The requests are checked before any conversion, which would start the worker
+        top_level = tmpdir.join("TopLevel.py")
+        top_level.write("# TopLevel")
+        assert convert({"path": str(top_level)}, token=None)[0] == 401
+        assert convert({"path": str(top_level)}, content_type="text/plain")[0] == 415
+        status, body = convert({"path": str(top_level)})
+        assert status == 422 and json.loads(body)["message"] == "Connects to the hardware."
+        legacy_device = tmpdir.mkdir("legacy").join("Device.py")
+        legacy_device.write("# Device")
+        status, body = convert({"path": str(legacy_device)})
+        assert status == 422 and json.loads(body)["message"] == "Obsolete."
+        status, _ = convert({"path": str(tmpdir.join("Missing.py"))})
+        assert status == 404
+        status, _ = request("/convert", b"{")
+        assert status == 400
+        status, _ = convert({"module": "surf.axi", "class": "AxiVersion", "sidecar": ["json"]})
+        assert status == 400
+        for output in ["../outside/", str(tmpdir.join("outside.yaml"))]:
+            status, _ = convert({"module": "surf.axi", "class": "AxiVersion", "output": output})
+            assert status == 403
+
+        status, body = request("/metrics")
+        assert status == 200
+        assert "rogue2yaml_requests_total 6" in body
+        assert "rogue2yaml_conversions_failed_total 2" in body
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def test_async_converter(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(rogue2yaml_launcher.async_conversion, "_convert_request",
+                        lambda filename, options, module_name=None:
+                        ConversionResult(filename[:-3], True, contents=tmpdir.join("input", filename).read()))
+    paths = []
+    for i in range(5):
+        tmpdir.join("Device{0}.py".format(i)).write("# {0}".format(i))
+        paths.append(str(tmpdir.join("Device{0}.py".format(i))))
+
+    async def convert():
+        async with AsyncConverter(processes=False, preflight=False) as converter:
+            results = [result async for result in converter.convert_many(paths, output_dir="output")]
+            # Stopping the iteration early cancels the remaining conversions
+            async for result in converter.convert_many(paths):
+                break
+            return results
+
+    results = asyncio.run(convert())
+    assert sorted(result.filename for result in results) == ["Device{0}".format(i) for i in range(5)]
+    assert all(result.succeeded for result in results)
+    assert tmpdir.join("output", "Device3.yaml").read() == "# 3"
+
+
+def test_async_converter_reload(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+    def convert_request(filename, options, module_name=None):
+        # Imported once, as by the workers
+        module_name = "input." + filename[:-3]
+        if module_name not in sys.modules:
+            sys.modules[module_name] = tmpdir.join("input", filename).read()
+        return ConversionResult(filename[:-3], True, contents=sys.modules[module_name])
+
+    monkeypatch.setattr(rogue2yaml_launcher.async_conversion, "_convert_request", convert_request)
+    path = tmpdir.join("Device.py")
+
+    async def convert():
+        async with AsyncConverter(processes=False, preflight=False) as converter:
+            contents = []
+            for version in ["# 1", "# 1", "# 2, edited"]:
+                path.write(version)
+                contents.append((await converter.convert_file(str(path))).contents)
+            return contents
+
+    try:
+        assert asyncio.run(convert()) == ["# 1", "# 1", "# 2, edited"]
+    finally:
+        sys.modules.pop("input.Device", None)
+
+
+def test_shared_outputs(tmpdir):
+    small_result = ConversionResult("Small", True, contents="small")
+    share_outputs(small_result, threshold=1024)
+    assert small_result.shared_outputs is None and small_result.contents == "small"
+
+    result = ConversionResult("Device", True, contents="Device:\n  size: 4\n" * 100,
+                              sidecars={"Device.addrmap.bin": b"\x00\x01" * 100})
+    share_outputs(result, threshold=1024)
+    assert result.contents is None and not result.sidecars
+    result = pickle.loads(pickle.dumps(result))
+
+    views = result.shared_outputs.open()
+    with WriteBehindWriter() as writer:
+        for name, view in views.items():
+            writer.submit(str(tmpdir.join(name or "Device.yaml")), view, on_written=result.shared_outputs.release)
+    assert tmpdir.join("Device.yaml").read() == "Device:\n  size: 4\n" * 100
+    assert tmpdir.join("Device.addrmap.bin").read_binary() == b"\x00\x01" * 100
+    # The segment is removed once all the outputs are written
+    with pytest.raises(OSError):
+        result.shared_outputs.open()
+
+
+_running_files = []
+
+
+def _convert_in_thread(filename, options):
+    with log_context(filename):
+        _running_files.append(filename)
+        try:
+            # A conversion stubbing the hardware modules runs alone
+            assert not options.stub_modules or _running_files == [filename]
+            threading.Event().wait(0.01)
+            logging.getLogger(__name__).warning(filename)
+            return filename
+        finally:
+            _running_files.remove(filename)
+
+
+def test_in_process_pool():
+    assert select_engine(ENGINE_THREADS) == ENGINE_THREADS
+    assert select_engine(ENGINE_PROCESSES) == ENGINE_PROCESSES
+
+    options = ConversionOptions()
+    tasks = [("File{0}.py".format(index), options.with_stub_modules(["rogue"]) if index % 3 == 0 else options)
+             for index in range(12)]
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger().addHandler(handler)
+    try:
+        with InProcessPool(_convert_in_thread, 4, ENGINE_THREADS) as pool:
+            outcomes = list(pool.imap_unordered(tasks))
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    assert all(error is None and result == task[0] for task, result, error in outcomes)
+    assert sorted(result for _, result, _ in outcomes) == sorted(task[0] for task in tasks)
+    # The records of each thread are tagged with the file it converts
+    assert len(records) == len(tasks) and all(record.rogue_file == record.getMessage() for record in records)